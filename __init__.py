@@ -1,29 +0,0 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager
-from config import Config
-
-db = SQLAlchemy()
-login_manager = LoginManager()
-login_manager.login_view = 'login'
-
-def create_app():
-    app = Flask(__name__)
-    app.config.from_object(Config)
-
-    db.init_app(app)
-    login_manager.init_app(app)
-
-    from .models import Usuario
-    
-    @login_manager.user_loader
-    def load_user(user_id):
-        return Usuario.query.get(int(user_id))
-
-    from .routes import main
-    app.register_blueprint(main)
-
-    with app.app_context():
-        db.create_all()
-
-    return app
\ No newline at end of file
@@ -13,21 +13,41 @@ else:
 
 from datetime import datetime, time, timedelta
 from contextlib import contextmanager
-import os, secrets
+import io, itertools, os, secrets
+import time as time_mod
+import hashlib
+from functools import wraps
 
-from flask import Flask, render_template, request, redirect, url_for, flash, abort
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, session, g, make_response, Response, jsonify, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func
-
-from database import SessionLocal, init_db
-from models import Usuario, Medico, Cita, TipoUsuario, EstadoCita, Expediente
-from utils import has_overlap
+from sqlalchemy import func, or_, select, update
+
+from database import HAS_REPLICA, SessionLocal, init_db, set_replica_reads, start_replica_sync, engine, primary_read_engine, read_engine
+from models import Usuario, Medico, Cita, CitaArchivada, TipoUsuario, EstadoCita, Expediente, CITA_ACTIVA
+from utils import has_overlap, keyset_page, recurring_series, series_conflicts, bulk_insert_citas, SERIES_MAX
+from cache import user_cache, fetch_user, doctor_directory
+from roster import roster_for
+from templating import init_templates, template_fingerprint
+from assets import init_assets
+from metrics import init_metrics, query_budget, allowed as metrics_allowed, render as render_metrics
+from capture import init_capture
+from availability import find_slots, AVAILABILITY_MAX_DAYS
+from importer import import_csv, write_report, COLUMNAS as IMPORT_COLUMNAS, IMPORT_REQUEST_WORKERS
+from search import search as search_pacientes, typeahead, CAMPOS as SEARCH_CAMPOS, SEARCH_LIMIT, TYPEAHEAD_LIMIT, TYPEAHEAD_MAX
+from passwords import hash_password, verify_password, HashingSaturado, RETRY_AFTER_SECONDS
+from export import FORMATOS as EXPORT_FORMATOS, stream as export_stream, citas_query as citas_export_query, pacientes_query as pacientes_export_query
+
+DASHBOARD_CITAS = 8  # el resumen del dashboard muestra a lo más 8 citas
 
 # ----------------- APP & LOGIN -----------------
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", secrets.token_hex(32))
+init_templates(app)
+assets = init_assets(app)
+# primary_read_engine suele ser read_engine o engine: init_metrics cuenta cada engine una vez
+init_metrics(app, {"writer": engine, "reader": read_engine, "primary": primary_read_engine})
+init_capture(app)
 
 init_db()
 
@@ -36,8 +56,10 @@ login_manager.login_view = "login"  # endpoint al que redirige si no estás aute
 login_manager.init_app(app)
 
 @contextmanager
-def get_db():
+def get_db(readonly=False):
+    """Sesión transaccional; readonly=True permite leer del motor de lectura (pool o réplica)."""
     db = SessionLocal()
+    db.info["readonly"] = readonly
     try:
         yield db
         db.commit()
@@ -47,10 +69,38 @@ def get_db():
     finally:
         db.close()
 
+# Lecturas de réplica solo en GET/HEAD y fuera de la ventana read-your-writes:
+# tras escribir, el usuario lee del primario unos segundos para ver su cambio.
+# Sin réplica aparte no hace falta: el pool de lectores ya ve lo confirmado.
+READ_YOUR_WRITES_SECONDS = float(os.environ.get("READ_YOUR_WRITES_SECONDS", 5))
+
+if os.environ.get("REPLICA_SYNC_SECONDS"):
+    start_replica_sync(float(os.environ["REPLICA_SYNC_SECONDS"]))
+
+
+@app.before_request
+def _route_reads():
+    if not HAS_REPLICA:
+        return
+    lectura = request.method in ("GET", "HEAD")
+    set_replica_reads(lectura and session.get("rw_until", 0) < time_mod.time())
+
+
+@app.after_request
+def _mark_write(response):
+    if HAS_REPLICA and request.method not in ("GET", "HEAD") and response.status_code < 400:
+        session["rw_until"] = time_mod.time() + READ_YOUR_WRITES_SECONDS
+    return response
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    with get_db() as db:
-        return db.get(Usuario, int(user_id))
+    # Caché primero: en la mayoría de las peticiones no se abre sesión de BD aquí
+    user = user_cache.get(int(user_id))
+    if user is None:
+        with get_db(readonly=True) as db:
+            user = fetch_user(db, int(user_id))
+    return user
 
 
 # ----------------- HELPERS -----------------
@@ -63,62 +113,182 @@ def saludo_actual():
     return "Buenas noches"
 
 
+def medico_actual():
+    """Medico (con su usuario) del usuario actual, resuelto una sola vez por petición."""
+    if "medico_actual" not in g:
+        medico = None
+        if current_user.tipo == TipoUsuario.MEDICO and current_user.medico_id:
+            with get_db(readonly=True) as db:
+                medico = (
+                    db.query(Medico)
+                    .options(joinedload(Medico.usuario))
+                    .filter(Medico.id == current_user.medico_id)
+                    .first()
+                )
+        g.medico_actual = medico
+    return g.medico_actual
+
+
+def medico_required(view):
+    """Solo médicos con registro en medicos; inyecta medico_id (viene del user loader, sin consulta)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_user.tipo != TipoUsuario.MEDICO:
+            abort(403)
+        if not current_user.medico_id:
+            flash("No hay registro de médico asociado a tu usuario.", "warning")
+            return redirect(url_for("dashboard"))
+        return view(*args, medico_id=current_user.medico_id, **kwargs)
+    return wrapper
+
+
+def _filtros_visibles(modelo=Cita):
+    """Filtros de las citas que el usuario actual puede ver (ninguno para admin)."""
+    if current_user.tipo == TipoUsuario.MEDICO and current_user.medico_id:
+        return [modelo.medico_id == current_user.medico_id]
+    elif current_user.tipo == TipoUsuario.PACIENTE:
+        return [modelo.paciente_id == current_user.id]
+    return []
+
+
+# Las vistas de historial leen citas y citas_archivo (archive.py): las funciones
+# reciben el modelo y keyset_page mezcla las páginas de los dos con archivo=.
+def _citas_visibles(db, modelo=Cita):
+    """Citas que el usuario actual puede ver (sin ordenar ni paginar)."""
+    return (
+        db.query(modelo)
+        .options(
+            joinedload(modelo.medico).joinedload(Medico.usuario),
+            joinedload(modelo.paciente),
+        )
+        .filter(*_filtros_visibles(modelo))
+    )
+
+
+def _citas_concluidas(db, medico_id, modelo=Cita):
+    """Citas atendidas o canceladas del médico (sin ordenar ni paginar)."""
+    return (
+        db.query(modelo)
+        .options(
+            joinedload(modelo.paciente),
+            joinedload(modelo.medico).joinedload(Medico.usuario),
+        )
+        .filter(
+            modelo.medico_id == medico_id,
+            modelo.estado.in_([EstadoCita.ATENDIDA, EstadoCita.CANCELADA]),
+        )
+    )
+
+
+# ----------------- RESPUESTAS CONDICIONALES -----------------
+# Antes de cargar objetos, las vistas de listas y registros calculan una versión
+# barata de lo que van a mostrar; si coincide con el ETag del navegador
+# contestan 304 sin consultar el resto ni renderizar. Un despliegue que cambie
+# plantillas o assets cambia _VERSION_DESPLIEGUE e invalida todos los ETag.
+_VERSION_DESPLIEGUE = (template_fingerprint(os.path.join(app.root_path, app.template_folder)), assets.version)
+
+
+def _version_citas(db, *filtros):
+    """
+    (conteo, max updated_at) de las citas del ámbito. El máximo cambia con cada
+    alta o edición; el conteo, cuando una cita sale del ámbito (otro médico, otro
+    estado o ya pasó). Sin filtros (admin) nada sale del ámbito: basta el máximo.
+    citas_archivo no entra: sus filas no cambian, y moverlas allí no cambia lo
+    que muestran las vistas que leen ambas tablas.
+    """
+    if not filtros:
+        return (db.query(func.max(Cita.updated_at)).scalar(),)
+    return tuple(db.query(func.count(Cita.id), func.max(Cita.updated_at)).filter(*filtros).one())
+
+
+def _version_personas(db, filtros, archivados=(), medico_id=None):
+    """
+    Último cambio a los usuarios y médicos detrás de las citas del ámbito: los
+    nombres y especialidades que aparecen en la página. filtros son los de
+    _version_citas; archivados, los mismos sobre CitaArchivada si la vista lee
+    también citas_archivo; medico_id, el médico que la página muestra aunque no
+    tenga citas. Así un registro o el rehash de un login solo invalida las
+    páginas donde aparece esa persona. Sin filtros (admin) el ámbito es toda
+    la base y basta el máximo global.
+    """
+    if not filtros:
+        return tuple(
+            db.query(
+                select(func.max(Usuario.updated_at)).scalar_subquery(),
+                select(func.max(Medico.updated_at)).scalar_subquery(),
+            ).one()
+        )
+    ambito = select(Cita.medico_id, Cita.paciente_id).where(*filtros)
+    if archivados:
+        ambito = ambito.union_all(select(CitaArchivada.medico_id, CitaArchivada.paciente_id).where(*archivados))
+    ambito = ambito.cte("ambito")
+    medicos = Medico.id.in_(select(ambito.c.medico_id))
+    if medico_id is not None:
+        medicos = or_(medicos, Medico.id == medico_id)
+    personas = or_(
+        Usuario.id.in_(select(ambito.c.paciente_id)),
+        Usuario.id.in_(select(Medico.usuario_id).where(medicos)),
+    )
+    return tuple(
+        db.query(
+            select(func.max(Usuario.updated_at)).where(personas).scalar_subquery(),
+            select(func.max(Medico.updated_at)).where(medicos).scalar_subquery(),
+        ).one()
+    )
+
+
+def _etag(*partes):
+    """(etag, última modificación) de la vista actual; (None, None) si hay mensajes flash pendientes."""
+    if session.get("_flashes"):
+        return None, None  # la página los consume al renderizar: no puede ser un 304
+    llave = repr((_VERSION_DESPLIEGUE, current_user.get_id(), request.full_path, partes))
+    valores = [v for p in partes for v in (p if isinstance(p, tuple) else (p,))]
+    fechas = [v for v in valores if isinstance(v, datetime)]
+    return hashlib.sha1(llave.encode("utf-8")).hexdigest(), max(fechas, default=None)
+
+
+def _validadores(respuesta, etag, ultima):
+    respuesta = make_response(respuesta)
+    if etag:
+        respuesta.set_etag(etag)
+        if ultima:
+            respuesta.last_modified = ultima
+        respuesta.cache_control.private = True
+        respuesta.cache_control.no_cache = True  # el navegador guarda la página, pero revalida siempre
+    return respuesta
+
+
+def _no_modificado(etag, ultima):
+    """Respuesta 304 si el navegador ya tiene esta versión; None si hay que renderizar."""
+    # Solo If-None-Match: Last-Modified no refleja citas que salen del ámbito
+    if etag and request.if_none_match.contains(etag):
+        return _validadores(Response(status=304), etag, ultima)
+    return None
+
+
 # ----------------- DASHBOARD -----------------
 @app.route("/")
 @login_required
+@query_budget(6)
 def dashboard():
     saludo = None
     doctor_nombre = None
     pacientes = []
     pending_counts = {}
 
-    with get_db() as db:
-        medico = None
-        if current_user.tipo == TipoUsuario.MEDICO:
-            medico = (
-                db.query(Medico)
-                .options(joinedload(Medico.usuario))
-                .filter(Medico.usuario_id == current_user.id)
-                .first()
-            )
-            if medico and medico.usuario:
-                saludo = saludo_actual()
-                doctor_nombre = f"Dr. {medico.usuario.nombre} {medico.usuario.apellido}"
-
-            if medico:
-                # Pacientes únicos que han tenido citas con este médico
-                pacientes = (
-                    db.query(Usuario)
-                    .join(Cita, Cita.paciente_id == Usuario.id)
-                    .filter(Cita.medico_id == medico.id)
-                    .distinct()
-                    .order_by(Usuario.apellido.asc(), Usuario.nombre.asc())
-                    .all()
-                )
-                # Conteo de citas pendientes por paciente
-                ahora = datetime.now()
-                rows = (
-                    db.query(Cita.paciente_id, func.count(Cita.id))
-                    .filter(
-                        Cita.medico_id == medico.id,
-                        Cita.start_at >= ahora,
-                        Cita.estado.in_([EstadoCita.PENDIENTE, EstadoCita.CONFIRMADA]),
-                    )
-                    .group_by(Cita.paciente_id)
-                    .all()
-                )
-                pending_counts = {pid: cnt for (pid, cnt) in rows}
+    with get_db(readonly=True) as db:
+        medico_id = current_user.medico_id if current_user.tipo == TipoUsuario.MEDICO else None
+        if medico_id:
+            saludo = saludo_actual()
+            doctor_nombre = f"Dr. {current_user.nombre} {current_user.apellido}"
+
+            # Pacientes del médico y sus citas pendientes, desde la tabla resumen
+            pacientes, pending_counts = roster_for(db, medico_id)
 
-        base_query = db.query(Cita).options(
-            joinedload(Cita.medico).joinedload(Medico.usuario),
-            joinedload(Cita.paciente),
+        # El resumen solo muestra las últimas citas: basta con la primera página
+        citas, _ = keyset_page(
+            _citas_visibles(db), None, limit=DASHBOARD_CITAS, archivo=_citas_visibles(db, CitaArchivada)
         )
-        if current_user.tipo == TipoUsuario.MEDICO and medico:
-            citas = base_query.filter(Cita.medico_id == medico.id).order_by(Cita.start_at.desc()).all()
-        elif current_user.tipo == TipoUsuario.PACIENTE:
-            citas = base_query.filter(Cita.paciente_id == current_user.id).order_by(Cita.start_at.desc()).all()
-        else:
-            citas = base_query.order_by(Cita.start_at.desc()).all()
 
     return render_template(
         "dashboard.html",
@@ -133,6 +303,14 @@ def dashboard():
 
 
 # ----------------- AUTH -----------------
+def _saturado(plantilla, **contexto):
+    """503 con Retry-After cuando el pool de hash de contraseñas está lleno (passwords.py)."""
+    flash("Hay demasiadas solicitudes en este momento. Intenta de nuevo en unos segundos.", "warning")
+    resp = make_response(render_template(plantilla, **contexto), 503)
+    resp.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return resp
+
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
@@ -143,6 +321,12 @@ def register():
         tipo = request.form.get("tipo", "PACIENTE")
         especialidad = request.form.get("especialidad", "").strip()
 
+        # Antes de abrir la transacción: el escritor no debe esperar al hash
+        try:
+            password_hash = hash_password(password)
+        except HashingSaturado:
+            return _saturado("register.html", TipoUsuario=TipoUsuario)
+
         with get_db() as db:
             if db.query(Usuario).filter_by(email=email).first():
                 flash("El correo ya está registrado", "warning")
@@ -152,7 +336,7 @@ def register():
                 nombre=nombre,
                 apellido=apellido,
                 email=email,
-                password_hash=generate_password_hash(password),
+                password_hash=password_hash,
                 tipo=TipoUsuario(tipo),
             )
             db.add(u)
@@ -176,15 +360,28 @@ def login():
         email = request.form["email"].strip().lower()
         password = request.form["password"]
 
-        with get_db() as db:
+        with get_db(readonly=True) as db:
             u = db.query(Usuario).filter_by(email=email).first()
-            if not u or not check_password_hash(u.password_hash, password):
-                flash("Credenciales inválidas", "danger")
-                return redirect(url_for("login"))
+        try:
+            valida, nuevo_hash = verify_password(u.password_hash, password) if u else (False, None)
+        except HashingSaturado:
+            return _saturado("login.html")
+        if not valida:
+            flash("Credenciales inválidas", "danger")
+            return redirect(url_for("login"))
+
+        if nuevo_hash:
+            # Hash con parámetros viejos: se reemplaza si nadie cambió la contraseña mientras tanto
+            with get_db() as db:
+                db.execute(
+                    update(Usuario)
+                    .where(Usuario.id == u.id, Usuario.password_hash == u.password_hash)
+                    .values(password_hash=nuevo_hash)
+                )
 
-            login_user(u)
-            next_url = request.args.get("next")
-            return redirect(next_url or url_for("dashboard"))
+        login_user(u)
+        next_url = request.args.get("next")
+        return redirect(next_url or url_for("dashboard"))
 
     return render_template("login.html")
 
@@ -199,26 +396,53 @@ def logout():
 # ----------------- CITAS -----------------
 @app.route("/citas")
 @login_required
+@query_budget(5)
 def citas_list():
-    with get_db() as db:
-        medico = None
-        if current_user.tipo == TipoUsuario.MEDICO:
-            medico = db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-
-        base_query = db.query(Cita).options(
-            joinedload(Cita.medico).joinedload(Medico.usuario),
-            joinedload(Cita.paciente),
+    with get_db(readonly=True) as db:
+        etag, ultima = _etag(
+            _version_citas(db, *_filtros_visibles()),
+            _version_personas(db, _filtros_visibles(), _filtros_visibles(CitaArchivada)),
+        )
+        no_modificado = _no_modificado(etag, ultima)
+        if no_modificado:
+            return no_modificado
+        citas, next_cursor = keyset_page(
+            _citas_visibles(db), request.args.get("cursor"), archivo=_citas_visibles(db, CitaArchivada)
         )
-        if current_user.tipo == TipoUsuario.MEDICO and medico:
-            citas = base_query.filter(Cita.medico_id == medico.id).order_by(Cita.start_at.desc()).all()
-        elif current_user.tipo == TipoUsuario.PACIENTE:
-            citas = base_query.filter(Cita.paciente_id == current_user.id).order_by(Cita.start_at.desc()).all()
+
+    html = render_template(
+        "appointments_list.html",
+        citas=citas,
+        EstadoCita=EstadoCita,
+        next_cursor=next_cursor,
+    )
+    return _validadores(html, etag, ultima)
+
+
+@app.route("/citas/fragmento")
+@login_required
+@query_budget(4)
+def citas_fragmento():
+    """Siguiente página de filas (scroll infinito) para el listado de citas o las concluidas."""
+    vista = request.args.get("vista", "citas")
+    if vista not in ("citas", "concluidas"):
+        abort(404)
+
+    if vista == "concluidas" and (current_user.tipo != TipoUsuario.MEDICO or not current_user.medico_id):
+        abort(403)
+
+    with get_db(readonly=True) as db:
+        if vista == "concluidas":
+            query = _citas_concluidas(db, current_user.medico_id)
+            archivo = _citas_concluidas(db, current_user.medico_id, CitaArchivada)
         else:
-            citas = base_query.order_by(Cita.start_at.desc()).all()
+            query = _citas_visibles(db)
+            archivo = _citas_visibles(db, CitaArchivada)
 
-        medicos = db.query(Medico).options(joinedload(Medico.usuario)).all()
+        citas, next_cursor = keyset_page(query, request.args.get("cursor"), archivo=archivo)
 
-    return render_template("appointments_list.html", citas=citas, medicos=medicos, EstadoCita=EstadoCita)
+    template = "_concluidas_rows.html" if vista == "concluidas" else "_citas_rows.html"
+    return render_template(template, citas=citas, EstadoCita=EstadoCita, next_cursor=next_cursor)
 
 
 @app.route("/citas/nueva", methods=["GET", "POST"])
@@ -227,8 +451,7 @@ def appointments_new():
     # Si el doctor viene desde "Agendar cita" para un paciente: ?paciente_id=
     selected_paciente_id = request.args.get("paciente_id", type=int)
 
-    with get_db() as db:
-        medicos = db.query(Medico).options(joinedload(Medico.usuario)).all()
+    with get_db(readonly=True) as db:
         selected_paciente = db.get(Usuario, selected_paciente_id) if selected_paciente_id else None
 
     if request.method == "POST":
@@ -284,7 +507,11 @@ def appointments_new():
         flash("Cita creada", "success")
         return redirect(url_for("citas_list"))
 
-    return render_template("appointments_new.html", medicos=medicos, selected_paciente=selected_paciente)
+    return render_template(
+        "appointments_new.html",
+        medico_options=doctor_directory.options_html(),
+        selected_paciente=selected_paciente,
+    )
 
 
 
@@ -292,7 +519,7 @@ def appointments_new():
 @login_required
 def citas_edit(cita_id: int):
     # GET con eager loading
-    with get_db() as db:
+    with get_db(readonly=True) as db:
         cita = (
             db.query(Cita)
             .options(
@@ -306,16 +533,11 @@ def citas_edit(cita_id: int):
             flash("Cita no encontrada", "warning")
             return redirect(url_for("citas_list"))
 
-        medicos = db.query(Medico).options(joinedload(Medico.usuario)).all()
-        medico_actual = None
-        if current_user.tipo == TipoUsuario.MEDICO:
-            medico_actual = db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-
     # permisos para ver/editar
     puede_ver = (
         current_user.tipo == TipoUsuario.ADMIN
         or (current_user.tipo == TipoUsuario.PACIENTE and current_user.id == cita.paciente_id)
-        or (current_user.tipo == TipoUsuario.MEDICO and medico_actual and medico_actual.id == cita.medico_id)
+        or (current_user.tipo == TipoUsuario.MEDICO and current_user.medico_id == cita.medico_id)
     )
     if not puede_ver:
         flash("No tienes permisos para editar esta cita", "danger")
@@ -378,13 +600,13 @@ def citas_edit(cita_id: int):
         return redirect(url_for("citas_list"))
 
     es_admin = current_user.tipo == TipoUsuario.ADMIN
-    es_medico_prop = current_user.tipo == TipoUsuario.MEDICO and medico_actual and medico_actual.id == cita.medico_id
+    es_medico_prop = current_user.tipo == TipoUsuario.MEDICO and current_user.medico_id == cita.medico_id
     puede_editar_todo = es_admin or es_medico_prop
 
     return render_template(
         "appointments_edit.html",
         cita=cita,
-        medicos=medicos,
+        medico_options=doctor_directory.options_html(selected=cita.medico_id),
         EstadoCita=EstadoCita,
         puede_editar_todo=puede_editar_todo
     )
@@ -405,16 +627,11 @@ def citas_cancel(cita_id: int):
             flash("Cita no encontrada.", "warning")
             return redirect(url_for("citas_list"))
 
-        # ¿Quién es el médico actual (si aplica)?
-        medico_actual = None
-        if current_user.tipo == TipoUsuario.MEDICO:
-            medico_actual = db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-
         # Permisos
         permitido = (
             current_user.tipo == TipoUsuario.ADMIN
             or (current_user.tipo == TipoUsuario.PACIENTE and current_user.id == c.paciente_id)
-            or (current_user.tipo == TipoUsuario.MEDICO and medico_actual and medico_actual.id == c.medico_id)
+            or (current_user.tipo == TipoUsuario.MEDICO and current_user.medico_id == c.medico_id)
         )
         if not permitido:
             flash("No tienes permisos para cancelar esta cita.", "danger")
@@ -446,33 +663,14 @@ def doctor_appointments_new():
     if current_user.tipo not in (TipoUsuario.MEDICO, TipoUsuario.ADMIN):
         abort(403)
 
-    with get_db() as db:
-        # Lista de médicos (por si admin agenda para cualquiera)
-        medicos = db.query(Medico).options(joinedload(Medico.usuario)).all()
-
-        # Determina el médico actual (si es médico)
-        medico_actual = None
-        if current_user.tipo == TipoUsuario.MEDICO:
-            medico_actual = (
-                db.query(Medico)
-                .filter(Medico.usuario_id == current_user.id)
-                .first()
-            )
-
-        # Lista de pacientes (solo usuarios tipo PACIENTE)
-        pacientes = (
-            db.query(Usuario)
-            .filter(Usuario.tipo == TipoUsuario.PACIENTE)
-            .order_by(Usuario.apellido.asc(), Usuario.nombre.asc())
-            .all()
-        )
-
     if request.method == "POST":
         try:
             paciente_id = int(request.form["paciente_id"])
             medico_id = int(request.form["medico_id"])
             start_at = datetime.fromisoformat(request.form["start_at"])
             end_at = datetime.fromisoformat(request.form["end_at"])
+            repeticiones = int(request.form.get("repeticiones") or 1)
+            cada_dias = int(request.form.get("cada_dias") or 7)
         except Exception:
             flash("Revisa que seleccionaste paciente, médico y las fechas/horas tengan formato válido.", "warning")
             return redirect(url_for("doctor_appointments_new"))
@@ -483,6 +681,14 @@ def doctor_appointments_new():
             flash("La hora de fin debe ser posterior al inicio.", "warning")
             return redirect(url_for("doctor_appointments_new"))
 
+        if not 1 <= repeticiones <= SERIES_MAX:
+            flash(f"Las repeticiones deben estar entre 1 y {SERIES_MAX}.", "warning")
+            return redirect(url_for("doctor_appointments_new"))
+
+        if repeticiones > 1 and (cada_dias < 1 or timedelta(days=cada_dias) < end_at - start_at):
+            flash("Las citas de la serie no pueden traslaparse entre sí.", "warning")
+            return redirect(url_for("doctor_appointments_new"))
+
         with get_db() as db:
             # Valida que el paciente exista
             if not db.get(Usuario, paciente_id):
@@ -491,57 +697,217 @@ def doctor_appointments_new():
 
             # Si es médico, solo puede agendar con su propio ID (a menos que sea admin)
             if current_user.tipo == TipoUsuario.MEDICO:
-                medico_actual = (
-                    db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-                )
-                if not medico_actual or medico_actual.id != medico_id:
+                if not current_user.medico_id or current_user.medico_id != medico_id:
                     flash("No puedes agendar citas para otro médico.", "danger")
                     return redirect(url_for("doctor_appointments_new"))
 
-            # Valida traslape
-            if has_overlap(db, medico_id, start_at, end_at):
-                flash("El médico ya tiene una cita que se traslapa en ese horario.", "warning")
-                return redirect(url_for("doctor_appointments_new"))
-
-            # Crea la cita
-            c = Cita(
-                medico_id=medico_id,
-                paciente_id=paciente_id,
-                start_at=start_at,
-                end_at=end_at,
-                estado=EstadoCita.PENDIENTE,
-                notas=notas,
-            )
-            db.add(c)
+            if repeticiones > 1:
+                # Serie: una consulta valida todas las ocurrencias y un executemany inserta las aceptadas
+                ocurrencias = recurring_series(start_at, end_at, repeticiones, cada_dias)
+                conflictos = series_conflicts(db, medico_id, ocurrencias)
+                bulk_insert_citas(db, [
+                    dict(
+                        medico_id=medico_id,
+                        paciente_id=paciente_id,
+                        start_at=inicio,
+                        end_at=fin,
+                        estado=EstadoCita.PENDIENTE,
+                        notas=notas,
+                    )
+                    for i, (inicio, fin) in enumerate(ocurrencias)
+                    if i not in conflictos
+                ])
+            else:
+                # Valida traslape
+                if has_overlap(db, medico_id, start_at, end_at):
+                    flash("El médico ya tiene una cita que se traslapa en ese horario.", "warning")
+                    return redirect(url_for("doctor_appointments_new"))
 
-        flash("Cita creada correctamente.", "success")
+                # Crea la cita
+                c = Cita(
+                    medico_id=medico_id,
+                    paciente_id=paciente_id,
+                    start_at=start_at,
+                    end_at=end_at,
+                    estado=EstadoCita.PENDIENTE,
+                    notas=notas,
+                )
+                db.add(c)
+
+        if repeticiones > 1:
+            agendadas = repeticiones - len(conflictos)
+            flash(f"Serie creada: {agendadas} de {repeticiones} citas agendadas.", "success" if agendadas else "warning")
+            if conflictos:
+                fechas = ", ".join(ocurrencias[i][0].strftime("%d/%m/%Y %H:%M") for i in sorted(conflictos))
+                flash(f"No se agendaron por traslape: {fechas}.", "warning")
+        else:
+            flash("Cita creada correctamente.", "success")
         return redirect(url_for("doctor_consultas"))
 
     # GET: renderiza formulario
     return render_template(
         "doctor_appointments_new.html",
-        medicos=medicos,
-        pacientes=pacientes,
-        medico_actual=medico_actual,
+        # Lista de médicos (por si admin agenda para cualquiera)
+        medico_options=doctor_directory.options_html(selected=current_user.medico_id),
+        medico_actual=medico_actual(),
+        series_max=SERIES_MAX,
     )
 
 
 
+# ----------------- DISPONIBILIDAD -----------------
+@app.route("/api/disponibilidad")
+@login_required
+def api_disponibilidad():
+    """
+    Huecos libres en JSON. ?medico_id=3 o ?especialidad=Cardiología, más
+    duracion (minutos, 30), desde (YYYY-MM-DD, hoy), dias (14) y limite (20).
+    Con especialidad regresa primero los huecos más cercanos de cualquier médico.
+    """
+    medico_id = request.args.get("medico_id", type=int)
+    especialidad = request.args.get("especialidad") or None
+    if medico_id is None and especialidad is None:
+        return jsonify(error="Indica medico_id o especialidad."), 400
+    try:
+        duracion = timedelta(minutes=request.args.get("duracion", 30, type=int))
+        dias = min(request.args.get("dias", 14, type=int), AVAILABILITY_MAX_DAYS)
+        limite = min(request.args.get("limite", 20, type=int), 200)
+        desde_txt = request.args.get("desde")
+        desde = datetime.fromisoformat(desde_txt) if desde_txt else datetime.now()
+    except ValueError:
+        return jsonify(error="Parámetros con formato inválido."), 400
+    if desde.tzinfo is not None:
+        # Las citas se guardan en hora local sin zona: no se comparan con una hora con zona
+        return jsonify(error="desde va en hora local, sin zona horaria."), 400
+    if duracion <= timedelta(0) or dias < 1 or limite < 1:
+        return jsonify(error="duracion, dias y limite deben ser positivos."), 400
+
+    desde = max(desde, datetime.now())
+    hasta = datetime.combine(desde.date(), time.min) + timedelta(days=dias)
+    with get_db(readonly=True) as db:
+        encontrados = find_slots(db, desde, hasta, duracion, medico_id, especialidad, limite)
+
+    return jsonify(slots=[
+        dict(
+            medico_id=medico.id,
+            medico=f"{medico.nombre} {medico.apellido}",
+            especialidad=medico.especialidad,
+            start_at=inicio.isoformat(timespec="minutes"),
+            end_at=fin.isoformat(timespec="minutes"),
+        )
+        for inicio, fin, medico in encontrados
+    ])
+
+
+# ----------------- EXPORTACIÓN -----------------
+def _descarga(query, nombre, formato):
+    if formato not in EXPORT_FORMATOS:
+        abort(404)
+    respuesta = Response(export_stream(query, formato), mimetype=EXPORT_FORMATOS[formato])
+    respuesta.headers["Content-Disposition"] = f'attachment; filename="{nombre}.{formato}"'
+    return respuesta
+
+
+@app.route("/export/citas.<formato>")
+@login_required
+def export_citas(formato):
+    """Citas de un rango (?desde=&hasta=, ISO) en streaming; el médico solo exporta las suyas."""
+    if current_user.tipo == TipoUsuario.ADMIN:
+        medico_id = request.args.get("medico_id", type=int)
+    elif current_user.tipo == TipoUsuario.MEDICO and current_user.medico_id:
+        medico_id = current_user.medico_id
+    else:
+        abort(403)
+    try:
+        desde = datetime.fromisoformat(request.args["desde"]) if request.args.get("desde") else None
+        hasta = datetime.fromisoformat(request.args["hasta"]) if request.args.get("hasta") else None
+    except ValueError:
+        abort(400)
+    return _descarga(citas_export_query(desde, hasta, medico_id), "citas", formato)
+
+
+@app.route("/export/pacientes.<formato>")
+@login_required
+def export_pacientes(formato):
+    if current_user.tipo not in (TipoUsuario.ADMIN, TipoUsuario.MEDICO):
+        abort(403)
+    return _descarga(pacientes_export_query(), "pacientes", formato)
+
+
+# ----------------- IMPORTACIÓN -----------------
+@app.route("/admin/importar", methods=["GET", "POST"])
+@login_required
+def admin_importar():
+    """Alta masiva de pacientes desde CSV; responde con el reporte en streaming conforme avanza."""
+    if current_user.tipo != TipoUsuario.ADMIN:
+        abort(403)
+
+    if request.method == "POST":
+        archivo = request.files.get("archivo")
+        if not archivo or not archivo.filename:
+            flash("Selecciona un archivo CSV.", "warning")
+            return redirect(url_for("admin_importar"))
+        texto = io.TextIOWrapper(archivo.stream, encoding="utf-8-sig", newline="")
+        resultados = import_csv(texto, workers=IMPORT_REQUEST_WORKERS)
+        try:
+            # El encabezado se valida antes de responder; el resto va en el reporte
+            primero = next(resultados, None)
+        except ValueError as e:
+            flash(f"No se pudo leer el archivo: {e}", "warning")
+            return redirect(url_for("admin_importar"))
+
+        def reporte():
+            salida = io.StringIO()
+            for _ in write_report(itertools.chain([primero] if primero else [], resultados), salida):
+                if salida.tell() > 64 * 1024:
+                    yield salida.getvalue()
+                    salida.seek(0)
+                    salida.truncate()
+            yield salida.getvalue()
+
+        respuesta = Response(stream_with_context(reporte()), mimetype="text/csv")
+        respuesta.headers["Content-Disposition"] = 'attachment; filename="importacion.csv"'
+        return respuesta
+
+    return render_template("admin_import.html", columnas=IMPORT_COLUMNAS)
+
+
 # ----------------- DOCTORES -----------------
 @app.route("/doctores")
 @login_required
+@query_budget(4)
 def doctores_list():
     if current_user.tipo not in (TipoUsuario.ADMIN, TipoUsuario.MEDICO):
         abort(403)
-    with get_db() as db:
+    with get_db(readonly=True) as db:
         doctores = db.query(Medico).options(joinedload(Medico.usuario)).order_by(Medico.id.asc()).all()
     return render_template("doctores_list.html", doctores=doctores)
 
 
 @app.route("/doctor/<int:medico_id>")
 @login_required
+@query_budget(7)
 def doctor_perfil(medico_id: int):
-    with get_db() as db:
+    es_admin = current_user.tipo == TipoUsuario.ADMIN
+    es_el_mismo_medico = False
+    if current_user.tipo == TipoUsuario.MEDICO:
+        es_el_mismo_medico = current_user.medico_id == medico_id
+
+    if not (es_admin or es_el_mismo_medico):
+        abort(403)
+
+    with get_db(readonly=True) as db:
+        hoy_inicio = datetime.combine(datetime.today().date(), time.min)
+        # Las citas del médico cubren también su lista de pacientes (doctor_paciente)
+        etag, ultima = _etag(
+            _version_citas(db, Cita.medico_id == medico_id),
+            hoy_inicio.date(),
+            _version_personas(db, [Cita.medico_id == medico_id], [CitaArchivada.medico_id == medico_id], medico_id),
+        )
+        no_modificado = _no_modificado(etag, ultima)
+        if no_modificado:
+            return no_modificado
+
         medico = (
             db.query(Medico)
             .options(joinedload(Medico.usuario))
@@ -552,16 +918,6 @@ def doctor_perfil(medico_id: int):
             flash("Médico no encontrado", "warning")
             return redirect(url_for("dashboard"))
 
-        es_admin = current_user.tipo == TipoUsuario.ADMIN
-        es_el_mismo_medico = False
-        if current_user.tipo == TipoUsuario.MEDICO:
-            medico_actual = db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-            es_el_mismo_medico = bool(medico_actual and medico_actual.id == medico.id)
-
-        if not (es_admin or es_el_mismo_medico):
-            abort(403)
-
-        hoy_inicio = datetime.combine(datetime.today().date(), time.min)
         citas = (
             db.query(Cita)
             .options(
@@ -576,17 +932,10 @@ def doctor_perfil(medico_id: int):
             .all()
         )
 
-        pacientes = (
-            db.query(Usuario)
-            .join(Cita, Cita.paciente_id == Usuario.id)
-            .filter(Cita.medico_id == medico.id)
-            .distinct()
-            .order_by(Usuario.apellido.asc(), Usuario.nombre.asc())
-            .all()
-        )
+        pacientes, _ = roster_for(db, medico.id)
 
     puede_editar_expediente = es_admin or es_el_mismo_medico
-    return render_template(
+    html = render_template(
         "doctor_perfil.html",
         medico=medico,
         citas=citas,
@@ -594,100 +943,78 @@ def doctor_perfil(medico_id: int):
         EstadoCita=EstadoCita,
         puede_editar_expediente=puede_editar_expediente
     )
+    return _validadores(html, etag, ultima)
 
 
 @app.route("/doctor/consultas")
 @login_required
-def doctor_consultas():
-    if current_user.tipo != TipoUsuario.MEDICO:
-        abort(403)
-
+@medico_required
+@query_budget(5)
+def doctor_consultas(medico_id: int):
     paciente_id = request.args.get("paciente_id", type=int)
 
-    with get_db() as db:
-        medico = db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-        if not medico:
-            flash("No hay registro de médico asociado a tu usuario.", "warning")
-            return redirect(url_for("dashboard"))
-
+    with get_db(readonly=True) as db:
         ahora = datetime.now()
+        filtros = [Cita.medico_id == medico_id, Cita.start_at >= ahora, CITA_ACTIVA]
+        if paciente_id:
+            filtros.append(Cita.paciente_id == paciente_id)
+
+        etag, ultima = _etag(_version_citas(db, *filtros), _version_personas(db, filtros))
+        no_modificado = _no_modificado(etag, ultima)
+        if no_modificado:
+            return no_modificado
+
         q = (
             db.query(Cita)
             .options(
                 joinedload(Cita.paciente),
                 joinedload(Cita.medico).joinedload(Medico.usuario),
             )
-            .filter(
-                Cita.medico_id == medico.id,
-                Cita.start_at >= ahora,
-                Cita.estado.in_([EstadoCita.PENDIENTE, EstadoCita.CONFIRMADA]),
-            )
+            .filter(*filtros)
         )
         selected_paciente = None
         if paciente_id:
-            q = q.filter(Cita.paciente_id == paciente_id)
             selected_paciente = db.get(Usuario, paciente_id)
 
         citas = q.order_by(Cita.start_at.asc()).all()
 
-    return render_template(
+    html = render_template(
         "doctor_consultas.html",
         citas=citas,
         EstadoCita=EstadoCita,
         selected_paciente=selected_paciente
     )
+    return _validadores(html, etag, ultima)
 
 
 @app.route("/doctor/consultas/concluidas")
 @login_required
-def doctor_concluidas():
-    if current_user.tipo != TipoUsuario.MEDICO:
-        abort(403)
-
-    with get_db() as db:
-        medico = db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-        if not medico:
-            flash("No hay registro de médico asociado a tu usuario.", "warning")
-            return redirect(url_for("dashboard"))
-
-        citas = (
-            db.query(Cita)
-            .options(
-                joinedload(Cita.paciente),
-                joinedload(Cita.medico).joinedload(Medico.usuario),
-            )
-            .filter(
-                Cita.medico_id == medico.id,
-                Cita.estado.in_([EstadoCita.ATENDIDA, EstadoCita.CANCELADA]),
-            )
-            .order_by(Cita.start_at.desc())
-            .all()
+@medico_required
+@query_budget(4)
+def doctor_concluidas(medico_id: int):
+    with get_db(readonly=True) as db:
+        citas, next_cursor = keyset_page(
+            _citas_concluidas(db, medico_id),
+            request.args.get("cursor"),
+            archivo=_citas_concluidas(db, medico_id, CitaArchivada),
         )
 
-    return render_template("doctor_concluidas.html", citas=citas, EstadoCita=EstadoCita)
+    return render_template(
+        "doctor_concluidas.html",
+        citas=citas,
+        EstadoCita=EstadoCita,
+        next_cursor=next_cursor,
+    )
 
 
 @app.route("/doctor/expedientes")
 @login_required
-def doctor_expedientes():
+@medico_required
+@query_budget(4)
+def doctor_expedientes(medico_id: int):
     """Lista de pacientes atendidos por el doctor con acceso a sus expedientes."""
-    if current_user.tipo != TipoUsuario.MEDICO:
-        abort(403)
-
-    with get_db() as db:
-        medico = db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-        if not medico:
-            flash("No hay registro de médico asociado a tu usuario.", "warning")
-            return redirect(url_for("dashboard"))
-
-        pacientes = (
-            db.query(Usuario)
-            .join(Cita, Cita.paciente_id == Usuario.id)
-            .filter(Cita.medico_id == medico.id)
-            .distinct()
-            .order_by(Usuario.apellido.asc(), Usuario.nombre.asc())
-            .all()
-        )
+    with get_db(readonly=True) as db:
+        pacientes, _ = roster_for(db, medico_id)
 
         # El propio médico puede editar expedientes
     return render_template(
@@ -710,13 +1037,6 @@ def doctor_paciente_new():
     from sqlalchemy.orm import joinedload
     import secrets
 
-    # Cargar médicos para el select (preselecciona al médico actual si existe)
-    with get_db() as db:
-        medicos = db.query(Medico).options(joinedload(Medico.usuario)).all()
-        medico_actual = None
-        if current_user.tipo == TipoUsuario.MEDICO:
-            medico_actual = db.query(Medico).filter(Medico.usuario_id == current_user.id).first()
-
     if request.method == "POST":
         # ---- Datos del paciente ----
         nombre = (request.form.get("nombre") or "").strip()
@@ -742,6 +1062,14 @@ def doctor_paciente_new():
             flash("La hora de fin debe ser posterior al inicio.", "warning")
             return redirect(url_for("doctor_paciente_new"))
 
+        # Genera password temporal (no se pide en el form); el hash, fuera de la transacción
+        temp_password = secrets.token_urlsafe(8)[:10]
+        try:
+            temp_hash = hash_password(temp_password)
+        except HashingSaturado:
+            flash("Hay demasiadas solicitudes en este momento. Intenta de nuevo en unos segundos.", "warning")
+            return redirect(url_for("doctor_paciente_new"))
+
         # Crear paciente + cita
         with get_db() as db:
             # Correo único solo si se proporcionó
@@ -749,14 +1077,11 @@ def doctor_paciente_new():
                 flash("El correo ya está registrado.", "warning")
                 return redirect(url_for("doctor_paciente_new"))
 
-            # Genera password temporal (no se pide en el form)
-            temp_password = secrets.token_urlsafe(8)[:10]
-
             u = Usuario(
                 nombre=nombre,
                 apellido=apellido,
                 email=email or f"paciente{secrets.randbelow(999999)}@local",
-                password_hash=generate_password_hash(temp_password),
+                password_hash=temp_hash,
                 tipo=TipoUsuario.PACIENTE,
             )
             db.add(u)
@@ -794,19 +1119,32 @@ def doctor_paciente_new():
     # GET: renderiza el formulario
     return render_template(
         "patient_new.html",
-        medicos=medicos,
-        medico_actual=medico_actual,
+        # Médicos para el select (preselecciona al médico actual si existe)
+        medico_options=doctor_directory.options_html(selected=current_user.medico_id),
     )
 
 # ----------------- EXPEDIENTE -----------------
 @app.route("/expediente/<int:paciente_id>")
 @login_required
+@query_budget(5)
 def expediente_view(paciente_id: int):
     # Paciente solo ve el suyo; médico/admin pueden ver cualquiera
     if current_user.tipo == TipoUsuario.PACIENTE and current_user.id != paciente_id:
         abort(403)
 
-    with get_db() as db:
+    with get_db(readonly=True) as db:
+        # Versión del paciente y de su expediente en una fila, sin cargar objetos
+        fila = (
+            db.query(Usuario.updated_at, Expediente.updated_at)
+            .outerjoin(Expediente, Expediente.paciente_id == Usuario.id)
+            .filter(Usuario.id == paciente_id)
+            .first()
+        )
+        etag, ultima = _etag(tuple(fila)) if fila else (None, None)
+        no_modificado = _no_modificado(etag, ultima)
+        if no_modificado:
+            return no_modificado
+
         paciente = db.get(Usuario, paciente_id)
         if not paciente:
             flash("Paciente no encontrado", "warning")
@@ -820,12 +1158,13 @@ def expediente_view(paciente_id: int):
         )
 
     puede_editar = current_user.tipo in (TipoUsuario.MEDICO, TipoUsuario.ADMIN)
-    return render_template(
+    html = render_template(
         "expediente_view.html",
         paciente=paciente,
         expediente=expediente,
         puede_editar=puede_editar
     )
+    return _validadores(html, etag, ultima)
 
 
 @app.route("/expediente/<int:paciente_id>/editar", methods=["GET", "POST"])
@@ -864,16 +1203,77 @@ def expediente_edit(paciente_id: int):
             return redirect(url_for("expediente_view", paciente_id=paciente_id))
 
     # GET (segunda consulta para hidratar si hizo rollback previo)
-    with get_db() as db:
+    with get_db(readonly=True) as db:
         expediente = db.query(Expediente).filter(Expediente.paciente_id == paciente_id).first()
 
     return render_template("expediente_edit.html", paciente=paciente, expediente=expediente)
 
 
+# ----------------- BÚSQUEDA -----------------
+def _buscar_pacientes():
+    """Resultados de ?q=&campo=&limite= con las reglas de expediente_view: el paciente solo se encuentra a sí mismo."""
+    campo = request.args.get("campo") or None
+    if campo is not None and campo not in SEARCH_CAMPOS:
+        abort(400)
+    limite = min(request.args.get("limite", SEARCH_LIMIT, type=int), SEARCH_LIMIT)
+    paciente_id = current_user.id if current_user.tipo == TipoUsuario.PACIENTE else None
+    with get_db(readonly=True) as db:
+        return search_pacientes(db, request.args.get("q", ""), campo, paciente_id, limite)
+
+
+@app.route("/api/pacientes/buscar")
+@login_required
+@query_budget(4)
+def api_buscar_pacientes():
+    """JSON ordenado por relevancia; nombre, apellido, email y fragmento son HTML escapado con <mark>."""
+    resultados = _buscar_pacientes()
+    return jsonify([
+        dict(r, url=url_for("expediente_view", paciente_id=r["id"]))
+        for r in resultados
+    ])
+
+
+@app.route("/api/pacientes/sugerencias")
+@login_required
+@query_budget(10)
+def api_sugerencias_pacientes():
+    """Autocompletado de pacientes por prefijo (?q=&limite=) para los formularios de médico y admin."""
+    if current_user.tipo not in (TipoUsuario.MEDICO, TipoUsuario.ADMIN):
+        abort(403)
+    limite = max(1, min(request.args.get("limite", TYPEAHEAD_LIMIT, type=int), TYPEAHEAD_MAX))
+    with get_db(readonly=True) as db:
+        return jsonify(typeahead(db, request.args.get("q", ""), limite))
+
+
+@app.route("/expedientes/buscar")
+@login_required
+@query_budget(4)
+def expedientes_buscar():
+    return render_template(
+        "expedientes_buscar.html",
+        resultados=_buscar_pacientes(),
+        q=request.args.get("q", ""),
+        campo=request.args.get("campo", ""),
+        campos=SEARCH_CAMPOS,
+        puede_editar_expediente=current_user.tipo in (TipoUsuario.MEDICO, TipoUsuario.ADMIN),
+    )
+
+
+# ----------------- MÉTRICAS -----------------
+@app.route("/metrics")
+def metrics():
+    # Sin sesión ni login: la consulta el colector (METRICS_TOKEN o METRICS_ALLOW, ver metrics.py)
+    if not metrics_allowed(request):
+        abort(404)
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 # ----------------- RUN -----------------
 # al final de app.py
 if __name__ == "__main__":
-    import os, webbrowser, threading, time
+    import os, webbrowser, threading, time, multiprocessing
+
+    multiprocessing.freeze_support()  # el pool de importer.py en el ejecutable de PyInstaller
 
     def open_browser():
         # pequeña espera para que el server arranque
@@ -0,0 +1,125 @@
+"""
+Archivo de citas concluidas: mueve a citas_archivo las ATENDIDA y CANCELADA que
+terminaron hace más de ARCHIVE_AFTER_DAYS días.
+
+citas queda con las citas vigentes y las concluidas recientes, así que sus
+índices (has_overlap, doctor_consultas, la carga de agendas) no crecen con los
+años de historia. Las filas conservan su id y sus columnas; el historial
+(listado de citas, concluidas), la exportación y doctor_paciente leen las dos
+tablas. Una cita archivada ya no se edita ni se cancela.
+
+Las citas archivadas terminaron antes del horizonte (ahora - ARCHIVE_AFTER_DAYS),
+así que has_overlap solo las busca para citas que empiezan antes de él. La app
+y el job deben usar el mismo ARCHIVE_AFTER_DAYS.
+
+Se mueve por lotes, una transacción por lote, para no retener el candado del
+escritor mientras la app atiende requests.
+
+    python archive.py                 # mueve todas las que ya pasaron el horizonte
+    python archive.py --lote 200
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select
+
+from database import SessionLocal, call_after_commit
+from interval_index import agenda_index
+from models import Cita, CitaArchivada, EstadoCita
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 365))
+LOTE = 400  # ids por sentencia (límite de variables de SQLite)
+CONCLUIDAS = (EstadoCita.ATENDIDA, EstadoCita.CANCELADA)
+COLUMNAS = ("id", "medico_id", "paciente_id", "start_at", "end_at", "estado", "notas", "version", "updated_at")
+
+
+def horizonte(ahora=None):
+    """Las citas concluidas que terminan antes de este momento van al archivo."""
+    return (ahora or datetime.now()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def archive_batch(db, ahora=None, lote=LOTE) -> int:
+    """
+    Mueve hasta 'lote' citas concluidas anteriores al horizonte en la transacción
+    de la sesión; regresa cuántas movió. Las agendas en memoria de los médicos
+    afectados se descartan al confirmar (el DELETE no pasa por el ORM).
+    """
+    filas = db.execute(
+        select(Cita.id, Cita.medico_id)
+        .where(Cita.end_at < horizonte(ahora), Cita.estado.in_(CONCLUIDAS))
+        .order_by(Cita.end_at)
+        .limit(lote),
+        bind_arguments={"primary": True},
+    ).all()
+    if not filas:
+        return 0
+    ids = [cita_id for cita_id, _ in filas]
+    db.execute(
+        insert(CitaArchivada).from_select(
+            [*COLUMNAS, "archived_at"],
+            select(*(getattr(Cita, c) for c in COLUMNAS), literal(datetime.utcnow())).where(Cita.id.in_(ids)),
+        )
+    )
+    db.execute(delete(Cita).where(Cita.id.in_(ids)))
+    for medico_id in {medico_id for _, medico_id in filas}:
+        call_after_commit(db, lambda medico_id=medico_id: agenda_index.invalidate(medico_id))
+    return len(ids)
+
+
+def archive(ahora=None, lote=LOTE, progreso=None) -> int:
+    """Mueve por lotes todas las citas concluidas anteriores al horizonte; regresa el total."""
+    ahora = ahora or datetime.now()
+    total = 0
+    while True:
+        with SessionLocal.session_factory() as db, db.begin():
+            movidas = archive_batch(db, ahora, lote)
+        if not movidas:
+            return total
+        total += movidas
+        if progreso:
+            progreso(total)
+
+
+def archived_overlaps(db, medico_id, start_at, end_at) -> bool:
+    """has_overlap contra citas_archivo; solo puede haber traslape si start_at es anterior al horizonte."""
+    if start_at >= horizonte():
+        return False
+    q = select(CitaArchivada.id).where(
+        CitaArchivada.medico_id == medico_id,
+        CitaArchivada.start_at < end_at,
+        CitaArchivada.end_at > start_at,
+    )
+    return db.execute(select(q.exists())).scalar()
+
+
+def archived_intervals(db, medico_id, desde, hasta):
+    """[(start_at, end_at)] archivados del médico que tocan [desde, hasta), ordenados; [] después del horizonte."""
+    if desde >= horizonte():
+        return []
+    return db.execute(
+        select(CitaArchivada.start_at, CitaArchivada.end_at)
+        .where(CitaArchivada.medico_id == medico_id, CitaArchivada.start_at < hasta, CitaArchivada.end_at > desde)
+        .order_by(CitaArchivada.start_at)
+    ).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lote", type=int, default=LOTE, help="citas por transacción")
+    args = parser.parse_args()
+
+    from database import init_db
+
+    init_db()
+    corte = horizonte()
+    total = archive(lote=args.lote, progreso=lambda n: print(f"{n} citas archivadas…", end="\r"))
+    with SessionLocal.session_factory() as db:
+        vigentes = db.scalar(select(func.count()).select_from(Cita))
+        archivadas = db.scalar(select(func.count()).select_from(CitaArchivada))
+    print(f"{total} citas concluidas antes de {corte:%Y-%m-%d %H:%M} archivadas; "
+          f"citas: {vigentes}, citas_archivo: {archivadas}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Assets estáticos: nombres con hash de contenido, copias gzip e imágenes locales.
+
+    python assets.py vendor       # descarga las imágenes de Unsplash a static/css/img en varios anchos
+    python assets.py build        # copia static/ a static/dist con hash en el nombre, .gz y manifest.json
+
+En las plantillas: {{ asset_url('css/layout.css') }} y {{ hero_img('consultas', 'Consultas') }}.
+/assets sirve static/dist con Cache-Control inmutable: el nombre cambia cuando
+cambia el contenido. Sin build (desarrollo) asset_url regresa la URL de
+/static. Para el ejecutable de PyInstaller, correr build antes de empaquetar.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import urllib.request
+
+from flask import request, send_from_directory, url_for
+from markupsafe import Markup
+
+log = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST = "dist"
+MANIFEST = "manifest.json"
+IMAGE_DIR = "css/img"
+WIDTHS = (480, 960, 1600)  # anchos de las imágenes para srcset
+GZIP_TYPES = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+ONE_YEAR = 365 * 24 * 3600
+
+# nombre local -> foto de Unsplash que usaban las plantillas
+IMAGES = {
+    "hero-medico": "photo-1582719478250-c89cae4dc85b",
+    "pacientes": "photo-1583912267551-4f33492a2701",
+    "calendario": "photo-1512412046876-f386342eddb5",
+    "consultas": "photo-1516542076529-1ea3854896e1",
+    "expedientes": "photo-1582719512121-3b82f39c8e41",
+}
+
+
+def _unsplash_url(foto, ancho, formato=None):
+    url = f"https://images.unsplash.com/{foto}?q=80&w={ancho}&auto=format&fit=crop"
+    return url + (f"&fm={formato}" if formato else "")
+
+
+def _image_path(nombre, ancho):
+    return f"{IMAGE_DIR}/{nombre}-{ancho}.webp"
+
+
+def missing_images(existe):
+    """Variantes de IMAGES (rutas relativas a static/) para las que existe(ruta) es falso."""
+    return [_image_path(nombre, ancho) for nombre in IMAGES for ancho in WIDTHS if not existe(_image_path(nombre, ancho))]
+
+
+# ----------------- CONSTRUCCIÓN -----------------
+def vendor(static_dir=STATIC_DIR):
+    """Descarga cada imagen de IMAGES en los anchos de WIDTHS (webp); omite las que ya existen."""
+    carpeta = os.path.join(static_dir, IMAGE_DIR)
+    os.makedirs(carpeta, exist_ok=True)
+    for nombre, foto in IMAGES.items():
+        for ancho in WIDTHS:
+            destino = os.path.join(static_dir, _image_path(nombre, ancho))
+            if os.path.exists(destino):
+                continue
+            with urllib.request.urlopen(_unsplash_url(foto, ancho, "webp"), timeout=30) as r:
+                datos = r.read()
+            with open(destino, "wb") as f:
+                f.write(datos)
+            print(f"  {os.path.relpath(destino, static_dir)}  {len(datos) // 1024} KiB")
+
+
+def build(static_dir=STATIC_DIR):
+    """
+    Copia cada archivo de static/ a static/dist/<ruta>.<hash><ext>, con .gz al
+    lado para los tipos de texto, y escribe el manifiesto ruta -> ruta con hash.
+    No borra versiones anteriores: páginas ya cacheadas pueden seguir pidiéndolas.
+    Avisa si falta alguna imagen de IMAGES: hero_img recurre a Unsplash hasta
+    que python assets.py vendor las descargue.
+    """
+    faltan = missing_images(lambda rel: os.path.isfile(os.path.join(static_dir, rel)))
+    if faltan:
+        log.warning("Faltan %d imágenes locales (python assets.py vendor): %s", len(faltan), ", ".join(faltan))
+    dist = os.path.join(static_dir, DIST)
+    manifest = {}
+    for raiz, dirs, archivos in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(raiz, d) != dist)
+        for nombre in sorted(archivos):
+            if nombre.startswith("."):
+                continue
+            ruta = os.path.join(raiz, nombre)
+            rel = os.path.relpath(ruta, static_dir).replace(os.sep, "/")
+            with open(ruta, "rb") as f:
+                datos = f.read()
+            base, ext = os.path.splitext(rel)
+            hashed = f"{base}.{hashlib.sha256(datos).hexdigest()[:12]}{ext}"
+            destino = os.path.join(dist, hashed)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            with open(destino, "wb") as f:
+                f.write(datos)
+            if ext.lower() in GZIP_TYPES:
+                comprimido = gzip.compress(datos, compresslevel=9, mtime=0)
+                if len(comprimido) < len(datos):
+                    with open(destino + ".gz", "wb") as f:
+                        f.write(comprimido)
+            manifest[rel] = hashed
+    with open(os.path.join(dist, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+# ----------------- EN LA APP -----------------
+class Assets:
+    """Manifiesto cargado al arrancar y los helpers de plantilla que lo usan."""
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.dist = os.path.join(static_dir, DIST)
+        ruta = os.path.join(self.dist, MANIFEST)
+        try:
+            with open(ruta, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+            log.info("Sin %s: los assets se sirven desde /static sin hash", ruta)
+        self.version = hashlib.sha1(json.dumps(self.manifest, sort_keys=True).encode()).hexdigest()[:12]
+        # Archivos de static/ al arrancar, para no tocar el disco en cada render
+        self._archivos = set(self.manifest)
+        for raiz, dirs, archivos in os.walk(static_dir):
+            dirs[:] = [d for d in dirs if os.path.join(raiz, d) != self.dist]
+            self._archivos.update(
+                os.path.relpath(os.path.join(raiz, nombre), static_dir).replace(os.sep, "/") for nombre in archivos
+            )
+        faltan = missing_images(self.exists)
+        if faltan:
+            log.warning("Faltan %d imágenes locales (python assets.py vendor): %s", len(faltan), ", ".join(faltan))
+
+    def exists(self, path):
+        return path in self._archivos
+
+    def url(self, path):
+        hashed = self.manifest.get(path)
+        if hashed:
+            return url_for("assets", filename=hashed)
+        return url_for("static", filename=path)
+
+    def hero_img(self, nombre, alt, clase=None, sizes="100vw"):
+        """
+        <img> con srcset de las copias locales; mientras no se descarguen
+        (aviso al arrancar), el mismo srcset servido por Unsplash en webp.
+        """
+        variantes = [(w, self.url(p)) for w, p in ((w, _image_path(nombre, w)) for w in WIDTHS) if self.exists(p)]
+        if not variantes:
+            variantes = [(w, _unsplash_url(IMAGES[nombre], w, "webp")) for w in WIDTHS]
+        src = variantes[len(variantes) // 2][1]
+        srcset = ", ".join(f"{url} {w}w" for w, url in variantes)
+        return Markup('<img{clase} alt="{alt}" src="{src}"{srcset} decoding="async">').format(
+            clase=Markup(' class="{}"').format(clase) if clase else "",
+            alt=alt,
+            src=src,
+            srcset=Markup(' srcset="{}" sizes="{}"').format(srcset, sizes),
+        )
+
+    def send(self, filename):
+        """Sirve un archivo de dist (el .gz si el cliente lo acepta) con caché inmutable."""
+        mimetype = mimetypes.guess_type(filename)[0]
+        gz = os.path.join(self.dist, filename + ".gz")
+        if "gzip" in request.accept_encodings and os.path.isfile(gz):
+            respuesta = send_from_directory(self.dist, filename + ".gz", mimetype=mimetype, max_age=ONE_YEAR)
+            respuesta.headers["Content-Encoding"] = "gzip"
+        else:
+            respuesta = send_from_directory(self.dist, filename, mimetype=mimetype, max_age=ONE_YEAR)
+        respuesta.vary.add("Accept-Encoding")
+        respuesta.cache_control.public = True
+        respuesta.cache_control.immutable = True
+        return respuesta
+
+
+def init_assets(app):
+    """Carga el manifiesto, registra /assets y los helpers asset_url y hero_img."""
+    assets = Assets(app.static_folder)
+    app.add_url_rule("/assets/<path:filename>", "assets", assets.send)
+    app.jinja_env.globals.update(asset_url=assets.url, hero_img=assets.hero_img)
+    return assets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline de assets estáticos.")
+    parser.add_argument("comando", choices=["vendor", "build"])
+    parser.add_argument("--static", default=STATIC_DIR, help="carpeta static (por defecto la del proyecto)")
+    args = parser.parse_args()
+    if args.comando == "vendor":
+        vendor(args.static)
+    else:
+        logging.basicConfig(format="%(message)s")
+        manifest = build(args.static)
+        print(f"{len(manifest)} archivos en {os.path.join(args.static, DIST)}")
@@ -0,0 +1,200 @@
+"""
+Horarios libres: horario semanal por médico menos las citas ocupadas.
+
+El horario de trabajo es una máscara de bits por día de la semana (bit k =
+bloque de SLOT_MINUTES que empieza en k * SLOT_MINUTES desde medianoche) y se
+guarda en Medico.horario como siete enteros en hexadecimal. Los huecos libres
+salen de un barrido sobre los intervalos de trabajo y los ocupados, ambos
+ordenados. La búsqueda por especialidad mezcla en un heap los huecos de cada
+médico y consulta las citas de un médico solo cuando le toca el turno.
+
+    python availability.py horario 3 "lun-vie 09:00-14:00,16:00-19:00; sab 09:00-13:00"
+"""
+import heapq
+import os
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import Medico, Usuario, normalizar
+from utils import busy_intervals
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DIAS = ("lun", "mar", "mie", "jue", "vie", "sab", "dom")  # índice = datetime.weekday()
+WORKING_HOURS = os.environ.get("WORKING_HOURS", "lun-vie 09:00-17:00")
+AVAILABILITY_MAX_DAYS = int(os.environ.get("AVAILABILITY_MAX_DAYS", 62))
+
+
+def _bloque(hora: str) -> int:
+    h, m = (int(x) for x in hora.split(":"))
+    minutos = h * 60 + m
+    if minutos % SLOT_MINUTES or not 0 <= minutos <= 24 * 60:
+        raise ValueError(f"Hora fuera de la cuadrícula de {SLOT_MINUTES} minutos: {hora}")
+    return minutos // SLOT_MINUTES
+
+
+class WeeklyHours:
+    """Siete máscaras de bits (lunes a domingo) con los bloques de trabajo."""
+
+    __slots__ = ("masks", "_runs")
+
+    def __init__(self, masks):
+        self.masks = tuple(masks)
+        # Tramos continuos [inicio, fin) en bloques, por día; se calculan una vez
+        self._runs = []
+        for mask in self.masks:
+            tramos, k = [], 0
+            while k < SLOTS_PER_DAY:
+                if mask >> k & 1:
+                    inicio = k
+                    while k < SLOTS_PER_DAY and mask >> k & 1:
+                        k += 1
+                    tramos.append((inicio, k))
+                else:
+                    k += 1
+            self._runs.append(tramos)
+
+    @classmethod
+    def decode(cls, texto):
+        """Desde Medico.horario; None o vacío = WORKING_HOURS."""
+        if not texto:
+            return cls.from_spec(WORKING_HOURS)
+        return cls(int(parte, 16) for parte in texto.split(","))
+
+    def encode(self) -> str:
+        return ",".join(format(mask, "x") for mask in self.masks)
+
+    @classmethod
+    def from_spec(cls, spec: str):
+        """'lun-vie 09:00-14:00,16:00-19:00; sab 09:00-13:00' -> WeeklyHours."""
+        masks = [0] * 7
+        for grupo in filter(None, (g.strip() for g in spec.split(";"))):
+            dias_txt, rangos_txt = grupo.split(None, 1)
+            dias = set()
+            for parte in normalizar(dias_txt).split(","):
+                if "-" in parte:
+                    a, b = (DIAS.index(d) for d in parte.split("-"))
+                    dias.update(range(a, b + 1))
+                else:
+                    dias.add(DIAS.index(parte))
+            for rango in rangos_txt.replace(" ", "").split(","):
+                inicio, fin = (_bloque(h) for h in rango.split("-"))
+                if fin <= inicio:
+                    raise ValueError(f"Rango vacío: {rango}")
+                bits = ((1 << (fin - inicio)) - 1) << inicio
+                for d in dias:
+                    masks[d] |= bits
+        return cls(masks)
+
+    def intervals(self, desde: datetime, hasta: datetime):
+        """Intervalos de trabajo [(inicio, fin)] dentro de [desde, hasta), ordenados."""
+        resultado = []
+        dia = datetime.combine(desde.date(), datetime.min.time())
+        paso = timedelta(minutes=SLOT_MINUTES)
+        while dia < hasta:
+            for a, b in self._runs[dia.weekday()]:
+                inicio, fin = max(dia + a * paso, desde), min(dia + b * paso, hasta)
+                if inicio < fin:
+                    resultado.append((inicio, fin))
+            dia += timedelta(days=1)
+        return resultado
+
+
+# ----------------- BARRIDO -----------------
+def free_intervals(trabajo, ocupado):
+    """
+    trabajo: intervalos disjuntos ordenados; ocupado: ordenados por inicio (pueden
+    traslaparse). Devuelve los tramos de trabajo sin ocupar, en un solo recorrido.
+    """
+    libres = []
+    j = 0
+    for inicio, fin in trabajo:
+        while j < len(ocupado) and ocupado[j][1] <= inicio:
+            j += 1
+        cursor, k = inicio, j
+        while k < len(ocupado) and ocupado[k][0] < fin:
+            if ocupado[k][0] > cursor:
+                libres.append((cursor, ocupado[k][0]))
+            cursor = max(cursor, ocupado[k][1])
+            k += 1
+        if cursor < fin:
+            libres.append((cursor, fin))
+    return libres
+
+
+def slots(libres, duracion: timedelta):
+    """Huecos de 'duracion' dentro de los tramos libres, alineados a SLOT_MINUTES."""
+    for inicio, fin in libres:
+        minutos = inicio.hour * 60 + inicio.minute
+        resto = (-minutos) % SLOT_MINUTES
+        t = inicio.replace(second=0, microsecond=0) + timedelta(minutes=resto)
+        if t < inicio:
+            t += timedelta(minutes=SLOT_MINUTES)
+        while t + duracion <= fin:
+            yield t, t + duracion
+            t += duracion
+
+
+# ----------------- CONSULTAS -----------------
+def _medicos(db, medico_id=None, especialidad=None):
+    q = db.query(Medico.id, Medico.horario, Medico.especialidad, Usuario.nombre, Usuario.apellido).join(
+        Usuario, Usuario.id == Medico.usuario_id
+    )
+    if medico_id is not None:
+        q = q.filter(Medico.id == medico_id)
+    if especialidad is not None:
+        q = q.filter(func.lower(Medico.especialidad) == especialidad.lower())
+    return q.order_by(Medico.id).all()
+
+
+def _slots_medico(db, fila, trabajo, duracion):
+    # Todas las citas bloquean, igual que has_overlap (también las canceladas)
+    ocupado = busy_intervals(db, fila.id, trabajo[0][0], trabajo[-1][1])
+    return slots(free_intervals(trabajo, ocupado), duracion)
+
+
+def find_slots(db, desde, hasta, duracion, medico_id=None, especialidad=None, limite=20):
+    """
+    Primeros 'limite' huecos libres [(inicio, fin, medico)] en [desde, hasta),
+    en orden cronológico, de un médico o de todos los de una especialidad.
+
+    Cada médico entra al heap con el inicio de su primer tramo de trabajo, que
+    es una cota inferior de su primer hueco; sus citas se consultan cuando esa
+    entrada sale del heap. Los médicos que empiezan después del último hueco
+    regresado no se consultan.
+    """
+    # (clave, medico_id, fila, hueco, resto): hueco None = médico sin consultar y resto sus tramos de trabajo
+    heap = []
+    for fila in _medicos(db, medico_id, especialidad):
+        trabajo = WeeklyHours.decode(fila.horario).intervals(desde, hasta)
+        if trabajo:
+            heap.append((trabajo[0][0], fila.id, fila, None, trabajo))
+    heapq.heapify(heap)
+    encontrados = []
+    while heap and len(encontrados) < limite:
+        _, mid, fila, hueco, resto = heapq.heappop(heap)
+        if hueco is None:
+            resto = _slots_medico(db, fila, resto, duracion)
+        else:
+            encontrados.append((*hueco, fila))
+        siguiente = next(resto, None)
+        if siguiente is not None:
+            heapq.heappush(heap, (siguiente[0], mid, fila, siguiente, resto))
+    return encontrados
+
+if __name__ == "__main__":
+    from database import SessionLocal, init_db
+
+    if len(sys.argv) != 4 or sys.argv[1] != "horario":
+        sys.exit(__doc__.strip().splitlines()[-1].strip())
+    init_db()
+    horario = WeeklyHours.from_spec(sys.argv[3])
+    db = SessionLocal()
+    medico = db.get(Medico, int(sys.argv[2]))
+    if medico is None:
+        sys.exit("Médico no encontrado")
+    medico.horario = horario.encode()
+    db.commit()
+    print(f"Médico {medico.id}: {horario.encode()}")
@@ -0,0 +1,108 @@
+"""
+Inicios de sesión por segundo con el hash en el hilo del request y en el pool.
+
+    python benchmarks/bench_login.py --hilos 16 --logins 200
+
+Lanza 'hilos' clientes que inician sesión en paralelo (cada login verifica un
+hash con PASSWORD_HASH_METHOD) y, mientras tanto, un cliente que pide /login
+por GET para medir cuánto esperan las demás peticiones durante el pico. Los
+logins que no consiguen lugar en HASH_WAIT_SECONDS se cuentan como 503.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'bench.db')}")
+
+from sqlalchemy import insert  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import passwords  # noqa: E402
+from app import app  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from models import Usuario, TipoUsuario  # noqa: E402
+
+
+def poblar(n):
+    pwhash = generate_password_hash("bench", passwords.PASSWORD_HASH_METHOD)
+    with SessionLocal.session_factory() as db:
+        db.execute(insert(Usuario), [
+            dict(nombre=f"P{i}", apellido="Bench", email=f"p{i}@bench", password_hash=pwhash,
+                 tipo=TipoUsuario.PACIENTE)
+            for i in range(n)
+        ])
+        db.commit()
+
+
+def pico(hilos, logins, usuarios):
+    """(logins/s, códigos de los logins fallidos, latencias de GET /login durante el pico)."""
+    pendientes = iter(range(logins))
+    lock = threading.Lock()
+    errores = []
+    latencias = []
+    terminado = threading.Event()
+
+    def cliente():
+        c = app.test_client()
+        while True:
+            with lock:
+                i = next(pendientes, None)
+            if i is None:
+                return
+            r = c.post("/login", data={"email": f"p{i % usuarios}@bench", "password": "bench"})
+            if r.status_code != 302 or r.location.endswith("/login"):
+                errores.append(r.status_code)
+
+    def sonda():
+        c = app.test_client()
+        while not terminado.is_set():
+            inicio = time.perf_counter()
+            c.get("/login")
+            latencias.append(time.perf_counter() - inicio)
+            time.sleep(0.01)
+
+    hilo_sonda = threading.Thread(target=sonda)
+    hilo_sonda.start()
+    inicio = time.perf_counter()
+    clientes = [threading.Thread(target=cliente) for _ in range(hilos)]
+    for t in clientes:
+        t.start()
+    for t in clientes:
+        t.join()
+    duracion = time.perf_counter() - inicio
+    terminado.set()
+    hilo_sonda.join()
+    return logins / duracion, errores, latencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hilos", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--usuarios", type=int, default=100)
+    args = parser.parse_args()
+
+    app.config["TESTING"] = True
+    poblar(args.usuarios)
+    procesos = passwords.HASH_WORKERS or os.cpu_count() or 1
+    for nombre, workers in (("en el hilo", 0), (f"pool de {procesos}", procesos)):
+        passwords.shutdown()
+        passwords.HASH_WORKERS = workers
+        pico(min(args.hilos, 4), min(args.logins, 8), args.usuarios)  # arranca el pool
+        por_segundo, errores, latencias = pico(args.hilos, args.logins, args.usuarios)
+        latencias.sort()
+        p95 = latencias[int(len(latencias) * 0.95) - 1] if latencias else float("nan")
+        print(f"{nombre:<12} {por_segundo:8.1f} logins/s   GET /login durante el pico: "
+              f"mediana {statistics.median(latencias) * 1e3:7.1f} ms  p95 {p95 * 1e3:7.1f} ms"
+              f"  ({errores.count(503)} con 503, {len(errores) - errores.count(503)} otros errores)")
+    passwords.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compara has_overlap por SQL contra el índice de agendas en memoria.
+
+    python benchmarks/bench_overlap.py --medicos 50 --citas 200000 --consultas 20000
+
+Usa una base SQLite temporal; además de los tiempos verifica que ambos caminos
+respondan lo mismo para cada consulta.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'bench.db')}")
+
+from sqlalchemy import insert  # noqa: E402
+
+from database import SessionLocal, init_db  # noqa: E402
+from models import Usuario, Medico, Cita, TipoUsuario, EstadoCita  # noqa: E402
+from interval_index import agenda_index  # noqa: E402
+from utils import sql_has_overlap  # noqa: E402
+
+
+def poblar(db, n_medicos, n_citas):
+    db.execute(insert(Usuario), [
+        dict(nombre=f"U{i}", apellido="Bench", email=f"u{i}@bench", password_hash="-", tipo=TipoUsuario.MEDICO)
+        for i in range(n_medicos + 1)
+    ])
+    db.execute(insert(Medico), [dict(usuario_id=i + 1, especialidad="General") for i in range(n_medicos)])
+    inicio = datetime(2024, 1, 1, 8)
+    por_medico = n_citas // n_medicos
+    filas = []
+    for mid in range(1, n_medicos + 1):
+        for k in range(por_medico):
+            start = inicio + timedelta(minutes=45 * k)
+            filas.append(dict(medico_id=mid, paciente_id=n_medicos + 1, start_at=start,
+                              end_at=start + timedelta(minutes=30), estado=EstadoCita.PENDIENTE))
+    db.execute(insert(Cita), filas)
+    db.commit()
+    return inicio, por_medico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--medicos", type=int, default=50)
+    parser.add_argument("--citas", type=int, default=200_000)
+    parser.add_argument("--consultas", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    inicio, por_medico = poblar(db, args.medicos, args.citas)
+    rnd = random.Random(args.seed)
+    consultas = []
+    for _ in range(args.consultas):
+        start = inicio + timedelta(minutes=rnd.randrange(0, 45 * por_medico))
+        consultas.append((rnd.randint(1, args.medicos), start, start + timedelta(minutes=rnd.choice((10, 15, 30)))))
+
+    t0 = time.perf_counter()
+    sql = [sql_has_overlap(db, *c) for c in consultas]
+    t_sql = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for mid in range(1, args.medicos + 1):
+        agenda_index.overlaps(db, mid, inicio, inicio)  # carga inicial, se reporta aparte
+    t_carga = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    idx = [agenda_index.overlaps(db, *c) for c in consultas]
+    t_idx = time.perf_counter() - t0
+
+    diferencias = sum(a != b for a, b in zip(sql, idx))
+    print(f"citas={args.citas} medicos={args.medicos} consultas={args.consultas}")
+    print(f"sql:    {t_sql:8.3f}s  {t_sql / args.consultas * 1e6:8.1f} us/consulta")
+    print(f"indice: {t_idx:8.3f}s  {t_idx / args.consultas * 1e6:8.1f} us/consulta (carga {t_carga:.3f}s)")
+    print(f"diferencias: {diferencias}")
+    return 1 if diferencias else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
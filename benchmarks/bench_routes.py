@@ -0,0 +1,512 @@
+"""
+Latencia, consultas por petición y memoria de cada ruta de app.py, como línea base en JSON.
+
+    python benchmarks/bench_routes.py --db bench.db --modo ambos -o base.json
+    python benchmarks/bench_routes.py --db bench.db --modo ambos -o nuevo.json --comparar base.json
+
+--db es una base de generate_data.py (sin --db se genera una chica en un
+directorio temporal). Cada modo trabaja sobre una copia, así que los
+escenarios que escriben no alteran la base ni la corrida siguiente.
+
+Cada escenario corre por separado con 'concurrencia' clientes en paralelo, ya
+con sesión iniciada: con el test client de Flask en este proceso (modo
+cliente) o por HTTP contra server.py con DB_PROFILE=production (modo http).
+Por escenario se reportan p50/p95/p99 en ms, peticiones por segundo, errores y
+consultas por petición (de los contadores de /metrics); por modo, el RSS
+máximo (de este proceso en modo cliente, del proceso más grande del servidor
+en modo http). Las redirecciones no se siguen: un POST mide solo el POST.
+
+Quedan fuera /logout (cerraría la sesión del cliente), /metrics (lo usa el
+propio harness) y el POST de /admin/importar (carga masiva, ver importer.py);
+/assets solo entra si existe static/dist (python assets.py build). Al
+arrancar se avisa de cualquier otra ruta sin escenario.
+
+Con --comparar se imprime el cambio de p95 y de consultas por escenario y se
+sale con código 1 si alguno empeora más de --umbral por ciento (o si hace más
+consultas que en la base).
+"""
+import argparse
+import json
+import math
+import os
+import re
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import quote, urlencode, urlsplit
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from generate_data import BENCH_PASSWORD  # noqa: E402
+
+MINIMO_MS = 1.0  # por debajo de esta diferencia de p95 no se considera regresión (ruido)
+CANCELABLES = 2000
+
+# rol: admin / medico / paciente con sesión; anon = cliente nuevo en cada petición
+# url y datos aceptan {campos} de la muestra o una función (muestra, i)
+Escenario = namedtuple("Escenario", "nombre rol metodo url datos esperado destino pesado",
+                       defaults=(None, 200, None, False))
+
+
+def hueco(anios, i):
+    """Intervalo de 30 min único para la petición i, 'anios' años adelante (no choca con las citas generadas)."""
+    inicio = datetime(date.today().year + anios, 1, 1, 8) + timedelta(days=i // 16, minutes=30 * (i % 16))
+    fin = inicio + timedelta(minutes=30)
+    return dict(start_at=inicio.isoformat(timespec="minutes"), end_at=fin.isoformat(timespec="minutes"))
+
+
+ESCENARIOS = [
+    Escenario("inicio_medico", "medico", "GET", "/"),
+    Escenario("inicio_paciente", "paciente", "GET", "/"),
+    Escenario("login_form", "anon", "GET", "/login"),
+    Escenario("registro_form", "anon", "GET", "/register"),
+    Escenario("citas_admin", "admin", "GET", "/citas"),
+    Escenario("citas_paciente", "paciente", "GET", "/citas"),
+    Escenario("citas_fragmento", "medico", "GET", "/citas/fragmento?vista=concluidas"),
+    Escenario("cita_nueva_form", "paciente", "GET", "/citas/nueva"),
+    Escenario("cita_editar_form", "medico", "GET", "/citas/{cita_id}/editar"),
+    Escenario("doctor_cita_nueva_form", "medico", "GET", "/doctor/citas/nueva"),
+    Escenario("disponibilidad_medico", "paciente", "GET", "/api/disponibilidad?medico_id={medico_id}"),
+    Escenario("disponibilidad_especialidad", "paciente", "GET", "/api/disponibilidad?especialidad={especialidad}"),
+    Escenario("export_citas", "admin", "GET", "/export/citas.csv?medico_id={medico_id}", pesado=True),
+    Escenario("export_pacientes", "medico", "GET", "/export/pacientes.csv", pesado=True),
+    Escenario("importar_form", "admin", "GET", "/admin/importar"),
+    Escenario("doctores", "admin", "GET", "/doctores"),
+    Escenario("doctor_perfil", "medico", "GET", "/doctor/{medico_id}"),
+    Escenario("doctor_consultas", "medico", "GET", "/doctor/consultas"),
+    Escenario("doctor_concluidas", "medico", "GET", "/doctor/consultas/concluidas"),
+    Escenario("doctor_expedientes", "medico", "GET", "/doctor/expedientes"),
+    Escenario("doctor_paciente_form", "medico", "GET", "/doctor/pacientes/nuevo"),
+    Escenario("expediente", "medico", "GET", "/expediente/{paciente_id}"),
+    Escenario("expediente_form", "medico", "GET", "/expediente/{paciente_id}/editar"),
+    Escenario("buscar_api", "medico", "GET", "/api/pacientes/buscar?q={q}"),
+    Escenario("sugerencias", "medico", "GET", "/api/pacientes/sugerencias?q={prefijo}"),
+    Escenario("buscar_expedientes", "admin", "GET", "/expedientes/buscar?q={q}"),
+    Escenario("static", "anon", "GET", "/static/css/layout.css"),
+    # Escrituras al final: cambian conteos y ETags de las lecturas
+    Escenario("login", "anon", "POST", "/login", lambda m, i: dict(email=m["paciente_email"], password=BENCH_PASSWORD),
+              302, "/"),
+    Escenario("registro", "anon", "POST", "/register",
+              lambda m, i: dict(nombre="Bench", apellido="Registro", email=f"registro.{i}@bench.local",
+                                password=BENCH_PASSWORD), 302, "/login"),
+    Escenario("cita_nueva", "paciente", "POST", "/citas/nueva",
+              lambda m, i: dict(medico_id=m["medico_id"], **hueco(3, i)), 302, "/citas"),
+    Escenario("doctor_cita_nueva", "medico", "POST", "/doctor/citas/nueva",
+              lambda m, i: dict(medico_id=m["medico_id"], paciente_id=m["paciente_id"], **hueco(4, i)),
+              302, "/doctor/consultas"),
+    Escenario("cita_editar", "medico", "POST", "/citas/{cita_id}/editar",
+              lambda m, i: dict(estado="CONFIRMADA", notas="Reagendada", **hueco(5, i)), 302, "/citas"),
+    Escenario("doctor_paciente_nuevo", "medico", "POST", "/doctor/pacientes/nuevo",
+              lambda m, i: dict(nombre="Bench", apellido="Nuevo", email=f"nuevo.{i}@bench.local",
+                                medico_id=m["medico_id"], **hueco(6, i)), 302, "/doctor/consultas"),
+    Escenario("expediente_editar", "medico", "POST", "/expediente/{paciente_id}/editar",
+              lambda m, i: dict(antecedentes=m["antecedentes"], alergias=m["alergias"], notas_clinicas=m["notas"]),
+              302, lambda m: f"/expediente/{m['paciente_id']}"),
+    Escenario("cita_cancelar", "admin", "POST", lambda m, i: f"/citas/{m['cancelables'][i % CANCELABLES]}/cancelar",
+              None, 302, "/citas"),
+]
+EXCLUIDAS = {("logout", "GET"), ("metrics", "GET"), ("admin_importar", "POST")}
+
+
+# ----------------- DATOS -----------------
+def _muestra():
+    """Ids, correos y términos de búsqueda reales de la base para armar las URLs."""
+    from sqlalchemy import select, func
+
+    from assets import DIST
+    from app import app, assets
+    from database import SessionLocal
+    from models import Usuario, Medico, Cita, Expediente, EstadoCita, TipoUsuario
+
+    with SessionLocal.session_factory() as db:
+        medico_id, especialidad = db.execute(
+            select(Medico.id, Medico.especialidad)
+            .join(Usuario, Medico.usuario_id == Usuario.id)
+            .where(Usuario.email == "medico0@bench.local")
+        ).one()
+        # El paciente con más citas con ese médico: el caso caro de sus vistas
+        paciente_id = db.scalar(
+            select(Cita.paciente_id).where(Cita.medico_id == medico_id)
+            .group_by(Cita.paciente_id).order_by(func.count().desc()).limit(1)
+        )
+        email, nombre, apellido = db.execute(
+            select(Usuario.email, Usuario.nombre, Usuario.apellido).where(Usuario.id == paciente_id)
+        ).one()
+        expediente = db.execute(
+            select(Expediente.antecedentes, Expediente.alergias, Expediente.notas_clinicas)
+            .where(Expediente.paciente_id == paciente_id)
+        ).first() or ("", "", "")
+        muestra = dict(
+            medico_id=medico_id,
+            medico_email="medico0@bench.local",
+            especialidad=quote(especialidad),
+            paciente_id=paciente_id,
+            paciente_email=email,
+            q=quote(apellido.split()[0]),
+            prefijo=quote(nombre[:3]),
+            cita_id=db.scalar(
+                select(Cita.id).where(Cita.medico_id == medico_id, Cita.paciente_id == paciente_id)
+                .order_by(Cita.start_at.desc()).limit(1)
+            ),
+            cancelables=db.scalars(
+                select(Cita.id).where(Cita.estado == EstadoCita.PENDIENTE, Cita.start_at > datetime.now())
+                .order_by(Cita.id).limit(CANCELABLES)
+            ).all(),
+            antecedentes=expediente[0] or "", alergias=expediente[1] or "", notas=expediente[2] or "",
+        )
+        datos = dict(
+            medicos=db.scalar(select(func.count()).select_from(Medico)),
+            pacientes=db.scalar(select(func.count()).select_from(Usuario).where(Usuario.tipo == TipoUsuario.PACIENTE)),
+            citas=db.scalar(select(func.count()).select_from(Cita)),
+        )
+
+    escenarios = list(ESCENARIOS)
+    if assets.manifest:
+        # Un archivo con hash de static/dist, el mismo que pide el navegador
+        hashed = assets.manifest.get("css/layout.css") or next(iter(assets.manifest.values()))
+        escenarios.insert(-len([e for e in ESCENARIOS if e.metodo == "POST"]),
+                          Escenario("assets", "anon", "GET", f"/assets/{hashed}"))
+    else:
+        print(f"Aviso: sin static/{DIST}, /assets queda fuera (python assets.py build)", file=sys.stderr)
+    return app, muestra, datos, escenarios
+
+
+def _endpoints(app, escenarios, muestra):
+    """Endpoint de cada escenario (para leer sus contadores) y aviso de las rutas sin escenario."""
+    adaptador = app.url_map.bind("localhost")
+    endpoints = {}
+    for e in escenarios:
+        url = e.url(muestra, 0) if callable(e.url) else e.url.format(**muestra)
+        endpoints[e.nombre] = adaptador.match(urlsplit(url).path, e.metodo)[0]
+    cubiertas = {(endpoints[e.nombre], e.metodo) for e in escenarios}
+    for regla in app.url_map.iter_rules():
+        for metodo in sorted(regla.methods - {"HEAD", "OPTIONS"}):
+            if (regla.endpoint, metodo) not in cubiertas | EXCLUIDAS:
+                print(f"Aviso: {metodo} {regla.rule} ({regla.endpoint}) no tiene escenario", file=sys.stderr)
+    return endpoints
+
+
+# ----------------- CLIENTES -----------------
+class _ClienteFlask:
+    def __init__(self, app):
+        self.cliente = app.test_client()
+
+    def pedir(self, metodo, url, datos=None):
+        r = self.cliente.open(url, method=metodo, data=datos)
+        try:
+            return r.status_code, r.headers.get("Location"), r.get_data()
+        finally:
+            r.close()
+
+
+class _SinRedirecciones(HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class ClienteHTTP:
+    def __init__(self, base):
+        self.base = base
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), _SinRedirecciones)
+
+    def pedir(self, metodo, url, datos=None):
+        cuerpo = urlencode(datos).encode() if datos else None
+        try:
+            with self.opener.open(Request(self.base + url, data=cuerpo, method=metodo), timeout=120) as r:
+                return r.status, r.headers.get("Location"), r.read()
+        except HTTPError as e:
+            return e.code, e.headers.get("Location"), e.read()
+
+
+def _sesion(nuevo, email):
+    cliente = nuevo()
+    estado, destino, _ = cliente.pedir("POST", "/login", dict(email=email, password=BENCH_PASSWORD))
+    if estado != 302 or urlsplit(destino or "").path != "/":
+        raise SystemExit(f"No se pudo iniciar sesión como {email} (estado {estado})")
+    return cliente
+
+
+_CONTADOR = re.compile(r'^(hs_sql_queries_total|hs_request_duration_seconds_count)\{endpoint="([^"]+)"\} (\S+)$')
+
+
+def _contadores(cliente):
+    """{endpoint: [consultas, requests]} de /metrics."""
+    estado, _, cuerpo = cliente.pedir("GET", "/metrics")
+    if estado != 200:
+        raise SystemExit(f"/metrics respondió {estado}: revisa METRICS y METRICS_ALLOW")
+    contadores = {}
+    for linea in cuerpo.decode().splitlines():
+        m = _CONTADOR.match(linea)
+        if m:
+            fila = contadores.setdefault(m.group(2), [0.0, 0.0])
+            fila[m.group(1) == "hs_request_duration_seconds_count"] = float(m.group(3))
+    return contadores
+
+
+# ----------------- CORRIDA -----------------
+def percentil(ordenadas, q):
+    return ordenadas[max(0, math.ceil(q * len(ordenadas)) - 1)]
+
+
+def _correr(escenario, muestra, sesiones, nuevo, veces, inicio_i):
+    """Latencias (s), errores y duración de 'veces' peticiones repartidas entre los clientes de 'sesiones'."""
+    pendientes = iter(range(inicio_i, inicio_i + veces))
+    lock = threading.Lock()
+    latencias = []
+    errores = []
+    destino = escenario.destino(muestra) if callable(escenario.destino) else escenario.destino
+
+    def trabajar(cliente):
+        while True:
+            with lock:
+                i = next(pendientes, None)
+            if i is None:
+                return
+            url = escenario.url(muestra, i) if callable(escenario.url) else escenario.url.format(**muestra)
+            datos = escenario.datos(muestra, i) if escenario.datos else None
+            c = nuevo() if cliente is None else cliente
+            t0 = time.perf_counter()
+            estado, location, _ = c.pedir(escenario.metodo, url, datos)
+            duracion = time.perf_counter() - t0
+            with lock:
+                latencias.append(duracion)
+                if estado != escenario.esperado or (destino and urlsplit(location or "").path != destino):
+                    errores.append(f"{estado} {location or ''}".strip())
+
+    hilos = [threading.Thread(target=trabajar, args=(s.get(escenario.rol),)) for s in sesiones]
+    t0 = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return latencias, errores, time.perf_counter() - t0
+
+
+def _modo(nuevo, muestra, escenarios, endpoints, args, espera=0.0):
+    """Corre todos los escenarios con clientes creados por nuevo(); regresa {nombre: resultado}."""
+    metricas = nuevo()
+    sesiones = [
+        dict(admin=_sesion(nuevo, "admin@bench.local"), medico=_sesion(nuevo, muestra["medico_email"]),
+             paciente=_sesion(nuevo, muestra["paciente_email"]))
+        for _ in range(args.concurrencia)
+    ]
+    rutas = {}
+    for e in escenarios:
+        veces = max(args.repeticiones // 10, 3) if e.pesado else args.repeticiones
+        calentamiento = min(veces, args.concurrencia)
+        _correr(e, muestra, sesiones, nuevo, calentamiento, 0)
+        time.sleep(espera)
+        antes = _contadores(metricas)
+        latencias, errores, duracion = _correr(e, muestra, sesiones, nuevo, veces, calentamiento)
+        time.sleep(espera)
+        despues = _contadores(metricas)
+
+        endpoint = endpoints[e.nombre]
+        consultas, requests = (d - a for d, a in zip(despues.get(endpoint, (0, 0)), antes.get(endpoint, (0, 0))))
+        latencias.sort()
+        rutas[e.nombre] = r = dict(
+            metodo=e.metodo, endpoint=endpoint, peticiones=veces,
+            p50_ms=round(percentil(latencias, 0.50) * 1e3, 2),
+            p95_ms=round(percentil(latencias, 0.95) * 1e3, 2),
+            p99_ms=round(percentil(latencias, 0.99) * 1e3, 2),
+            rps=round(veces / duracion, 1),
+            consultas=round(consultas / requests, 2) if requests else None,
+            errores=len(errores),
+        )
+        if errores:
+            r["ejemplo_error"] = errores[0]
+        print(f"  {e.nombre:<28} p50 {r['p50_ms']:8.2f}  p95 {r['p95_ms']:8.2f}  p99 {r['p99_ms']:8.2f} ms"
+              f"  {r['rps']:7.1f}/s  consultas {r['consultas'] if r['consultas'] is not None else '-':>5}"
+              f"  errores {r['errores']}{' (' + errores[0] + ')' if errores else ''}")
+    return rutas
+
+
+def _modo_cliente(app, muestra, escenarios, endpoints, args):
+    import passwords
+
+    print(f"Modo cliente (test client, {args.concurrencia} hilos)")
+    rutas = _modo(lambda: _ClienteFlask(app), muestra, escenarios, endpoints, args)
+    passwords.shutdown()
+    # ru_maxrss está en KiB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 ** 2)
+    return dict(rutas=rutas, rss_max_mb=round(rss, 1))
+
+
+def _vmhwm_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _procesos(pid):
+    """pid y todos sus descendientes (Linux)."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            hijos = [int(p) for p in f.read().split()]
+    except OSError:
+        hijos = []
+    return [pid] + [p for h in hijos for p in _procesos(h)]
+
+
+def _modo_http(db_url, muestra, escenarios, endpoints, args, directorio):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    env = dict(os.environ, DATABASE_URL=db_url, DB_PROFILE="production", METRICS="1", METRICS_FLUSH_SECONDS="0.5",
+               METRICS_ALLOW="127.0.0.1")
+    env.pop("METRICS_DIR", None)
+    env.pop("METRICS_TOKEN", None)
+    bitacora = os.path.join(directorio, "server.log")
+    with open(bitacora, "w") as salida:
+        servidor = subprocess.Popen(
+            [sys.executable, os.path.join(RAIZ, "server.py"), "--host", "127.0.0.1", "--port", str(puerto),
+             "--workers", str(args.workers)],
+            env=env, stdout=salida, stderr=subprocess.STDOUT,
+        )
+    try:
+        limite = time.monotonic() + 60
+        while True:
+            if servidor.poll() is not None:
+                with open(bitacora) as f:
+                    raise SystemExit(f"server.py terminó al arrancar:\n{f.read()[-2000:]}")
+            try:
+                socket.create_connection(("127.0.0.1", puerto), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > limite:
+                    raise SystemExit("server.py no abrió el puerto en 60 s")
+                time.sleep(0.2)
+        print(f"Modo http (server.py con {args.workers} workers, {args.concurrencia} clientes)")
+        # Con varios workers /metrics suma lo que cada uno vuelca cada METRICS_FLUSH_SECONDS
+        espera = 1.6 if args.workers > 1 else 0.0
+        base = f"http://127.0.0.1:{puerto}"
+        rutas = _modo(lambda: ClienteHTTP(base), muestra, escenarios, endpoints, args, espera)
+        rss = [_vmhwm_mb(p) for p in _procesos(servidor.pid)]
+        rss = [r for r in rss if r is not None]
+    finally:
+        servidor.send_signal(signal.SIGTERM)
+        try:
+            servidor.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            servidor.kill()
+    return dict(rutas=rutas, workers=args.workers, rss_max_mb=round(max(rss), 1) if rss else None)
+
+
+def _copiar(origen, destino):
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(destino + sufijo):
+            os.remove(destino + sufijo)
+        if os.path.exists(origen + sufijo):
+            shutil.copyfile(origen + sufijo, destino + sufijo)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=RAIZ, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ----------------- COMPARACIÓN -----------------
+def comparar(base, nuevo, umbral):
+    """Imprime p95 y consultas de 'nuevo' contra 'base'; regresa el número de regresiones."""
+    regresiones = 0
+    for modo, resultado in nuevo["modos"].items():
+        anterior = base.get("modos", {}).get(modo)
+        if not anterior:
+            continue
+        print(f"{modo}: {base.get('commit', '?')[:10]} -> {nuevo.get('commit', '?')[:10]}")
+        for nombre, r in resultado["rutas"].items():
+            a = anterior["rutas"].get(nombre)
+            if not a:
+                print(f"  {nombre:<28} (nuevo)")
+                continue
+            cambio = (r["p95_ms"] - a["p95_ms"]) / a["p95_ms"] * 100 if a["p95_ms"] else 0.0
+            peor = cambio > umbral and r["p95_ms"] - a["p95_ms"] > MINIMO_MS
+            mas_consultas = None not in (a["consultas"], r["consultas"]) and r["consultas"] > a["consultas"]
+            marca = "  <-- REGRESIÓN" if peor or mas_consultas else ""
+            regresiones += bool(marca)
+            print(f"  {nombre:<28} p95 {a['p95_ms']:8.2f} -> {r['p95_ms']:8.2f} ms ({cambio:+6.1f} %)"
+                  f"  consultas {a['consultas']} -> {r['consultas']}{marca}")
+        if anterior.get("rss_max_mb") and resultado.get("rss_max_mb"):
+            print(f"  RSS máximo {anterior['rss_max_mb']} -> {resultado['rss_max_mb']} MB")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="base de generate_data.py (sin ella se genera una chica)")
+    parser.add_argument("--modo", choices=["cliente", "http", "ambos"], default="ambos")
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--repeticiones", type=int, default=50, help="peticiones por escenario (exportes: 1/10)")
+    parser.add_argument("--workers", type=int, default=2, help="workers de server.py en modo http")
+    parser.add_argument("-o", "--salida", help="archivo JSON con los resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    parser.add_argument("--umbral", type=float, default=20.0, help="%% de aumento de p95 que cuenta como regresión")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="hs-bench-")
+    copia = os.path.join(directorio, "bench.db")
+    if args.db:
+        original = os.path.abspath(args.db)
+        if not os.path.exists(original):
+            raise SystemExit(f"No existe {original}: créala con benchmarks/generate_data.py")
+    else:
+        original = os.path.join(directorio, "original.db")
+        subprocess.run([sys.executable, os.path.join(RAIZ, "benchmarks", "generate_data.py"), original,
+                        "--medicos", "50", "--pacientes", "10000", "--citas", "200000"], check=True)
+    _copiar(original, copia)
+
+    # La app se importa ya con la copia: el modo cliente la usa y el http la toma para la muestra
+    db_url = f"sqlite:///{copia}"
+    os.environ["DATABASE_URL"] = db_url
+    os.environ.setdefault("DB_PROFILE", "production")
+    os.environ["METRICS_ALLOW"] = "127.0.0.1"  # el harness lee /metrics; sin esto la app lo niega
+    app, muestra, datos, escenarios = _muestra()
+    endpoints = _endpoints(app, escenarios, muestra)
+
+    resultado = dict(commit=_commit(), fecha=datetime.now().isoformat(timespec="seconds"), datos=datos,
+                     concurrencia=args.concurrencia, repeticiones=args.repeticiones, modos={})
+    if args.modo in ("cliente", "ambos"):
+        resultado["modos"]["cliente"] = _modo_cliente(app, muestra, escenarios, endpoints, args)
+    if args.modo in ("http", "ambos"):
+        from database import engine, read_engine
+
+        engine.dispose()
+        read_engine.dispose()
+        _copiar(original, copia)  # sin las escrituras del modo cliente
+        resultado["modos"]["http"] = _modo_http(db_url, muestra, escenarios, endpoints, args, directorio)
+    for modo, r in resultado["modos"].items():
+        print(f"RSS máximo ({modo}): {r['rss_max_mb']} MB")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    shutil.rmtree(directorio, ignore_errors=True)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        if comparar(base, resultado, args.umbral):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Mide la compilación de las plantillas y el render de los listados de citas.
+
+    python benchmarks/bench_templates.py --filas 50 --repeticiones 500
+
+Compilación: todas las plantillas en un Environment nuevo (como en cada
+arranque) sin caché de bytecode y con la caché ya escrita en disco.
+Render: appointments_list.html y dashboard.html con la caché de fragmentos
+apagada y con la caché caliente; verifica que el HTML sea el mismo.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'bench.db')}")
+os.environ.setdefault("TEMPLATE_CACHE_DIR", "")  # la caché de bytecode se mide aparte
+
+from flask import render_template  # noqa: E402
+from flask_login import login_user  # noqa: E402
+from jinja2 import Environment, FileSystemLoader  # noqa: E402
+
+import templating  # noqa: E402
+from app import app  # noqa: E402
+from cache import CachedUser  # noqa: E402
+from models import Usuario, Medico, Cita, TipoUsuario, EstadoCita  # noqa: E402
+from templating import FragmentCacheExtension, TemplateBytecodeCache  # noqa: E402
+
+
+def compilar_todo(bytecode_cache):
+    env = Environment(
+        loader=FileSystemLoader(app.template_folder if os.path.isabs(app.template_folder)
+                                else os.path.join(app.root_path, app.template_folder)),
+        extensions=[FragmentCacheExtension],
+        bytecode_cache=bytecode_cache,
+    )
+    for nombre in env.list_templates():
+        env.get_template(nombre)
+
+
+def medir(fn, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        fn()
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+def citas_de_prueba(n):
+    du = Usuario(id=1, nombre="Doc", apellido="Bench", email="d@bench", tipo=TipoUsuario.MEDICO)
+    medico = Medico(id=1, usuario_id=1, especialidad="General", usuario=du)
+    inicio = datetime(2030, 1, 1, 8)
+    citas = []
+    for i in range(n):
+        paciente = Usuario(id=100 + i, nombre=f"Paciente{i}", apellido="Bench", email=f"p{i}@bench",
+                           tipo=TipoUsuario.PACIENTE)
+        citas.append(Cita(id=i + 1, medico_id=1, paciente_id=paciente.id, medico=medico, paciente=paciente,
+                          start_at=inicio + timedelta(hours=i), end_at=inicio + timedelta(hours=i, minutes=30),
+                          estado=[EstadoCita.PENDIENTE, EstadoCita.ATENDIDA, EstadoCita.CANCELADA][i % 3]))
+    return citas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filas", type=int, default=50)
+    parser.add_argument("--repeticiones", type=int, default=500)
+    args = parser.parse_args()
+
+    # ---- compilación ----
+    n = max(1, args.repeticiones // 25)
+    sin_bc = medir(lambda: compilar_todo(None), n)
+    bc_dir = tempfile.mkdtemp()
+    compilar_todo(TemplateBytecodeCache(bc_dir))  # escribe la caché
+    con_bc = medir(lambda: compilar_todo(TemplateBytecodeCache(bc_dir)), n)
+    print(f"Compilar todas las plantillas:  sin bytecode {sin_bc * 1e3:8.2f} ms   con bytecode {con_bc * 1e3:8.2f} ms"
+          f"   ({sin_bc / con_bc:.1f}x)")
+
+    # ---- render ----
+    citas = citas_de_prueba(args.filas)
+    usuario = CachedUser(1, "Doc", "Bench", TipoUsuario.MEDICO, 1)
+    vistas = {
+        "appointments_list.html": dict(citas=citas, EstadoCita=EstadoCita, next_cursor=None),
+        "dashboard.html": dict(citas=citas[:8], EstadoCita=EstadoCita, saludo="Hola", doctor_nombre="Dr. Doc Bench",
+                               pacientes=[c.paciente for c in citas], pending_counts={}),
+    }
+    with app.test_request_context("/"):
+        login_user(usuario)
+        for plantilla, contexto in vistas.items():
+            templating.FRAGMENT_CACHE = False
+            esperado = render_template(plantilla, **contexto)
+            sin_frag = medir(lambda: render_template(plantilla, **contexto), args.repeticiones)
+            templating.FRAGMENT_CACHE = True
+            templating.fragment_cache.clear()
+            obtenido = render_template(plantilla, **contexto)  # calienta la caché
+            con_frag = medir(lambda: render_template(plantilla, **contexto), args.repeticiones)
+            igual = "igual" if obtenido == esperado else "DIFERENTE"
+            print(f"Render {plantilla:<24} sin fragmentos {sin_frag * 1e6:8.1f} µs   con fragmentos "
+                  f"{con_frag * 1e6:8.1f} µs   ({sin_frag / con_frag:.1f}x, HTML {igual})")
+
+
+if __name__ == "__main__":
+    main()
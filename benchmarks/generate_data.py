@@ -0,0 +1,191 @@
+"""
+Genera una base SQLite con volúmenes realistas para los benchmarks.
+
+    python benchmarks/generate_data.py bench.db                       # 500 médicos, 200k pacientes, 5M citas
+    python benchmarks/generate_data.py chica.db --medicos 20 --pacientes 2000 --citas 50000
+
+Con la misma semilla y los mismos tamaños sale la misma base (las fechas se
+anclan al día en que se genera), así que los resultados de bench_routes.py son
+comparables entre commits. Todas las cuentas usan la contraseña BENCH_PASSWORD:
+
+    admin@bench.local         administrador
+    medico<i>@bench.local     médicos (i desde 0)
+    <nombre>.<apellido>.<i>@bench.local   pacientes
+
+Cada médico atiende a un panel de pacientes y sus citas no se traslapan: las
+pasadas quedan mayormente ATENDIDA o CANCELADA y las futuras PENDIENTE o
+CONFIRMADA. La mayoría de los pacientes tiene expediente con notas largas.
+Al final se reconstruyen doctor_paciente y el índice de búsqueda.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_PASSWORD = "bench"
+LOTE = 20_000
+
+NOMBRES = ("José", "María", "Juan", "Guadalupe", "Luis", "Ana", "Jesús", "Verónica", "Miguel", "Sofía",
+           "Ángel", "Lucía", "Andrés", "Mónica", "Raúl", "Inés", "Óscar", "Elena", "Iván", "Beatriz",
+           "Héctor", "Carmen", "Rubén", "Adriana", "Tomás", "Noemí", "Joaquín", "Rocío", "Martín", "Itzel")
+APELLIDOS = ("Hernández", "García", "Martínez", "López", "González", "Pérez", "Rodríguez", "Sánchez",
+             "Ramírez", "Cruz", "Flores", "Gómez", "Morales", "Vázquez", "Jiménez", "Reyes", "Díaz",
+             "Torres", "Gutiérrez", "Ruiz", "Mendoza", "Aguilar", "Ortiz", "Castillo", "Núñez", "Ríos",
+             "Domínguez", "Chávez", "Muñoz", "Ibáñez", "Peña", "Zúñiga", "Salazar", "Ortega", "Guzmán")
+ESPECIALIDADES = ("Medicina general", "Pediatría", "Cardiología", "Dermatología", "Ginecología",
+                  "Traumatología", "Psiquiatría", "Oftalmología", "Endocrinología", "Neurología")
+ANTECEDENTES = ("Hipertensión arterial", "Diabetes tipo 2", "Asma", "Hipotiroidismo", "Migraña",
+                "Apendicectomía", "Fractura de radio", "Dislipidemia", "Gastritis crónica", "Ninguno relevante")
+ALERGIAS = ("Penicilina", "Sulfas", "Polen", "Látex", "Mariscos", "Ácaros", "Ibuprofeno", "Ninguna conocida")
+FRASES = ("Paciente refiere dolor de intensidad moderada desde hace tres días.",
+          "Se indica control de presión arterial y dieta baja en sodio.",
+          "Exploración física sin hallazgos de importancia.",
+          "Se solicita biometría hemática, química sanguínea y examen general de orina.",
+          "Evolución favorable con el tratamiento previo; se ajusta la dosis.",
+          "Refiere apego parcial al tratamiento por efectos adversos gastrointestinales.",
+          "Se explica al paciente el plan de manejo y los signos de alarma.",
+          "Cita de seguimiento en cuatro semanas con resultados de laboratorio.",
+          "Antecedente familiar de cardiopatía isquémica en línea paterna.",
+          "Sin cambios en la sintomatología respecto a la consulta anterior.")
+
+
+def _ascii(texto):
+    from models import normalizar
+
+    return normalizar(texto).replace(" ", "")
+
+
+def _notas(rnd, minimo, maximo):
+    return " ".join(rnd.choice(FRASES) for _ in range(rnd.randint(minimo, maximo)))
+
+
+def _lotes(filas, tamano=LOTE):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _estado(rnd, pasada):
+    from models import EstadoCita
+
+    r = rnd.random()
+    if pasada:
+        return EstadoCita.ATENDIDA if r < 0.72 else EstadoCita.CANCELADA if r < 0.93 else EstadoCita.PENDIENTE
+    return EstadoCita.PENDIENTE if r < 0.6 else EstadoCita.CONFIRMADA if r < 0.9 else EstadoCita.CANCELADA
+
+
+def _citas(rnd, medico_ids, pacientes, n_citas, hoy):
+    """Citas sin traslapes por médico, en horario de 8 a 18 h entre semana, ~80 % en el pasado."""
+    por_medico = n_citas // len(medico_ids)
+    for medico_id in medico_ids:
+        panel = rnd.sample(pacientes, min(len(pacientes), max(20, por_medico // 12)))
+        # Algunos pacientes del panel son frecuentes: pesos tipo Zipf
+        pesos = [1 / (i + 1) for i in range(len(panel))]
+        inicio = hoy - timedelta(days=int(por_medico * 0.8 / 7) + 1)  # ~7 citas por día de calendario
+        cursor = inicio.replace(hour=8, minute=0, second=0, microsecond=0)
+        elegidos = rnd.choices(panel, pesos, k=por_medico)
+        for paciente_id in elegidos:
+            duracion = timedelta(minutes=rnd.choice((30, 30, 30, 45, 60)))
+            cursor += timedelta(minutes=rnd.choice((0, 0, 15, 30, 60)))
+            if cursor.weekday() >= 5 or cursor + duracion > cursor.replace(hour=18, minute=0):
+                cursor = (cursor + timedelta(days=1)).replace(hour=8, minute=0)
+                while cursor.weekday() >= 5:
+                    cursor += timedelta(days=1)
+            yield dict(medico_id=medico_id, paciente_id=paciente_id, start_at=cursor, end_at=cursor + duracion,
+                       estado=_estado(rnd, cursor < hoy),
+                       notas=_notas(rnd, 1, 2) if rnd.random() < 0.15 else None)
+            cursor += duracion
+
+
+def generate(n_medicos, n_pacientes, n_citas, seed=42, progreso=print):
+    """Llena la base de DATABASE_URL (debe estar vacía) y regresa los conteos insertados."""
+    from sqlalchemy import insert, select, func
+    from werkzeug.security import generate_password_hash
+
+    import roster
+    import search
+    from database import engine, init_db
+    from models import Usuario, Medico, Expediente, Cita, TipoUsuario
+    from passwords import PASSWORD_HASH_METHOD
+
+    init_db()
+    rnd = random.Random(seed)
+    pwhash = generate_password_hash(BENCH_PASSWORD, PASSWORD_HASH_METHOD)  # el mismo para todas las cuentas
+    hoy = datetime.now().replace(minute=0, second=0, microsecond=0)
+    inicio = time.monotonic()
+
+    with engine.begin() as conn:
+        if conn.scalar(select(func.count()).select_from(Usuario)):
+            raise SystemExit("La base ya tiene usuarios: usa un archivo nuevo.")
+        conn.exec_driver_sql("PRAGMA synchronous = OFF")
+
+        conn.execute(insert(Usuario), [dict(nombre="Admin", apellido="Bench", email="admin@bench.local",
+                                            password_hash=pwhash, tipo=TipoUsuario.ADMIN)])
+        medicos_u = [
+            dict(nombre=rnd.choice(NOMBRES), apellido=rnd.choice(APELLIDOS), email=f"medico{i}@bench.local",
+                 password_hash=pwhash, tipo=TipoUsuario.MEDICO)
+            for i in range(n_medicos)
+        ]
+        ids = conn.scalars(insert(Usuario).returning(Usuario.id, sort_by_parameter_order=True), medicos_u).all()
+        medico_ids = conn.scalars(
+            insert(Medico).returning(Medico.id, sort_by_parameter_order=True),
+            [dict(usuario_id=u, especialidad=ESPECIALIDADES[i % len(ESPECIALIDADES)]) for i, u in enumerate(ids)],
+        ).all()
+        progreso(f"{n_medicos} médicos ({time.monotonic() - inicio:.0f} s)")
+
+        pacientes = []
+        for lote in _lotes(range(n_pacientes)):
+            filas = []
+            for i in lote:
+                nombre, apellido = rnd.choice(NOMBRES), rnd.choice(APELLIDOS)
+                filas.append(dict(nombre=nombre, apellido=f"{apellido} {rnd.choice(APELLIDOS)}",
+                                  email=f"{_ascii(nombre)}.{_ascii(apellido)}.{i}@bench.local",
+                                  password_hash=pwhash, tipo=TipoUsuario.PACIENTE))
+            nuevos = conn.scalars(insert(Usuario).returning(Usuario.id, sort_by_parameter_order=True), filas).all()
+            pacientes += nuevos
+            conn.execute(insert(Expediente), [
+                dict(paciente_id=p, antecedentes=", ".join(rnd.sample(ANTECEDENTES, rnd.randint(1, 3))),
+                     alergias=rnd.choice(ALERGIAS), notas_clinicas=_notas(rnd, 5, 30))
+                for p in nuevos if rnd.random() < 0.9
+            ])
+            progreso(f"{len(pacientes)} pacientes ({time.monotonic() - inicio:.0f} s)")
+
+        total = 0
+        for lote in _lotes(_citas(rnd, medico_ids, pacientes, n_citas, hoy)):
+            conn.execute(insert(Cita), lote)
+            total += len(lote)
+            if total % (LOTE * 10) == 0:
+                progreso(f"{total} citas ({time.monotonic() - inicio:.0f} s)")
+
+        roster.rebuild(conn)
+        search.rebuild(conn)
+        conn.exec_driver_sql("ANALYZE")
+    progreso(f"Listo: {n_medicos} médicos, {len(pacientes)} pacientes, {total} citas "
+             f"({time.monotonic() - inicio:.0f} s)")
+    return dict(medicos=n_medicos, pacientes=len(pacientes), citas=total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("archivo", help="base SQLite nueva")
+    parser.add_argument("--medicos", type=int, default=500)
+    parser.add_argument("--pacientes", type=int, default=200_000)
+    parser.add_argument("--citas", type=int, default=5_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.archivo)}"
+    generate(args.medicos, args.pacientes, args.citas, args.seed)
+
+
+if __name__ == "__main__":
+    main()
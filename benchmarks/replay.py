@@ -0,0 +1,253 @@
+"""
+Reproduce una captura de capture.py contra una instancia local y compara latencias por endpoint.
+
+    python benchmarks/replay.py trafico.jsonl --db bench.db --url http://127.0.0.1:5000 --velocidad 10
+    python benchmarks/replay.py trafico.jsonl --db bench.db --tasa 50 --desde 2026-10-12T08:00 --hasta 2026-10-12T10:00
+
+La instancia debe usar una base de generate_data.py (--db es esa misma base):
+cada seudónimo de la captura se asigna a una cuenta de prueba del mismo rol y
+las sesiones se abren antes de empezar. Los ids de la captura se usan tal cual
+(contra otra base algunas escrituras se rechazan y cuentan como estado
+distinto); los campos reducidos a su forma se rellenan: <fechahora> con huecos
+futuros únicos, <email> con el de la cuenta en /login y con correos nuevos en
+los demás, <texto:n> con apellidos de generate_data.py y <password> con
+BENCH_PASSWORD. Se omiten /logout (cerraría la sesión del seudónimo), los
+requests con archivos y los de rutas desconocidas.
+
+El ritmo es el de la captura (--velocidad 1 = tiempo real, 10 = diez veces más
+rápido) o una tasa fija (--tasa, requests por segundo), con hasta --hilos
+requests en vuelo. Al final se imprime por endpoint p50/p95 grabados (en el
+servidor) contra los del replay (en el cliente), errores (5xx y estados
+distintos a los grabados) y cuántos requests salieron tarde de su hora.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from urllib.parse import quote, urlencode, urlsplit
+
+from bench_routes import ClienteHTTP, percentil, hueco
+from generate_data import APELLIDOS, BENCH_PASSWORD
+
+TARDE_S = 0.1  # un request que sale más de esto después de su hora cuenta como tarde
+OMITIR = {"logout"}
+
+_PARAMETRO = re.compile(r"<(?:([^:<>]+):)?([^<>]+)>")
+_FORMA = re.compile(r"<(\w+)(?::(\d+))?>")
+
+
+def _cargar(ruta, desde=None, hasta=None):
+    """Registros reproducibles ordenados por ts y cuántos se omitieron."""
+    registros, omitidos = [], 0
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            r = json.loads(linea)
+            if (desde and r["ts"] < desde) or (hasta and r["ts"] >= hasta):
+                continue
+            if r["ruta"] is None or r["archivos"] or r["endpoint"] in OMITIR:
+                omitidos += 1
+                continue
+            registros.append(r)
+    registros.sort(key=lambda r: r["ts"])
+    return registros, omitidos
+
+
+def _cuentas(db_path):
+    """{rol: [emails]} de las cuentas de prueba de la base."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(db_path)}"
+    from sqlalchemy import select
+
+    from database import SessionLocal
+    from models import Usuario, TipoUsuario
+
+    with SessionLocal.session_factory() as db:
+        return {
+            tipo.value.lower(): db.scalars(
+                select(Usuario.email)
+                .where(Usuario.tipo == tipo, Usuario.email.like("%@bench.local"))
+                .order_by(Usuario.id)
+            ).all()
+            for tipo in TipoUsuario
+        }
+
+
+def _asignar(registros, cuentas):
+    """{seudónimo: email}: cada seudónimo a una cuenta de su rol, en orden de aparición."""
+    asignadas, usadas = {}, defaultdict(int)
+    for r in registros:
+        seudonimo, rol = r["usuario"], r["rol"]
+        if seudonimo is None or seudonimo in asignadas:
+            continue
+        if not cuentas.get(rol):
+            raise SystemExit(f"La base no tiene cuentas de prueba con rol {rol}: usa una de generate_data.py")
+        asignadas[seudonimo] = cuentas[rol][usadas[rol] % len(cuentas[rol])]
+        usadas[rol] += 1
+    return asignadas
+
+
+def _texto(largo, n):
+    palabras = []
+    while sum(len(p) + 1 for p in palabras) <= largo:
+        palabras.append(APELLIDOS[(n + len(palabras)) % len(APELLIDOS)])
+    return " ".join(palabras)[:max(largo, 1)]
+
+
+def _rellenar(campos, n, email):
+    """Campos con los valores de la captura y las formas (<...>) sustituidas por valores de prueba."""
+    intervalo = hueco(7, n)
+    valores = {}
+    for nombre, valor in campos.items():
+        m = _FORMA.fullmatch(valor) if isinstance(valor, str) else None
+        if m is None:
+            valores[nombre] = valor
+        elif m.group(1) == "password":
+            valores[nombre] = BENCH_PASSWORD
+        elif m.group(1) == "email":
+            valores[nombre] = email or f"replay.{n}@bench.local"
+        elif m.group(1) == "fechahora":
+            valores[nombre] = intervalo["end_at" if nombre.startswith(("end", "hasta")) else "start_at"]
+        elif m.group(1) == "fecha":
+            valores[nombre] = date.today().isoformat()
+        else:
+            valores[nombre] = _texto(int(m.group(2) or 8), n)
+    return valores
+
+
+def _url(r, n, email):
+    ruta = _PARAMETRO.sub(
+        lambda m: quote(str(r["args"][m.group(2)]), safe="/" if m.group(1) == "path" else ""), r["ruta"]
+    )
+    query = _rellenar(r["query"], n, email)
+    return ruta + ("?" + urlencode(query) if query else "")
+
+
+class Replay:
+    def __init__(self, base, asignadas, hilos):
+        self.base = base
+        self.asignadas = asignadas
+        self.hilos = hilos
+        self.sesiones = {}
+        self.lock = threading.Lock()
+        self.resultados = defaultdict(
+            lambda: dict(grabado=[], replay=[], errores_5xx=0, estado_distinto=0, sin_respuesta=0)
+        )
+        self.tarde = 0
+
+    def abrir_sesiones(self):
+        def entrar(item):
+            seudonimo, email = item
+            cliente = ClienteHTTP(self.base)
+            estado, destino, _ = cliente.pedir("POST", "/login", dict(email=email, password=BENCH_PASSWORD))
+            if estado != 302 or urlsplit(destino or "").path != "/":
+                raise SystemExit(f"No se pudo iniciar sesión como {email} (estado {estado})")
+            return seudonimo, cliente
+
+        with ThreadPoolExecutor(self.hilos) as pool:
+            self.sesiones = dict(pool.map(entrar, self.asignadas.items()))
+
+    def enviar(self, r, n, programado, inicio):
+        retraso = time.perf_counter() - inicio - programado
+        login = r["endpoint"] == "login" and r["metodo"] == "POST"
+        email = self.asignadas.get(r["usuario"]) if login else None
+        # anon y /login con un cliente nuevo: no tocan las sesiones abiertas
+        cliente = self.sesiones.get(r["usuario"]) if r["rol"] != "anon" and not login else None
+        cliente = cliente or ClienteHTTP(self.base)
+        datos = _rellenar(r["form"], n, email) if r["metodo"] == "POST" else None
+        t0 = time.perf_counter()
+        try:
+            estado, _, _ = cliente.pedir(r["metodo"], _url(r, n, email), datos)
+        except OSError:
+            with self.lock:
+                self.resultados[r["endpoint"]]["sin_respuesta"] += 1
+            return
+        duracion = time.perf_counter() - t0
+        with self.lock:
+            fila = self.resultados[r["endpoint"]]
+            fila["grabado"].append(r["duracion_ms"] / 1000)
+            fila["replay"].append(duracion)
+            fila["errores_5xx"] += estado >= 500
+            fila["estado_distinto"] += estado != r["estado"] and estado < 500
+            self.tarde += retraso > TARDE_S
+
+    def correr(self, registros, velocidad=1.0, tasa=None):
+        t0 = registros[0]["ts"]
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(self.hilos) as pool:
+            for n, r in enumerate(registros):
+                programado = n / tasa if tasa else (r["ts"] - t0) / velocidad
+                espera = programado - (time.perf_counter() - inicio)
+                if espera > 0:
+                    time.sleep(espera)
+                pool.submit(self.enviar, r, n, programado, inicio)
+        return time.perf_counter() - inicio
+
+
+def _ms(valores, q):
+    return round(percentil(sorted(valores), q) * 1e3, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("captura", help="JSONL de TRAFFIC_CAPTURE")
+    parser.add_argument("--db", required=True, help="base de generate_data.py que usa la instancia")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    ritmo = parser.add_mutually_exclusive_group()
+    ritmo.add_argument("--velocidad", type=float, default=1.0, help="1 = ritmo grabado, 10 = diez veces más rápido")
+    ritmo.add_argument("--tasa", type=float, help="requests por segundo fijos en lugar del ritmo grabado")
+    parser.add_argument("--hilos", type=int, default=32, help="requests en vuelo como máximo")
+    parser.add_argument("--desde", type=datetime.fromisoformat, help="solo la ventana [desde, hasta) de la captura")
+    parser.add_argument("--hasta", type=datetime.fromisoformat)
+    parser.add_argument("-o", "--salida", help="archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    registros, omitidos = _cargar(args.captura, args.desde and args.desde.timestamp(),
+                                  args.hasta and args.hasta.timestamp())
+    if not registros:
+        raise SystemExit("La captura no tiene requests reproducibles en esa ventana")
+    try:
+        ClienteHTTP(args.url.rstrip("/")).pedir("GET", "/login")
+    except OSError as e:
+        raise SystemExit(f"{args.url} no responde: {e}")
+    replay = Replay(args.url.rstrip("/"), _asignar(registros, _cuentas(args.db)), args.hilos)
+    print(f"{len(registros)} requests ({omitidos} omitidos), {len(replay.asignadas)} usuarios; abriendo sesiones…")
+    replay.abrir_sesiones()
+    duracion = replay.correr(registros, args.velocidad, args.tasa)
+    grabado = registros[-1]["ts"] - registros[0]["ts"]
+
+    endpoints = {}
+    print(f"{'endpoint':<28} {'n':>6} {'grabado p50/p95':>18} {'replay p50/p95':>18} {'p95':>8} {'5xx':>5} {'≠':>5}")
+    for endpoint, fila in sorted(replay.resultados.items(), key=lambda e: -len(e[1]["replay"])):
+        if not fila["replay"]:
+            print(f"{endpoint:<28} sin respuesta en {fila['sin_respuesta']} requests")
+            endpoints[endpoint] = dict(n=0, sin_respuesta=fila["sin_respuesta"])
+            continue
+        e = endpoints[endpoint] = dict(
+            n=len(fila["replay"]),
+            grabado_p50_ms=_ms(fila["grabado"], 0.50), grabado_p95_ms=_ms(fila["grabado"], 0.95),
+            replay_p50_ms=_ms(fila["replay"], 0.50), replay_p95_ms=_ms(fila["replay"], 0.95),
+            errores_5xx=fila["errores_5xx"], estado_distinto=fila["estado_distinto"],
+            sin_respuesta=fila["sin_respuesta"],
+        )
+        cambio = (e["replay_p95_ms"] / e["grabado_p95_ms"] - 1) * 100 if e["grabado_p95_ms"] else 0.0
+        print(f"{endpoint:<28} {e['n']:>6} {e['grabado_p50_ms']:>8.1f} / {e['grabado_p95_ms']:<7.1f}"
+              f" {e['replay_p50_ms']:>8.1f} / {e['replay_p95_ms']:<7.1f} {cambio:>+7.0f}%"
+              f" {e['errores_5xx']:>5} {e['estado_distinto']:>5}")
+    print(f"Grabado en {grabado:.1f} s, reproducido en {duracion:.1f} s "
+          f"({len(registros) / duracion:.1f} req/s); {replay.tarde} salieron más de {TARDE_S * 1e3:.0f} ms tarde")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(dict(captura=os.path.abspath(args.captura), url=args.url, velocidad=args.velocidad,
+                           tasa=args.tasa, requests=len(registros), omitidos=omitidos, tarde=replay.tarde,
+                           duracion_s=round(duracion, 2), endpoints=endpoints), f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Cachés en memoria del proceso.
+
+Se invalidan de forma explícita al confirmar cambios (database.on_commit); el
+TTL, o en el directorio de médicos la revisión periódica de su sello, acota
+cuánto puede durar un dato escrito por otro proceso.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from markupsafe import Markup
+from sqlalchemy import func, select
+
+from database import SessionLocal, on_commit
+from models import Usuario, Medico, TipoUsuario
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU acotado con expiración por entrada; seguro entre hilos."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            valor, expira = item
+            if expira < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return valor
+
+    def set(self, key, valor):
+        with self._lock:
+            self._data[key] = (valor, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# ----------------- USUARIO ACTUAL -----------------
+class CachedUser(UserMixin):
+    """Lo que login y permisos necesitan de un Usuario, sin sesión de BD detrás."""
+
+    __slots__ = ("id", "nombre", "apellido", "tipo", "medico_id")
+
+    def __init__(self, id, nombre, apellido, tipo, medico_id):
+        self.id = id
+        self.nombre = nombre
+        self.apellido = apellido
+        self.tipo = tipo
+        self.medico_id = medico_id
+
+    def get_id(self) -> str:
+        return str(self.id)
+
+
+user_cache = TTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("USER_CACHE_TTL", 60)),
+)
+
+
+def fetch_user(db, user_id: int):
+    """Carga un CachedUser (usuario + id de médico en una consulta) y lo guarda; None si no existe."""
+    fila = (
+        db.query(Usuario.id, Usuario.nombre, Usuario.apellido, Usuario.tipo, Medico.id)
+        .outerjoin(Medico, Medico.usuario_id == Usuario.id)
+        .filter(Usuario.id == user_id)
+        .first()
+    )
+    if fila is None:
+        return None
+    user = CachedUser(*fila)
+    user_cache.set(user_id, user)
+    return user
+
+
+@on_commit
+def _invalidate_users(cambios):
+    for _, obj in cambios:
+        if isinstance(obj, Usuario):
+            user_cache.invalidate(obj.id)
+        elif isinstance(obj, Medico):
+            user_cache.invalidate(obj.usuario_id)
+
+
+# ----------------- DIRECTORIO DE MÉDICOS -----------------
+# Cada cuánto se compara el directorio con la base: los commits de otros
+# procesos (workers, importer.py, la CLI) no pasan por on_commit de este.
+DIRECTORY_CHECK_SECONDS = float(os.environ.get("DIRECTORY_CHECK_SECONDS", 5))
+
+_SELLO_DIRECTORIO = (
+    select(func.count(Medico.id), func.max(Medico.updated_at), func.max(Usuario.updated_at))
+    .join(Usuario, Usuario.id == Medico.usuario_id)
+)
+
+
+class DoctorDirectory:
+    """
+    Lista compacta (id, nombre, especialidad) de los médicos y el fragmento
+    <option> ya renderizado para los <select>. Se reconstruye cuando cambia la
+    versión (un commit de este proceso a un Medico o a un Usuario médico) o,
+    revisado cada DIRECTORY_CHECK_SECONDS, el sello de la base: número de
+    médicos y máximos updated_at de medicos y de sus usuarios.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self._built = None  # (version, sello, entries, html)
+        self._revisado = 0.0  # monotonic de la última comparación del sello
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def _get(self):
+        with self._lock:
+            version, built = self.version, self._built
+            if built and built[0] == version and time.monotonic() - self._revisado < DIRECTORY_CHECK_SECONDS:
+                return built
+        # Sesión propia (no la del hilo) y siempre del primario: una réplica atrasada se quedaría en caché.
+        # De solo lectura, para no esperar ni tomar el candado del escritor.
+        with SessionLocal.session_factory(info={"readonly": True}) as db:
+            sello = tuple(db.execute(_SELLO_DIRECTORIO, bind_arguments={"primary": True}).one())
+            if built and built[0] == version and built[1] == sello:
+                with self._lock:
+                    self._revisado = time.monotonic()
+                return built
+            filas = db.execute(
+                select(Medico.id, Usuario.nombre, Usuario.apellido, Medico.especialidad)
+                .join(Usuario, Usuario.id == Medico.usuario_id)
+                .order_by(Medico.id),
+                bind_arguments={"primary": True},
+            ).all()
+        entries = [(mid, f"{nombre} {apellido}", especialidad) for mid, nombre, apellido, especialidad in filas]
+        html = Markup("").join(
+            Markup('<option value="{}">{} — {}</option>').format(mid, nombre, especialidad)
+            for mid, nombre, especialidad in entries
+        )
+        built = (version, sello, entries, html)
+        with self._lock:
+            if self.version == version:  # si cambió mientras se construía, no se guarda
+                self._built = built
+                self._revisado = time.monotonic()
+        return built
+
+    def entries(self):
+        return self._get()[2]
+
+    def options_html(self, selected=None):
+        html = self._get()[3]
+        if selected is not None:
+            opcion = f'<option value="{int(selected)}">'
+            html = Markup(str(html).replace(opcion, f'<option value="{int(selected)}" selected>', 1))
+        return html
+
+
+doctor_directory = DoctorDirectory()
+
+
+@on_commit
+def _invalidate_directory(cambios):
+    for _, obj in cambios:
+        if isinstance(obj, Medico) or (isinstance(obj, Usuario) and obj.tipo == TipoUsuario.MEDICO):
+            doctor_directory.invalidate()
+            return
@@ -0,0 +1,145 @@
+"""
+Captura opcional del tráfico a JSONL, sin datos clínicos, para reproducirlo con benchmarks/replay.py.
+
+    TRAFFIC_CAPTURE=/var/log/hs/trafico.jsonl python server.py
+
+Una línea por request con: ts (epoch), método, endpoint, regla de la ruta y
+sus parámetros (ids y formatos), forma del query string y del formulario,
+rol y seudónimo del usuario, estado y duración hasta el último byte (incluye
+las respuestas en streaming).
+
+De los campos solo se guardan tal cual los números (ids, límites) y los de
+CAMPOS_SEGUROS (enumeraciones como estado o vista); el resto se reduce a su
+forma: <texto:largo>, <fecha>, <fechahora>, <email>, <password>, <archivo:bytes>.
+El seudónimo es un HMAC del id con SECRET_KEY: agrupa los requests de una
+misma persona sin identificarla.
+
+El middleware escribe cada línea con un solo write en modo append, así que
+varios workers de server.py pueden compartir el archivo.
+"""
+import hashlib
+import hmac
+import json
+import os
+import re
+import time
+
+from flask import current_app, request
+from flask_login import current_user
+from werkzeug.wsgi import ClosingIterator
+
+TRAFFIC_CAPTURE = os.environ.get("TRAFFIC_CAPTURE")  # ruta del JSONL; sin ella no se captura
+CAMPOS_SEGUROS = {"vista", "campo", "estado", "tipo", "formato", "especialidad", "cursor", "duracion", "dias", "limite"}
+NO_CAPTURAR = {"metrics"}
+
+_ENTERO = re.compile(r"-?\d+")
+_FECHA = re.compile(r"\d{4}-\d{2}-\d{2}")
+_FECHAHORA = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?")
+_INICIO = "hs.captura.usuario"  # quién hizo el request, desde before_request
+_CLAVE = "hs.captura"  # anotaciones de Flask en el environ para el middleware
+
+
+def shape(nombre, valor):
+    """Valor tal cual si es seguro (número o campo de CAMPOS_SEGUROS); si no, su forma."""
+    if "password" in nombre:
+        return "<password>"
+    if nombre == "email" or "@" in valor:
+        return "<email>"
+    if _ENTERO.fullmatch(valor):
+        return valor
+    if _FECHA.fullmatch(valor):
+        return "<fecha>"
+    if _FECHAHORA.fullmatch(valor):
+        return "<fechahora>"
+    if nombre in CAMPOS_SEGUROS:
+        return valor
+    return f"<texto:{len(valor)}>"
+
+
+def _campos(multidict):
+    return {nombre: shape(nombre, valor) for nombre, valor in multidict.items()}
+
+
+def _seudonimo(usuario_id):
+    clave = current_app.config["SECRET_KEY"].encode()
+    return hmac.new(clave, str(usuario_id).encode(), hashlib.sha256).hexdigest()[:12]
+
+
+def _usuario():
+    if current_user.is_authenticated:
+        return current_user.tipo.value.lower(), _seudonimo(current_user.id)
+    return "anon", None
+
+
+# ----------------- HOOKS DE FLASK -----------------
+def _inicio_request():
+    # Al inicio: en /logout ya no hay usuario al terminar
+    request.environ[_INICIO] = _usuario()
+
+
+def _fin_request(exc):
+    inicio = request.environ.pop(_INICIO, None)
+    if inicio is None:
+        return
+    rol, seudonimo = inicio
+    if seudonimo is None:
+        rol, seudonimo = _usuario()  # /login: el usuario que acaba de entrar
+    request.environ[_CLAVE] = dict(
+        endpoint=request.endpoint,
+        ruta=request.url_rule.rule if request.url_rule else None,
+        args=request.view_args or {},
+        query=_campos(request.args),
+        form=_campos(request.form) if request.method == "POST" else {},
+        archivos={nombre: f"<archivo:{archivo.content_length or 0}>" for nombre, archivo in request.files.items()},
+        rol=rol,
+        usuario=seudonimo,
+    )
+
+
+# ----------------- MIDDLEWARE -----------------
+class TrafficRecorder:
+    """Middleware WSGI: mide cada request hasta cerrar la respuesta y agrega su línea a 'ruta'."""
+
+    def __init__(self, wsgi_app, ruta):
+        self.wsgi_app = wsgi_app
+        self.ruta = ruta
+        self._fd = None
+        self._pid = None
+
+    def _escribir(self, registro):
+        if self._pid != os.getpid():  # tras fork: descriptor propio del worker
+            self._fd = os.open(self.ruta, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+        os.write(self._fd, (json.dumps(registro, ensure_ascii=False) + "\n").encode())
+
+    def __call__(self, environ, start_response):
+        ts = time.time()
+        inicio = time.perf_counter()
+        estado = []
+
+        def _start_response(status, headers, exc_info=None):
+            estado.append(int(status.split(" ", 1)[0]))
+            return start_response(status, headers, exc_info)
+
+        def _registrar():
+            datos = environ.get(_CLAVE)
+            if datos is None or datos["endpoint"] in NO_CAPTURAR:
+                return
+            self._escribir(dict(
+                ts=round(ts, 3),
+                metodo=environ["REQUEST_METHOD"],
+                estado=estado[0] if estado else None,
+                duracion_ms=round((time.perf_counter() - inicio) * 1000, 2),
+                **datos,
+            ))
+
+        return ClosingIterator(self.wsgi_app(environ, _start_response), _registrar)
+
+
+def init_capture(app):
+    """Con TRAFFIC_CAPTURE, envuelve app.wsgi_app con TrafficRecorder y conecta sus hooks."""
+    if not TRAFFIC_CAPTURE:
+        return
+    app.before_request(_inicio_request)
+    app.teardown_request(_fin_request)
+    app.wsgi_app = TrafficRecorder(app.wsgi_app, TRAFFIC_CAPTURE)
@@ -1,26 +1,229 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
 
-DATABASE_URL = "sqlite:///health_system.db"
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker, scoped_session, declarative_base
+from sqlalchemy.pool import QueuePool
+
+log = logging.getLogger(__name__)
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///health_system.db")
+
+# "dev" conserva el SQLite por defecto; "production" activa WAL, los PRAGMA de
+# abajo y separa un único escritor (con cola) de un pool de lectores.
+DB_PROFILE = os.environ.get("DB_PROFILE", "dev")
+
+PRODUCTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "cache_size": -int(os.environ.get("SQLITE_CACHE_SIZE_KB", 64 * 1024)),  # negativo = KiB
+    "foreign_keys": "ON",
+    "temp_store": "MEMORY",
+}
+READ_POOL_SIZE = int(os.environ.get("SQLITE_READ_POOL_SIZE", 8))
+WRITE_QUEUE_TIMEOUT = float(os.environ.get("SQLITE_WRITE_QUEUE_TIMEOUT", 30))
+
+
+def _is_memory(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _apply_pragmas(dbapi_conn, pragmas):
+    cursor = dbapi_conn.cursor()
+    for nombre, valor in pragmas.items():
+        cursor.execute(f"PRAGMA {nombre} = {valor}")
+    cursor.close()
+
+
+def _production_engines(url):
+    """Escritor único (las escrituras esperan su turno en el pool) y pool de lectores query_only."""
+    writer = create_engine(
+        url,
+        echo=False,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=WRITE_QUEUE_TIMEOUT,
+    )
+    reader = create_engine(
+        url,
+        echo=False,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=READ_POOL_SIZE,
+        max_overflow=0,
+    )
+
+    @event.listens_for(writer, "connect")
+    def _writer_connect(dbapi_conn, record):
+        dbapi_conn.isolation_level = None  # el BEGIN lo emite el evento de abajo
+        _apply_pragmas(dbapi_conn, PRODUCTION_PRAGMAS)
+
+    @event.listens_for(writer, "begin")
+    def _writer_begin(conn):
+        # Toma el candado de escritura al inicio: evita el "database is locked"
+        # inmediato al promover una transacción de lectura a escritura.
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    @event.listens_for(reader, "connect")
+    def _reader_connect(dbapi_conn, record):
+        pragmas = {k: v for k, v in PRODUCTION_PRAGMAS.items() if k != "journal_mode"}
+        _apply_pragmas(dbapi_conn, dict(pragmas, query_only="ON"))
+
+    return writer, reader
+
+
+def _replica_engine(url):
+    """Motor de lectura apuntando a DATABASE_READ_URL (p. ej. una réplica MySQL vía PyMySQL)."""
+    if url.get_backend_name() == "sqlite":
+        reader = create_engine(url, echo=False, connect_args={"check_same_thread": False})
+
+        @event.listens_for(reader, "connect")
+        def _replica_connect(dbapi_conn, record):
+            _apply_pragmas(dbapi_conn, {"query_only": "ON"})
+
+        return reader
+    return create_engine(url, echo=False, pool_pre_ping=True, pool_recycle=3600)
+
+
+_url = make_url(DATABASE_URL)
+if DB_PROFILE == "production" and _url.get_backend_name() == "sqlite" and not _is_memory(_url):
+    engine, read_engine = _production_engines(_url)
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        echo=False,
+        connect_args={"check_same_thread": False},  # requerido por SQLite en hilos
+    )
+    read_engine = engine
+
+# Lecturas que deben ver el primario sin pasar por el escritor (ni su BEGIN
+# IMMEDIATE): el pool de lectores comparte el archivo WAL con el escritor.
+primary_read_engine = read_engine
+
+DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL")
+if DATABASE_READ_URL:
+    read_engine = _replica_engine(make_url(DATABASE_READ_URL))
+
+
+# ----------------- RUTEO LECTURA/ESCRITURA -----------------
+# Con una réplica aparte (DATABASE_READ_URL) la app desactiva sus lecturas en
+# peticiones que escriben y durante la ventana read-your-writes posterior a una
+# escritura del usuario; esas lecturas van a primary_read_engine.
+HAS_REPLICA = read_engine is not primary_read_engine
+_replica_reads = ContextVar("replica_reads", default=True)
+
+
+def set_replica_reads(permitido: bool):
+    _replica_reads.set(permitido)
+
+
+class RoutingSession(Session):
+    """
+    Las sesiones marcadas con info["readonly"] leen de read_engine; flush, DML
+    y cualquier otra sesión van al escritor. bind_arguments={"primary": True}
+    fuerza el primario para una consulta puntual: en una sesión de solo lectura
+    es primary_read_engine, que no toma el candado de escritura.
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, bind=None, primary=False, **kw):
+        if bind is not None:
+            return bind
+        if not self.info.get("readonly") or self._flushing or getattr(clause, "is_dml", False):
+            return engine
+        if primary or not _replica_reads.get():
+            return primary_read_engine
+        return read_engine
 
-engine = create_engine(
-    DATABASE_URL,
-    echo=False,
-    connect_args={"check_same_thread": False},  # requerido por SQLite en hilos
-)
 
 SessionLocal = scoped_session(
     sessionmaker(
-        bind=engine,
+        class_=RoutingSession,
         autocommit=False,
         autoflush=False,
         expire_on_commit=False,  # evita DetachedInstanceError en current_user
     )
 )
 
+
+def sync_replica():
+    """Copia el primario SQLite sobre la réplica SQLite con la API de backup (pruebas locales)."""
+    origen = sqlite3.connect(make_url(DATABASE_URL).database)
+    destino = sqlite3.connect(make_url(DATABASE_READ_URL).database)
+    try:
+        origen.backup(destino)
+    finally:
+        destino.close()
+        origen.close()
+
+
+def start_replica_sync(intervalo: float):
+    """Hilo que mantiene la réplica SQLite local al día cada 'intervalo' segundos."""
+    def _loop():
+        while True:
+            time.sleep(intervalo)
+            try:
+                sync_replica()
+            except sqlite3.Error:
+                log.exception("No se pudo sincronizar la réplica")
+
+    threading.Thread(target=_loop, name="replica-sync", daemon=True).start()
+
 Base = declarative_base()
 
 def init_db():
-    """Crea tablas si no existen."""
+    """Crea tablas si no existen y aplica las migraciones pendientes."""
     from models import Usuario, Medico, Cita  # noqa: F401
+    from migrations import upgrade
     Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+
+
+# ----------------- AVISOS DE COMMIT -----------------
+# Los cachés en memoria se enteran de lo escrito solo cuando el commit se confirma:
+# after_flush acumula los objetos tocados y after_commit los entrega a los listeners.
+_commit_listeners = []
+
+
+def on_commit(callback):
+    """Registra callback(cambios) con cambios = [(op, obj)], op en insert/update/delete."""
+    _commit_listeners.append(callback)
+    return callback
+
+
+@event.listens_for(SessionLocal.session_factory, "after_flush")
+def _collect_changes(session, flush_context):
+    cambios = session.info.setdefault("cambios", [])
+    cambios.extend(("insert", obj) for obj in session.new)
+    cambios.extend(("update", obj) for obj in session.dirty if session.is_modified(obj))
+    cambios.extend(("delete", obj) for obj in session.deleted)
+
+
+def call_after_commit(session, callback):
+    """callback() al confirmar la transacción actual de la sesión; se descarta si hay rollback.
+    Para escrituras por Core (sin objetos) que los listeners de on_commit no ven."""
+    session.info.setdefault("despues_commit", []).append(callback)
+
+
+@event.listens_for(SessionLocal.session_factory, "after_commit")
+def _dispatch_changes(session):
+    cambios = session.info.pop("cambios", None)
+    if cambios:
+        for callback in _commit_listeners:
+            callback(cambios)
+    for callback in session.info.pop("despues_commit", ()):
+        callback()
+
+
+@event.listens_for(SessionLocal.session_factory, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("cambios", None)
+    session.info.pop("despues_commit", None)
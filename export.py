@@ -0,0 +1,139 @@
+"""
+Exportación en streaming (NDJSON o CSV) de citas y pacientes.
+
+Consultas de Core sobre una conexión propia con yield_per: las filas llegan
+en bloques y se escriben conforme llegan, así que la memoria no depende del
+número de filas. Lo usan las rutas /export/... y la línea de comandos:
+
+    python export.py citas --desde 2024-01-01 --hasta 2025-01-01 [--medico 3] [--formato csv] [-o citas.csv]
+    python export.py pacientes --formato ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date, datetime
+from enum import Enum
+
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import aliased
+
+from database import read_engine
+from models import Cita, CitaArchivada, Medico, Usuario, TipoUsuario
+
+YIELD_PER = 1000
+FORMATOS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _citas_nivel(modelo, desde, hasta, medico_id):
+    doctor = aliased(Usuario)
+    paciente = aliased(Usuario)
+    q = (
+        select(
+            modelo.id.label("id"),  # etiquetas: el ORDER BY del UNION las busca por nombre
+            modelo.start_at.label("start_at"),
+            modelo.end_at,
+            modelo.estado,
+            modelo.medico_id,
+            (doctor.nombre + " " + doctor.apellido).label("medico"),
+            Medico.especialidad,
+            modelo.paciente_id,
+            (paciente.nombre + " " + paciente.apellido).label("paciente"),
+            paciente.email.label("paciente_email"),
+            modelo.notas,
+        )
+        .join(Medico, Medico.id == modelo.medico_id)
+        .join(doctor, doctor.id == Medico.usuario_id)
+        .join(paciente, paciente.id == modelo.paciente_id)
+    )
+    if desde is not None:
+        q = q.where(modelo.start_at >= desde)
+    if hasta is not None:
+        q = q.where(modelo.start_at < hasta)
+    if medico_id is not None:
+        q = q.where(modelo.medico_id == medico_id)
+    return q
+
+
+def citas_query(desde=None, hasta=None, medico_id=None):
+    """Citas (de citas y citas_archivo) con nombres de médico y paciente, por fecha de inicio."""
+    q = union_all(
+        _citas_nivel(Cita, desde, hasta, medico_id),
+        _citas_nivel(CitaArchivada, desde, hasta, medico_id),
+    )
+    # Cada rama sale ordenada de su índice y SQLite las intercala sin ordenar todo
+    return q.order_by(q.selected_columns.start_at, q.selected_columns.id)
+
+
+def pacientes_query():
+    return (
+        select(Usuario.id, Usuario.nombre, Usuario.apellido, Usuario.email)
+        .where(Usuario.tipo == TipoUsuario.PACIENTE)
+        .order_by(Usuario.apellido, Usuario.nombre, Usuario.id)
+    )
+
+
+def _valor(v):
+    if isinstance(v, Enum):
+        return v.value
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+
+def stream(query, formato="ndjson", engine=None):
+    """Genera el archivo en trozos de texto, un trozo por bloque de YIELD_PER filas."""
+    engine = engine or read_engine
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=YIELD_PER).execute(query)
+        columnas = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if formato == "csv" else None
+        if writer:
+            writer.writerow(columnas)
+        for bloque in result.partitions():
+            for fila in bloque:
+                valores = [_valor(v) for v in fila]
+                if writer:
+                    writer.writerow(valores)
+                else:
+                    buffer.write(json.dumps(dict(zip(columnas, valores)), ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+def _fecha(texto):
+    return datetime.fromisoformat(texto)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta citas o pacientes en NDJSON o CSV.")
+    parser.add_argument("que", choices=["citas", "pacientes"])
+    parser.add_argument("--desde", type=_fecha)
+    parser.add_argument("--hasta", type=_fecha)
+    parser.add_argument("--medico", type=int)
+    parser.add_argument("--formato", choices=sorted(FORMATOS), default="ndjson")
+    parser.add_argument("-o", "--salida", help="archivo de salida (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    if args.que == "citas":
+        query = citas_query(args.desde, args.hasta, args.medico)
+    else:
+        query = pacientes_query()
+
+    salida = open(args.salida, "w", encoding="utf-8", newline="") if args.salida else sys.stdout
+    try:
+        for trozo in stream(query, args.formato):
+            salida.write(trozo)
+    finally:
+        if args.salida:
+            salida.close()
+
+
+if __name__ == "__main__":
+    main()
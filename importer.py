@@ -0,0 +1,258 @@
+"""
+Importación masiva de pacientes (con expediente y primera cita opcional) desde CSV.
+
+Cada fila equivale a registrar un paciente con doctor_paciente_new. Columnas:
+nombre, apellido, email, antecedentes, alergias, notas_clinicas, medico_id,
+start_at, end_at, notas. Solo nombre y apellido son obligatorias; sin email se
+asigna uno interno, y la cita se agenda si vienen medico_id, start_at y end_at.
+
+- Las filas se validan conforme se leen, sin cargar el archivo completo.
+- Los correos se comparan contra un set llenado con una sola consulta.
+- Las contraseñas temporales se hashean en un pool de procesos (forkserver o
+  spawn; desde la app, con IMPORT_REQUEST_WORKERS procesos como mucho).
+- Los traslapes se revisan por bloque con una consulta por médico (series_conflicts).
+- Cada bloque de IMPORT_CHUNK filas se inserta con executemany en su propia
+  transacción, así que las escrituras de la app pueden intercalarse.
+
+    python importer.py pacientes.csv -o credenciales.csv
+
+El reporte tiene una fila por fila del archivo: línea, correo y la contraseña
+temporal, o el motivo por el que no se importó.
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import secrets
+import sys
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from database import SessionLocal
+from passwords import PASSWORD_HASH_METHOD, mp_context
+from models import Usuario, Medico, Expediente, TipoUsuario, EstadoCita
+from utils import series_conflicts, bulk_insert_citas
+
+IMPORT_CHUNK = int(os.environ.get("IMPORT_CHUNK", 1000))
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", 0)) or os.cpu_count() or 1
+# Desde /admin/importar: el worker del servidor sigue atendiendo requests mientras tanto
+IMPORT_REQUEST_WORKERS = int(os.environ.get("IMPORT_REQUEST_WORKERS", 2))
+COLUMNAS = ("nombre", "apellido", "email", "antecedentes", "alergias", "notas_clinicas",
+            "medico_id", "start_at", "end_at", "notas")
+
+Resultado = namedtuple("Resultado", "linea email password error")
+
+
+def _email_interno(emails):
+    while True:
+        email = f"paciente-{secrets.token_hex(6)}@local"
+        if email not in emails:
+            return email
+
+
+def _validar(linea, datos, emails, medicos):
+    """Fila del CSV -> dict listo para insertar; ValueError con el motivo si no es válida."""
+    valor = lambda c: (datos.get(c) or "").strip()
+    nombre, apellido = valor("nombre"), valor("apellido")
+    if not (nombre and apellido):
+        raise ValueError("Nombre y apellido son obligatorios.")
+
+    email = valor("email").lower()
+    if email and "@" not in email:
+        raise ValueError("Correo inválido.")
+    if email in emails:
+        raise ValueError("El correo ya está registrado.")
+
+    cita = None
+    if valor("medico_id") or valor("start_at") or valor("end_at"):
+        try:
+            medico_id = int(valor("medico_id"))
+            start_at = datetime.fromisoformat(valor("start_at"))
+            end_at = datetime.fromisoformat(valor("end_at"))
+        except ValueError:
+            raise ValueError("Completa médico e intervalos con un formato válido.") from None
+        if medico_id not in medicos:
+            raise ValueError(f"El médico {medico_id} no existe.")
+        if end_at <= start_at:
+            raise ValueError("La hora de fin debe ser posterior al inicio.")
+        cita = dict(medico_id=medico_id, start_at=start_at, end_at=end_at,
+                    estado=EstadoCita.PENDIENTE, notas=valor("notas") or None)
+
+    email = email or _email_interno(emails)
+    emails.add(email)
+    return dict(
+        linea=linea,
+        usuario=dict(nombre=nombre, apellido=apellido, email=email, tipo=TipoUsuario.PACIENTE),
+        expediente={c: valor(c) or None for c in ("antecedentes", "alergias", "notas_clinicas")},
+        cita=cita,
+    )
+
+
+def _leer(archivo, emails, medicos):
+    """Genera un dict por fila válida o un Resultado con el error, en orden de lectura."""
+    reader = csv.DictReader(archivo)
+    faltan = {"nombre", "apellido"} - set(reader.fieldnames or ())
+    if faltan:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(sorted(faltan))}")
+    for datos in reader:
+        try:
+            yield _validar(reader.line_num, datos, emails, medicos)
+        except ValueError as e:
+            yield Resultado(reader.line_num, (datos.get("email") or "").strip().lower(), None, str(e))
+
+
+def _traslapes(db, bloque):
+    """linea -> motivo de las filas cuya cita choca con la agenda o con otra fila del archivo."""
+    por_medico = defaultdict(list)
+    for fila in bloque:
+        if fila["cita"]:
+            por_medico[fila["cita"]["medico_id"]].append(fila)
+    rechazadas = {}
+    for medico_id, filas in por_medico.items():
+        filas.sort(key=lambda f: f["cita"]["start_at"])
+        ocurrencias = [(f["cita"]["start_at"], f["cita"]["end_at"]) for f in filas]
+        choques = series_conflicts(db, medico_id, ocurrencias)
+        # Entre las aceptadas del bloque: mismo barrido con el mayor fin visto
+        max_fin = None
+        for i, (fila, (inicio, fin)) in enumerate(zip(filas, ocurrencias)):
+            if i in choques:
+                rechazadas[fila["linea"]] = "El médico ya tiene una cita en ese horario."
+            elif max_fin is not None and inicio < max_fin:
+                rechazadas[fila["linea"]] = "Se traslapa con otra cita del archivo."
+            else:
+                max_fin = fin if max_fin is None else max(max_fin, fin)
+    return rechazadas
+
+
+def _importar_bloque(db, bloque, emails, hashear):
+    """Inserta un bloque ya validado en una transacción; devuelve un Resultado por fila."""
+    # Se hashea antes de abrir la transacción: el escritor toma el candado
+    # (BEGIN IMMEDIATE) con la primera consulta y no debe esperar al pool.
+    passwords = [secrets.token_urlsafe(8)[:10] for _ in bloque]
+    credenciales = dict(zip((f["linea"] for f in bloque), zip(passwords, hashear(passwords))))
+
+    rechazadas = _traslapes(db, bloque)
+    for fila in bloque:
+        if fila["linea"] in rechazadas:
+            emails.discard(fila["usuario"]["email"])
+    validas = [f for f in bloque if f["linea"] not in rechazadas]
+    try:
+        ids = db.scalars(
+            insert(Usuario).returning(Usuario.id, sort_by_parameter_order=True),
+            [dict(f["usuario"], password_hash=credenciales[f["linea"]][1]) for f in validas],
+        ).all() if validas else []
+        if ids:
+            db.execute(insert(Expediente), [dict(f["expediente"], paciente_id=i) for f, i in zip(validas, ids)])
+        bulk_insert_citas(db, [dict(f["cita"], paciente_id=i) for f, i in zip(validas, ids) if f["cita"]])
+        db.commit()
+    except IntegrityError as e:
+        # Otro proceso registró alguno de los correos mientras tanto: el bloque completo se descarta
+        db.rollback()
+        motivo = f"Bloque no importado: {e.orig}"
+        rechazadas.update((f["linea"], motivo) for f in validas)
+        validas = []
+
+    resultados = [Resultado(f["linea"], f["usuario"]["email"], credenciales[f["linea"]][0], None) for f in validas]
+    resultados += [Resultado(f["linea"], f["usuario"]["email"], None, rechazadas[f["linea"]])
+                   for f in bloque if f["linea"] in rechazadas]
+    return resultados
+
+
+def import_csv(archivo, progreso=None, chunk=IMPORT_CHUNK, workers=IMPORT_WORKERS):
+    """
+    Importa un CSV (archivo de texto abierto) y genera un Resultado por fila,
+    en orden de línea, bloque por bloque conforme se confirman. progreso(leidas, importadas, errores)
+    se llama después de cada bloque.
+    """
+    db = SessionLocal.session_factory()  # propia: no cerrar la sesión del request en curso
+    pool = ProcessPoolExecutor(workers, mp_context=mp_context()) if workers > 1 else None
+
+    generar = partial(generate_password_hash, method=PASSWORD_HASH_METHOD)
+
+    def hashear(passwords):
+        if pool is None:
+            return [generar(p) for p in passwords]
+        return list(pool.map(generar, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+    try:
+        emails = set(db.scalars(select(Usuario.email)))
+        medicos = set(db.scalars(select(Medico.id)))
+        db.commit()
+        leidas = importadas = errores = 0
+        bloque, invalidas = [], []
+
+        def confirmar():
+            nonlocal importadas, errores
+            resultados = _importar_bloque(db, bloque, emails, hashear) + invalidas
+            ok = sum(r.error is None for r in resultados)
+            importadas += ok
+            errores += len(resultados) - ok
+            bloque.clear()
+            invalidas.clear()
+            return sorted(resultados, key=lambda r: r.linea)
+
+        for fila in _leer(archivo, emails, medicos):
+            leidas += 1
+            (invalidas if isinstance(fila, Resultado) else bloque).append(fila)
+            if len(bloque) + len(invalidas) >= chunk:
+                yield from confirmar()
+                if progreso:
+                    progreso(leidas, importadas, errores)
+        if bloque or invalidas:
+            yield from confirmar()
+        if progreso:
+            progreso(leidas, importadas, errores)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        db.close()
+
+
+def write_report(resultados, salida):
+    """Escribe el reporte CSV; regresa los resultados tal cual para poder encadenarlo."""
+    writer = csv.writer(salida)
+    writer.writerow(Resultado._fields)
+    for r in resultados:
+        writer.writerow(r)
+        yield r
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa pacientes (expediente y primera cita) desde CSV.")
+    parser.add_argument("archivo", help=f"CSV con columnas {', '.join(COLUMNAS)}")
+    parser.add_argument("-o", "--salida", help="reporte con credenciales y errores (por defecto stdout)")
+    parser.add_argument("--bloque", type=int, default=IMPORT_CHUNK, help="filas por transacción")
+    parser.add_argument("--procesos", type=int, default=IMPORT_WORKERS, help="procesos para hashear contraseñas")
+    args = parser.parse_args(argv)
+
+    from database import init_db
+
+    init_db()
+    inicio = time.monotonic()
+
+    def progreso(leidas, importadas, errores):
+        ritmo = leidas / max(time.monotonic() - inicio, 1e-9)
+        print(f"\r{leidas} filas, {importadas} importadas, {errores} con error ({ritmo:.0f} filas/s)",
+              end="", file=sys.stderr, flush=True)
+
+    salida = open(args.salida, "w", encoding="utf-8", newline="") if args.salida else sys.stdout
+    try:
+        with open(args.archivo, encoding="utf-8-sig", newline="") as archivo:
+            for _ in write_report(import_csv(archivo, progreso, args.bloque, args.procesos), salida):
+                pass
+    finally:
+        print(file=sys.stderr)
+        if args.salida:
+            salida.close()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,176 @@
+"""
+Índice en memoria de los intervalos ocupados por médico.
+
+Cada agenda guarda listas paralelas ordenadas por inicio (starts, ends, ids).
+Como has_overlap impide crear citas traslapadas, los intervalos de un médico
+son disjuntos y los fines quedan también ordenados: preguntar por un traslape
+o por el siguiente hueco libre es una búsqueda binaria.
+
+Si una agenda trae traslapes (datos cargados por fuera de la app) se marca
+como no confiable y las consultas regresan None para usar el SQL de respaldo.
+
+Con varios procesos (server.py) cada uno tiene su índice y solo ve sus propios
+commits. En SQLite, PRAGMA data_version de una conexión al primario cambia
+cuando otra conexión confirma algo; entonces se descartan todas las agendas.
+Las sesiones de escritura (has_overlap) lo revisan en cada consulta sobre la
+conexión del escritor. Las de solo lectura nunca usan el escritor: cargan y
+revisan en el pool de lectores (primary_read_engine) a lo más cada
+AGENDA_SYNC_SECONDS; ahí también cuentan los commits de este proceso, así que
+a veces se descartan agendas que estaban al día.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy import select
+
+from database import on_commit
+from models import Cita
+
+AGENDA_SYNC_SECONDS = float(os.environ.get("AGENDA_SYNC_SECONDS", 2))
+
+
+class _Agenda:
+    __slots__ = ("starts", "ends", "ids", "confiable")
+
+    def __init__(self, filas):
+        self.starts = [f[0] for f in filas]
+        self.ends = [f[1] for f in filas]
+        self.ids = [f[2] for f in filas]
+        self.confiable = all(self.ends[i] <= self.starts[i + 1] for i in range(len(filas) - 1))
+
+    def quitar(self, cita_id, start_at):
+        i = bisect_left(self.starts, start_at)
+        while i < len(self.starts) and self.starts[i] == start_at:
+            if self.ids[i] == cita_id:
+                del self.starts[i], self.ends[i], self.ids[i]
+                return
+            i += 1
+
+    def agregar(self, cita_id, start_at, end_at):
+        i = bisect_right(self.starts, start_at)
+        if (i > 0 and self.ends[i - 1] > start_at) or (i < len(self.starts) and self.starts[i] < end_at):
+            self.confiable = False
+        self.starts.insert(i, start_at)
+        self.ends.insert(i, end_at)
+        self.ids.insert(i, cita_id)
+
+
+class IntervalIndex:
+    """Agendas por medico_id, cargadas bajo demanda y actualizadas en cada commit."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._agendas = {}
+        self._entradas = {}  # cita_id -> (medico_id, start_at) de lo indexado
+        self._revisado = 0.0  # monotonic de la última revisión de data_version
+
+    def _sincronizar(self, conn):
+        """Descarta las agendas si otra conexión (otro proceso) confirmó escrituras desde la última revisión."""
+        if conn.dialect.name == "sqlite":
+            version = conn.exec_driver_sql("PRAGMA data_version").scalar()
+            if conn.info.get("agenda_data_version") != version:
+                self.invalidate()
+                conn.info["agenda_data_version"] = version
+        self._revisado = time.monotonic()
+
+    def _usa_primario(self, db, medico_id):
+        """True si hay que ir al primario: revisar data_version o cargar la agenda."""
+        return (
+            not db.info.get("readonly")
+            or time.monotonic() - self._revisado >= AGENDA_SYNC_SECONDS
+            or medico_id not in self._agendas
+        )
+
+    @contextmanager
+    def _agenda(self, db, medico_id):
+        """
+        La agenda con el candado tomado. La conexión al primario (el escritor
+        en sesiones de escritura, un lector en las de solo lectura) se pide
+        antes del candado: en producción el pool del escritor es de 1 y quien
+        tiene esa conexión puede estar esperando el candado (has_overlap, o
+        apply_changes al confirmar); esperarla con el candado tomado traba a
+        los dos.
+        """
+        conn = None
+        while True:
+            if conn is None and self._usa_primario(db, medico_id):
+                conn = db.connection(bind_arguments={"primary": True})
+            with self._lock:
+                if conn is None and self._usa_primario(db, medico_id):
+                    continue  # otro hilo descartó la agenda o venció la revisión: por la conexión
+                if conn is not None:
+                    self._sincronizar(conn)
+                agenda = self._agendas.get(medico_id)
+                if agenda is None:
+                    # Siempre del primario: una réplica atrasada dejaría huecos falsos en la agenda
+                    filas = db.execute(
+                        select(Cita.start_at, Cita.end_at, Cita.id)
+                        .where(Cita.medico_id == medico_id)
+                        .order_by(Cita.start_at, Cita.id),
+                        bind_arguments={"primary": True},
+                    ).all()
+                    agenda = self._agendas[medico_id] = _Agenda(filas)
+                    for start_at, _, cita_id in filas:
+                        self._entradas[cita_id] = (medico_id, start_at)
+                yield agenda
+                return
+
+    def overlaps(self, db, medico_id, start_at, end_at, exclude_id=None):
+        """True/False si hay traslape en [start_at, end_at); None si la agenda no es confiable."""
+        with self._agenda(db, medico_id) as agenda:
+            if not agenda.confiable:
+                return None
+            # Candidatas: citas que empiezan antes de end_at; la última es la de mayor fin
+            i = bisect_left(agenda.starts, end_at) - 1
+            if i >= 0 and agenda.ids[i] == exclude_id:
+                i -= 1
+            return i >= 0 and agenda.ends[i] > start_at
+
+    def next_free(self, db, medico_id, desde, duracion):
+        """Primer inicio >= desde con un hueco libre de la duración pedida; None si no es confiable."""
+        with self._agenda(db, medico_id) as agenda:
+            if not agenda.confiable:
+                return None
+            inicio = desde
+            j = bisect_right(agenda.ends, desde)  # primera cita que termina después de 'desde'
+            while j < len(agenda.starts) and agenda.starts[j] < inicio + duracion:
+                inicio = max(inicio, agenda.ends[j])
+                j += 1
+            return inicio
+
+    def busy(self, db, medico_id, desde, hasta):
+        """[(start_at, end_at)] ordenados de las citas que tocan [desde, hasta); None si no es confiable."""
+        with self._agenda(db, medico_id) as agenda:
+            if not agenda.confiable:
+                return None
+            i = bisect_right(agenda.ends, desde)
+            j = bisect_left(agenda.starts, hasta)
+            return list(zip(agenda.starts[i:j], agenda.ends[i:j]))
+
+    def invalidate(self, medico_id=None):
+        """Descarta una agenda (o todas) para recargarla en la siguiente consulta."""
+        with self._lock:
+            medicos = list(self._agendas) if medico_id is None else [medico_id]
+            for mid in medicos:
+                self._agendas.pop(mid, None)
+            self._entradas = {cid: e for cid, e in self._entradas.items() if e[0] in self._agendas}
+
+    def apply_changes(self, cambios):
+        with self._lock:
+            for op, obj in cambios:
+                if not isinstance(obj, Cita):
+                    continue
+                previa = self._entradas.pop(obj.id, None)
+                if previa and previa[0] in self._agendas:
+                    self._agendas[previa[0]].quitar(obj.id, previa[1])
+                agenda = self._agendas.get(obj.medico_id)
+                if op != "delete" and agenda is not None:
+                    agenda.agregar(obj.id, obj.start_at, obj.end_at)
+                    self._entradas[obj.id] = (obj.medico_id, obj.start_at)
+
+
+agenda_index = IntervalIndex()
+on_commit(agenda_index.apply_changes)
@@ -0,0 +1,375 @@
+"""
+Métricas de requests y de SQL en formato de texto de Prometheus (/metrics).
+
+Por endpoint: histograma de latencia, número de consultas, tiempo total en
+SQL y tiempo de render de plantillas. Por motor: checkouts del pool y
+conexiones en uso. Las consultas que tardan más de SLOW_QUERY_MS se registran
+en el logger "metrics" con el SQL normalizado (sin literales, IN (?, …)) y la
+forma de los parámetros (tipos, no valores: pueden ser datos clínicos).
+
+Los hooks son before/after_cursor_execute de SQLAlchemy y before/teardown
+request de Flask; cada uno suma a un contador en memoria, así que pueden
+quedarse prendidos en producción (METRICS=0 los desactiva).
+
+Presupuesto de consultas: @query_budget(n) declara cuántas consultas puede
+hacer una vista por request (contando las de flask-login). Si se excede se
+registra un warning; con HS_STRICT_LOADS=1 (pruebas y desarrollo, ver
+models.py) se lanza PresupuestoExcedido y el test falla.
+
+Con server.py cada worker tiene sus propios contadores: con METRICS_DIR cada
+proceso vuelca los suyos a <pid>.json cada METRICS_FLUSH_SECONDS y /metrics
+suma los de todos. El maestro acumula en acumulado.json los de los workers que
+terminan, para que los contadores no retrocedan al reciclarlos.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import before_render_template, current_app, g, request, template_rendered
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+METRICS = os.environ.get("METRICS", "1") == "1"
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+# /metrics se niega a todos salvo que se configure uno de los dos: detrás de un
+# proxy local todas las peticiones llegan desde 127.0.0.1
+METRICS_ALLOW = set(filter(None, os.environ.get("METRICS_ALLOW", "").split(",")))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+STRICT_LOADS = os.environ.get("HS_STRICT_LOADS", "0") == "1"
+
+# Límites superiores (segundos) del histograma de latencia
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIN_REQUEST = "-"  # consultas fuera de un request (hilos de fondo, CLI)
+ACUMULADO = "acumulado.json"
+
+
+class PresupuestoExcedido(AssertionError):
+    """Una vista hizo más consultas que su @query_budget (solo con HS_STRICT_LOADS=1)."""
+
+
+class _Request:
+    __slots__ = ("inicio", "consultas", "sql", "plantillas", "renders")
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.sql = 0.0
+        self.plantillas = 0.0
+        self.renders = []  # inicios de render_template anidados
+
+
+_actual = ContextVar("metrics_request", default=None)
+_lock = threading.Lock()
+
+
+def _vacio():
+    return {"requests": {}, "estados": {}, "sql": {}, "lentas": 0, "pool": {}}
+
+
+_datos = _vacio()
+_ultimo_volcado = 0.0
+_engines = {}  # nombre -> engine, para el estado actual de sus pools
+
+
+# ----------------- SQL -----------------
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_ESPACIOS = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """SQL sin literales ni listas de marcadores, en una línea: agrupa consultas de la misma forma."""
+    sql = _LITERAL.sub("?", sql)
+    sql = _LISTA.sub("(?, …)", sql)
+    return _ESPACIOS.sub(" ", sql).strip()
+
+
+def _forma(parametros):
+    if isinstance(parametros, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parametros.items()) + "}"
+    if isinstance(parametros, (list, tuple)):
+        return "(" + ", ".join(type(v).__name__ for v in parametros) + ")"
+    return type(parametros).__name__
+
+
+def parameter_shape(parametros, executemany):
+    """Tipos de los parámetros (nunca los valores); en executemany, filas × forma de la primera."""
+    if executemany:
+        return f"{len(parametros)} × {_forma(parametros[0]) if parametros else '()'}"
+    return _forma(parametros)
+
+
+def _antes(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_inicio", []).append(time.perf_counter())
+
+
+def _despues(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("metrics_inicio")
+    if not inicios:
+        return
+    duracion = time.perf_counter() - inicios.pop()
+    actual = _actual.get()
+    if actual is not None:
+        actual.consultas += 1
+        actual.sql += duracion
+    else:
+        with _lock:
+            fila = _datos["sql"].setdefault(SIN_REQUEST, [0, 0.0])
+            fila[0] += 1
+            fila[1] += duracion
+    if duracion * 1000 >= SLOW_QUERY_MS:
+        with _lock:
+            _datos["lentas"] += 1
+        log.warning(
+            "Consulta lenta %.1f ms en %s: %s | %s",
+            duracion * 1000, request.endpoint if actual is not None else SIN_REQUEST,
+            normalize_sql(statement), parameter_shape(parameters, executemany),
+        )
+
+
+def _pool_hooks(nombre, engine):
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_conn, record, proxy):
+        with _lock:
+            _datos["pool"][nombre] = _datos["pool"].get(nombre, 0) + 1
+
+
+# ----------------- REQUESTS -----------------
+def _inicio_request():
+    _actual.set(_Request())
+
+
+def query_budget(consultas):
+    """Declara el máximo de consultas por request de la vista; va debajo de @app.route y @login_required."""
+    def decorador(vista):
+        vista.query_budget = consultas
+        return vista
+    return decorador
+
+
+def _estado_request(response):
+    g.metrics_estado = response.status_code
+    actual = _actual.get()
+    presupuesto = getattr(current_app.view_functions.get(request.endpoint), "query_budget", None)
+    if actual is not None and presupuesto is not None and actual.consultas > presupuesto:
+        # En respuestas en streaming solo cuentan las consultas previas al primer byte
+        mensaje = f"{request.endpoint} hizo {actual.consultas} consultas (presupuesto: {presupuesto})"
+        if STRICT_LOADS:
+            raise PresupuestoExcedido(mensaje)
+        log.warning(mensaje)
+    return response
+
+
+def _fin_request(exc):
+    actual = _actual.get()
+    if actual is None:
+        return
+    _actual.set(None)
+    duracion = time.perf_counter() - actual.inicio
+    endpoint = request.endpoint or "sin_ruta"
+    estado = g.get("metrics_estado", 500 if exc is not None else 200)
+    i = next((i for i, limite in enumerate(BUCKETS) if duracion <= limite), len(BUCKETS))
+    with _lock:
+        fila = _datos["requests"].get(endpoint)
+        if fila is None:
+            fila = _datos["requests"][endpoint] = {
+                "buckets": [0] * (len(BUCKETS) + 1), "suma": 0.0, "total": 0,
+                "consultas": 0, "sql": 0.0, "plantillas": 0.0,
+            }
+        fila["buckets"][i] += 1
+        fila["suma"] += duracion
+        fila["total"] += 1
+        fila["consultas"] += actual.consultas
+        fila["sql"] += actual.sql
+        fila["plantillas"] += actual.plantillas
+        clave = f"{endpoint} {estado}"
+        _datos["estados"][clave] = _datos["estados"].get(clave, 0) + 1
+    flush_if_due()
+
+
+def _antes_render(sender, template, context, **extra):
+    actual = _actual.get()
+    if actual is not None:
+        actual.renders.append(time.perf_counter())
+
+
+def _despues_render(sender, template, context, **extra):
+    actual = _actual.get()
+    if actual is not None and actual.renders:
+        inicio = actual.renders.pop()
+        if not actual.renders:  # solo el render de fuera: los anidados ya están dentro de su tiempo
+            actual.plantillas += time.perf_counter() - inicio
+
+
+def init_metrics(app, engines):
+    """Conecta los hooks de Flask a 'app' y los de SQLAlchemy a engines = {nombre: engine}."""
+    if not (METRICS or STRICT_LOADS):
+        return
+    app.before_request(_inicio_request)
+    app.after_request(_estado_request)
+    app.teardown_request(_fin_request)
+    before_render_template.connect(_antes_render, app)
+    template_rendered.connect(_despues_render, app)
+    vistos = set()
+    for nombre, engine in engines.items():
+        if id(engine) in vistos:
+            continue
+        vistos.add(id(engine))
+        event.listen(engine, "before_cursor_execute", _antes)
+        event.listen(engine, "after_cursor_execute", _despues)
+        _pool_hooks(nombre, engine)
+        _engines[nombre] = engine
+
+
+# ----------------- VOLCADO ENTRE PROCESOS -----------------
+def _snapshot():
+    with _lock:
+        return json.loads(json.dumps(_datos))
+
+
+def _sumar(destino, origen):
+    for endpoint, fila in origen["requests"].items():
+        actual = destino["requests"].setdefault(endpoint, dict(fila, buckets=[0] * len(fila["buckets"]), suma=0.0,
+                                                               total=0, consultas=0, sql=0.0, plantillas=0.0))
+        actual["buckets"] = [a + b for a, b in zip(actual["buckets"], fila["buckets"])]
+        for campo in ("suma", "total", "consultas", "sql", "plantillas"):
+            actual[campo] += fila[campo]
+    for clave, n in origen["estados"].items():
+        destino["estados"][clave] = destino["estados"].get(clave, 0) + n
+    for clave, (n, segundos) in origen["sql"].items():
+        fila = destino["sql"].setdefault(clave, [0, 0.0])
+        fila[0] += n
+        fila[1] += segundos
+    destino["lentas"] += origen["lentas"]
+    for nombre, n in origen["pool"].items():
+        destino["pool"][nombre] = destino["pool"].get(nombre, 0) + n
+    return destino
+
+
+def _escribir(ruta, datos):
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w") as f:
+        json.dump(datos, f)
+    os.replace(temporal, ruta)
+
+
+def _leer(ruta):
+    try:
+        with open(ruta) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush():
+    """Vuelca los contadores de este proceso a METRICS_DIR/<pid>.json."""
+    global _ultimo_volcado
+    _ultimo_volcado = time.monotonic()
+    if METRICS_DIR:
+        try:
+            _escribir(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), _snapshot())
+        except OSError:
+            log.warning("No se pudieron volcar las métricas en %s", METRICS_DIR)
+
+
+def flush_if_due():
+    """flush() si pasaron METRICS_FLUSH_SECONDS desde el último volcado (server.py lo llama también en reposo)."""
+    if METRICS_DIR and time.monotonic() - _ultimo_volcado >= METRICS_FLUSH_SECONDS:
+        flush()
+
+
+def collect_dead(pid):
+    """En el maestro: pasa los contadores del worker 'pid' (ya terminado) a acumulado.json."""
+    ruta = os.path.join(METRICS_DIR, f"{pid}.json")
+    datos = _leer(ruta)
+    if datos is None:
+        return
+    acumulado = _leer(os.path.join(METRICS_DIR, ACUMULADO)) or _vacio()
+    _escribir(os.path.join(METRICS_DIR, ACUMULADO), _sumar(acumulado, datos))
+    os.remove(ruta)
+
+
+def _todos():
+    """Contadores de este proceso más los volcados de los demás (si hay METRICS_DIR)."""
+    total = _snapshot()
+    if not METRICS_DIR:
+        return total
+    propio = f"{os.getpid()}.json"
+    for nombre in os.listdir(METRICS_DIR):
+        if nombre.endswith(".json") and nombre != propio:
+            datos = _leer(os.path.join(METRICS_DIR, nombre))
+            if datos is not None:
+                _sumar(total, datos)
+    return total
+
+
+# ----------------- EXPOSICIÓN -----------------
+def allowed(req):
+    """/metrics: con METRICS_TOKEN pide Bearer; sin él, solo desde METRICS_ALLOW (vacío = nadie)."""
+    if METRICS_TOKEN:
+        return req.headers.get("Authorization") == f"Bearer {METRICS_TOKEN}"
+    return req.remote_addr in METRICS_ALLOW
+
+
+def _etiquetas(**valores):
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in valores.items()) + "}"
+
+
+def render():
+    """Texto en formato de exposición de Prometheus (version=0.0.4)."""
+    datos = _todos()
+    lineas = []
+
+    def metrica(nombre, tipo, ayuda, muestras):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for sufijo, etiquetas, valor in muestras:
+            lineas.append(f"{nombre}{sufijo}{etiquetas} {valor}")
+
+    requests = sorted(datos["requests"].items())
+    histograma = []
+    for endpoint, fila in requests:
+        acumulado = 0
+        for limite, n in zip((*map(str, BUCKETS), "+Inf"), fila["buckets"]):
+            acumulado += n
+            histograma.append(("_bucket", _etiquetas(endpoint=endpoint, le=limite), acumulado))
+        histograma.append(("_sum", _etiquetas(endpoint=endpoint), fila["suma"]))
+        histograma.append(("_count", _etiquetas(endpoint=endpoint), fila["total"]))
+    metrica("hs_request_duration_seconds", "histogram", "Latencia de los requests por endpoint.", histograma)
+
+    estados = []
+    for clave, n in sorted(datos["estados"].items()):
+        endpoint, estado = clave.rsplit(" ", 1)
+        estados.append(("", _etiquetas(endpoint=endpoint, status=estado), n))
+    metrica("hs_requests_total", "counter", "Requests por endpoint y código de estado.", estados)
+
+    consultas = [("", _etiquetas(endpoint=e), f["consultas"]) for e, f in requests]
+    consultas += [("", _etiquetas(endpoint=e), n) for e, (n, _) in sorted(datos["sql"].items())]
+    metrica("hs_sql_queries_total", "counter", "Consultas SQL ejecutadas por endpoint.", consultas)
+    sql = [("", _etiquetas(endpoint=e), f["sql"]) for e, f in requests]
+    sql += [("", _etiquetas(endpoint=e), s) for e, (_, s) in sorted(datos["sql"].items())]
+    metrica("hs_sql_seconds_total", "counter", "Tiempo en SQL por endpoint.", sql)
+    metrica("hs_template_render_seconds_total", "counter", "Tiempo de render de plantillas por endpoint.",
+            [("", _etiquetas(endpoint=e), f["plantillas"]) for e, f in requests])
+    metrica("hs_sql_slow_queries_total", "counter", f"Consultas de más de {SLOW_QUERY_MS:g} ms.",
+            [("", "", datos["lentas"])])
+
+    metrica("hs_db_pool_checkouts_total", "counter", "Conexiones tomadas del pool por motor.",
+            [("", _etiquetas(engine=n), v) for n, v in sorted(datos["pool"].items())])
+    # Del proceso que responde: el estado del pool no se suma entre workers
+    estado_pool = []
+    for nombre, engine in _engines.items():
+        pool = engine.pool
+        if hasattr(pool, "checkedout"):
+            estado_pool.append(("", _etiquetas(engine=nombre, state="checked_out"), pool.checkedout()))
+            estado_pool.append(("", _etiquetas(engine=nombre, state="size"), pool.size()))
+            estado_pool.append(("", _etiquetas(engine=nombre, state="overflow"), max(pool.overflow(), 0)))
+    metrica("hs_db_pool_connections", "gauge", "Conexiones del pool en este proceso.", estado_pool)
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,170 @@
+"""
+Migraciones versionadas del esquema SQLite.
+
+La versión aplicada vive en PRAGMA user_version. Cada migración es una función
+que recibe la conexión y debe ser idempotente: en una base nueva create_all ya
+creó tablas y columnas, y la migración solo completa lo que falte.
+
+    python migrations.py          # aplica las pendientes sobre DATABASE_URL
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, descripcion):
+    def registrar(fn):
+        MIGRATIONS.append((version, descripcion, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return registrar
+
+
+def current_version(conn) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def upgrade(engine) -> int:
+    """Aplica las migraciones pendientes, una transacción por versión. Devuelve la versión final."""
+    if engine.dialect.name != "sqlite":
+        return 0
+    with engine.connect() as conn:
+        version = current_version(conn)
+    for numero, descripcion, fn in MIGRATIONS:
+        if numero <= version:
+            continue
+        log.info("Migración %s: %s", numero, descripcion)
+        with engine.begin() as conn:
+            fn(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(numero)}")
+        version = numero
+    return version
+
+
+def _add_column(conn, tabla, columna, ddl) -> bool:
+    """ALTER TABLE ... ADD COLUMN si la columna no existe; True si la agregó."""
+    if columna in {c["name"] for c in inspect(conn).get_columns(tabla)}:
+        return False
+    conn.exec_driver_sql(f"ALTER TABLE {tabla} ADD COLUMN {columna} {ddl}")
+    return True
+
+
+# ----------------- MIGRACIONES -----------------
+@migration(1, "Índices compuestos y parcial para las consultas de citas y pacientes")
+def _indices_citas(conn):
+    # has_overlap y la carga del índice de agendas: medico_id + rango
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_citas_medico_start_end ON citas (medico_id, start_at, end_at)"
+    )
+    # doctor_consultas, concluidas y conteo de pendientes: medico_id + estado + start_at
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_citas_medico_estado_start ON citas (medico_id, estado, start_at)"
+    )
+    # Citas del paciente ordenadas por fecha
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_citas_paciente_start ON citas (paciente_id, start_at)"
+    )
+    # Solo las citas activas: mucho más chico que la tabla completa
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_citas_activas ON citas (medico_id, start_at) "
+        "WHERE estado IN ('PENDIENTE', 'CONFIRMADA')"
+    )
+    # Lista de pacientes ordenada por apellido/nombre
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_tipo_apellido_nombre ON usuarios (tipo, apellido, nombre)"
+    )
+
+
+@migration(2, "Tabla resumen doctor_paciente, llenada a partir de citas")
+def _doctor_paciente(conn):
+    from models import DoctorPaciente
+    from roster import rebuild
+
+    DoctorPaciente.__table__.create(conn, checkfirst=True)
+    rebuild(conn)
+
+
+@migration(3, "version y updated_at en citas, medicos y usuarios para las respuestas condicionales")
+def _versiones(conn):
+    ahora = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")  # formato de DateTime en SQLite
+    for tabla in ("citas", "medicos", "usuarios"):
+        _add_column(conn, tabla, "version", "INTEGER NOT NULL DEFAULT 1")
+        # SQLite no acepta un default no constante en ADD COLUMN: se llena después
+        if _add_column(conn, tabla, "updated_at", "DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00.000000'"):
+            conn.execute(text(f"UPDATE {tabla} SET updated_at = :ahora"), {"ahora": ahora})
+    # Versión por ámbito: conteo + max(updated_at) sin leer las filas
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_citas_medico_updated ON citas (medico_id, updated_at)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_citas_paciente_updated ON citas (paciente_id, updated_at)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_citas_updated_at ON citas (updated_at)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_medicos_updated_at ON medicos (updated_at)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_usuarios_updated_at ON usuarios (updated_at)")
+
+
+@migration(4, "Horario semanal de trabajo por médico")
+def _horario_medicos(conn):
+    _add_column(conn, "medicos", "horario", "VARCHAR")
+
+
+@migration(5, "Índice de texto completo (FTS5) de pacientes y expedientes, con triggers")
+def _busqueda_pacientes(conn):
+    from search import install, rebuild
+
+    install(conn)
+    rebuild(conn)
+
+
+@migration(6, "Nombre y apellido normalizados de usuarios para la búsqueda por prefijo")
+def _nombres_normalizados(conn):
+    from models import normalizar
+
+    nuevas = [_add_column(conn, "usuarios", c, "VARCHAR") for c in ("nombre_norm", "apellido_norm")]
+    if any(nuevas):
+        filas = conn.exec_driver_sql("SELECT id, nombre, apellido FROM usuarios").fetchall()
+        for i in range(0, len(filas), 5000):
+            conn.execute(
+                text("UPDATE usuarios SET nombre_norm = :nombre, apellido_norm = :apellido WHERE id = :id"),
+                [
+                    {"id": id_, "nombre": normalizar(nombre), "apellido": normalizar(apellido)}
+                    for id_, nombre, apellido in filas[i:i + 5000]
+                ],
+            )
+    # Prefijo de apellido (y nombre después), de nombre o de correo, solo entre pacientes y ya en orden
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_tipo_apellido_norm ON usuarios (tipo, apellido_norm, nombre_norm)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_tipo_nombre_norm ON usuarios (tipo, nombre_norm, apellido_norm)"
+    )
+    # El correo ya se guarda en minúsculas: basta el índice por tipo
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_usuarios_tipo_email ON usuarios (tipo, email)")
+
+
+@migration(7, "Tabla citas_archivo para las citas concluidas antiguas (archive.py)")
+def _archivo_citas(conn):
+    from models import CitaArchivada
+
+    CitaArchivada.__table__.create(conn, checkfirst=True)
+    # Concluidas e historial del médico, doctor_paciente y has_overlap antes del horizonte
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_citas_archivo_medico_start_end ON citas_archivo (medico_id, start_at, end_at)"
+    )
+    # Historial del paciente
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_citas_archivo_paciente_start ON citas_archivo (paciente_id, start_at)"
+    )
+    # Listado del administrador y exportación por rango de fechas
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_citas_archivo_start ON citas_archivo (start_at)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    from database import init_db, engine
+
+    init_db()
+    with engine.connect() as conn:
+        print(f"Esquema en versión {current_version(conn)}")
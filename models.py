@@ -1,13 +1,21 @@
+import os
+import unicodedata
 from enum import Enum as PyEnum
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, bindparam, text
 from sqlalchemy import Enum as SAEnum
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from flask_login import UserMixin
 
 from database import Base
 
+# HS_STRICT_LOADS=1 (pruebas y desarrollo): una relación que no se cargó con
+# joinedload/selectinload lanza error en lugar de hacer una consulta por fila.
+# raise_on_sql sí permite las que se resuelven del identity map (many-to-one ya cargado).
+STRICT_LOADS = os.environ.get("HS_STRICT_LOADS", "0") == "1"
+LAZY = "raise_on_sql" if STRICT_LOADS else "select"
+
 
 class TipoUsuario(str, PyEnum):
     ADMIN = "ADMIN"
@@ -22,6 +30,24 @@ class EstadoCita(str, PyEnum):
     ATENDIDA = "ATENDIDA"
 
 
+# version es un contador que sube en cada UPDATE (ETag y llaves de caché), no un
+# bloqueo optimista: dos ediciones simultáneas no fallan, gana la última. Con
+# eager_defaults el UPDATE trae el valor nuevo (RETURNING) y el objeto no queda expirado.
+VERSION_SIGUIENTE = text("version + 1")
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos: la forma en que se comparan los nombres al buscar por prefijo."""
+    if texto is None:
+        return None
+    return "".join(c for c in unicodedata.normalize("NFD", texto.lower()) if unicodedata.category(c) != "Mn")
+
+
+def _normalizada(columna):
+    """Default de Core (insert masivo sin pasar por el ORM): normaliza el valor de 'columna' de la fila."""
+    return lambda context: normalizar(context.get_current_parameters().get(columna))
+
+
 class Usuario(Base, UserMixin):
     __tablename__ = "usuarios"
 
@@ -32,12 +58,26 @@ class Usuario(Base, UserMixin):
     password_hash = Column(String, nullable=False)
     tipo = Column(SAEnum(TipoUsuario), default=TipoUsuario.PACIENTE, nullable=False)
 
-    medico = relationship("Medico", back_populates="usuario", uselist=False)
-    expediente = relationship("Expediente", back_populates="paciente", uselist=False)
+    # normalizar(nombre/apellido) para la búsqueda por prefijo (índices en migrations.py)
+    nombre_norm = Column(String, default=_normalizada("nombre"))
+    apellido_norm = Column(String, default=_normalizada("apellido"))
+
+    version = Column(Integer, nullable=False, server_default="1", onupdate=VERSION_SIGUIENTE)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
+
+    medico = relationship("Medico", back_populates="usuario", uselist=False, lazy=LAZY)
+    expediente = relationship("Expediente", back_populates="paciente", uselist=False, lazy=LAZY)
 
     def get_id(self) -> str:
         return str(self.id)
 
+    @validates("nombre", "apellido")
+    def _normalizar(self, key, valor):
+        setattr(self, f"{key}_norm", normalizar(valor))
+        return valor
+
+    __mapper_args__ = {"eager_defaults": True}
+
 
 class Medico(Base):
     __tablename__ = "medicos"
@@ -45,9 +85,15 @@ class Medico(Base):
     id = Column(Integer, primary_key=True)
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False, unique=True)
     especialidad = Column(String, nullable=False)
+    horario = Column(String, nullable=True)  # WeeklyHours codificado (availability.py); NULL = WORKING_HOURS
+
+    version = Column(Integer, nullable=False, server_default="1", onupdate=VERSION_SIGUIENTE)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
 
-    usuario = relationship("Usuario", back_populates="medico")
-    citas = relationship("Cita", back_populates="medico")
+    usuario = relationship("Usuario", back_populates="medico", lazy=LAZY)
+    citas = relationship("Cita", back_populates="medico", lazy=LAZY)
+
+    __mapper_args__ = {"eager_defaults": True}
 
 
 class Cita(Base):
@@ -62,8 +108,66 @@ class Cita(Base):
     estado = Column(SAEnum(EstadoCita), default=EstadoCita.PENDIENTE, nullable=False)
     notas = Column(String, nullable=True)
 
-    medico = relationship("Medico", back_populates="citas")
-    paciente = relationship("Usuario")
+    version = Column(Integer, nullable=False, server_default="1", onupdate=VERSION_SIGUIENTE)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    medico = relationship("Medico", back_populates="citas", lazy=LAZY)
+    paciente = relationship("Usuario", lazy=LAZY)
+
+    archivada = False  # las plantillas comparten filas con CitaArchivada
+
+    __mapper_args__ = {"eager_defaults": True}
+
+
+class CitaArchivada(Base):
+    """
+    Cita concluida que archive.py sacó de citas (conserva id y columnas). Solo
+    se lee: historial, concluidas, exportación y doctor_paciente. Índices en migrations.py.
+    """
+    __tablename__ = "citas_archivo"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    medico_id = Column(Integer, ForeignKey("medicos.id"), nullable=False)
+    paciente_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime, nullable=False)
+    estado = Column(SAEnum(EstadoCita), nullable=False)
+    notas = Column(String, nullable=True)
+
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    medico = relationship("Medico", lazy=LAZY)
+    paciente = relationship("Usuario", lazy=LAZY)
+
+    archivada = True
+
+
+class DoctorPaciente(Base):
+    """Resumen por (médico, paciente) que mantiene roster.py en la misma transacción que las citas."""
+    __tablename__ = "doctor_paciente"
+
+    medico_id = Column(Integer, ForeignKey("medicos.id"), primary_key=True)
+    paciente_id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True, index=True)
+    pending_count = Column(Integer, default=0, nullable=False)  # activas con start_at >= momento del cálculo
+    last_visit = Column(DateTime, nullable=True)  # última cita ATENDIDA
+    next_visit = Column(DateTime, nullable=True)  # próxima cita activa al momento del cálculo
+
+    paciente = relationship("Usuario", lazy=LAZY)
+
+
+# Filtro de citas activas. Los estados van como literales y no como parámetros
+# para que SQLite pueda usar el índice parcial ix_citas_activas (ver migrations.py).
+CITA_ACTIVA = Cita.estado.in_(
+    bindparam(
+        "estados_activos",
+        [EstadoCita.PENDIENTE, EstadoCita.CONFIRMADA],
+        expanding=True,
+        literal_execute=True,
+    )
+)
 
 
 class Expediente(Base):
@@ -78,4 +182,4 @@ class Expediente(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
-    paciente = relationship("Usuario", back_populates="expediente")
+    paciente = relationship("Usuario", back_populates="expediente", lazy=LAZY)
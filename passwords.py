@@ -0,0 +1,122 @@
+"""
+Hash y verificación de contraseñas fuera del hilo del request.
+
+scrypt/PBKDF2 son caros a propósito: calculados en los hilos del request, un
+pico de inicios de sesión ocupa todo el CPU del proceso y las demás peticiones
+esperan detrás. Aquí se calculan en un pool de procesos (HASH_WORKERS) y como
+mucho HASH_QUEUE a la vez por proceso; quien no consigue lugar en
+HASH_WAIT_SECONDS recibe HashingSaturado y la app responde 503 con
+Retry-After en lugar de encolar sin límite.
+
+verify_password también indica si el hash guardado usa parámetros distintos
+de PASSWORD_HASH_METHOD y, en ese caso, regresa el hash nuevo calculado en la
+misma ida al pool para que el login lo guarde.
+
+Este módulo no importa la app ni los modelos: los procesos del pool lo cargan
+solo.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 1))  # 0 = en el hilo del request
+HASH_QUEUE = int(os.environ.get("HASH_QUEUE", 0)) or max(HASH_WORKERS, 1) * 4
+HASH_WAIT_SECONDS = float(os.environ.get("HASH_WAIT_SECONDS", 2))
+RETRY_AFTER_SECONDS = 2
+
+
+class HashingSaturado(RuntimeError):
+    """No hubo lugar en el pool de hash dentro de HASH_WAIT_SECONDS."""
+
+
+def _parametros(metodo):
+    """'scrypt' / 'scrypt:32768:8:1' / 'pbkdf2:sha256' ... -> tupla con los valores por defecto explícitos."""
+    nombre, *args = metodo.split(":")
+    if nombre == "scrypt":
+        return (nombre, *(map(int, args) if args else (2**15, 8, 1)))
+    if nombre == "pbkdf2":
+        algoritmo = args[0] if args else "sha256"
+        iteraciones = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return (nombre, algoritmo, iteraciones)
+    return (nombre, *args)
+
+
+def needs_rehash(pwhash, metodo=None):
+    """True si 'pwhash' no se generó con los parámetros de 'metodo' (por defecto PASSWORD_HASH_METHOD)."""
+    return _parametros(pwhash.split("$", 1)[0]) != _parametros(metodo or PASSWORD_HASH_METHOD)
+
+
+def _hashear(password, metodo):
+    return generate_password_hash(password, metodo)
+
+
+def _verificar(pwhash, password, metodo):
+    if not check_password_hash(pwhash, password):
+        return False, None
+    return True, generate_password_hash(password, metodo) if needs_rehash(pwhash, metodo) else None
+
+
+# ----------------- POOL -----------------
+def mp_context():
+    """forkserver/spawn: hacer fork de un proceso con hilos de requests no es seguro."""
+    metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(metodo)
+
+
+_lock = threading.Lock()
+_cupo = threading.BoundedSemaphore(HASH_QUEUE)
+_pool = None
+_pool_pid = None
+
+
+def _ejecutor():
+    """Pool del proceso actual; se crea al primer uso (en server.py, ya dentro de cada worker)."""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(HASH_WORKERS, mp_context=mp_context())
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _ejecutar(fn, *args):
+    if not _cupo.acquire(timeout=HASH_WAIT_SECONDS):
+        raise HashingSaturado()
+    try:
+        if HASH_WORKERS <= 0:
+            return fn(*args)
+        try:
+            return _ejecutor().submit(fn, *args).result()
+        except BrokenProcessPool:
+            shutdown(wait=False)  # un proceso del pool murió: el siguiente llamado crea otro
+            raise
+    finally:
+        _cupo.release()
+
+
+def shutdown(wait=True):
+    """Cierra el pool del proceso (se vuelve a crear si se usa otra vez)."""
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+
+
+def hash_password(password, metodo=None):
+    """Hash de 'password' con PASSWORD_HASH_METHOD; HashingSaturado si el pool está lleno."""
+    return _ejecutar(_hashear, password, metodo or PASSWORD_HASH_METHOD)
+
+
+def verify_password(pwhash, password, metodo=None):
+    """
+    (ok, hash_nuevo): ok indica si la contraseña coincide; hash_nuevo no es
+    None cuando coincide pero el hash guardado usa otros parámetros.
+    HashingSaturado si el pool está lleno.
+    """
+    return _ejecutar(_verificar, pwhash, password, metodo or PASSWORD_HASH_METHOD)
@@ -0,0 +1,320 @@
+"""
+Revisa con EXPLAIN QUERY PLAN el SQL que de verdad emiten las rutas de app.py.
+
+    python query_plans.py                 # base temporal sembrada con benchmarks/generate_data.py
+    python query_plans.py --actual        # una copia de la base de DATABASE_URL (sus datos y estadísticas)
+
+Pide cada ruta GET de app.url_map con cada rol (administrador, el médico con
+más citas y su paciente más frecuente), con cursor de paginación donde la
+ruta lo acepta, y llama a los helpers reales en los caminos que un GET no
+recorre: escrituras y sus after_flush, el SQL de respaldo del índice de
+agendas, el archivo y las filas vencidas de doctor_paciente (en una
+transacción que se descarta). Un listener de SQLAlchemy captura cada
+sentencia con sus parámetros; una ruta nueva o una consulta cambiada entran
+solas a la revisión.
+
+Termina con código 1 si alguna consulta recorre una tabla o un índice
+completo (SCAN, con o sin USING INDEX) fuera de PERMITIDOS.
+"""
+import argparse
+import html
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+_SCAN = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?$")
+_SENTENCIA = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE|INSERT INTO \w+ \([^)]*\) SELECT)\b", re.IGNORECASE)
+_SIGUIENTE = re.compile(r'data-next="([^"]+)"')
+
+# (consulta, tabla) -> motivo; consulta None = en cualquier consulta. La consulta es
+# el nombre con que se reporta: "rol GET /ruta?parámetros" o el del camino de helpers.
+PERMITIDOS = {
+    (None, "medicos"): "cientos de filas: directorio, búsqueda por especialidad y join de la exportación",
+    (None, "ambito"): "CTE de app._version_personas, ya acotada por índice a las citas de la página",
+    # Primera página del administrador: recorre el índice de start_at en orden y para en el LIMIT
+    ("admin GET /", "citas"): "primera página, índice ordenado con LIMIT",
+    ("admin GET /", "citas_archivo"): "primera página, índice ordenado con LIMIT",
+    ("admin GET /citas", "citas"): "primera página, índice ordenado con LIMIT",
+    ("admin GET /citas", "citas_archivo"): "primera página, índice ordenado con LIMIT",
+    ("admin GET /citas/fragmento?vista=citas", "citas"): "primera página, índice ordenado con LIMIT",
+    ("admin GET /citas/fragmento?vista=citas", "citas_archivo"): "primera página, índice ordenado con LIMIT",
+}
+# Parámetros por endpoint; {llaves} se llenan con la muestra
+CONSULTAS = {
+    "citas_list": ("", "cursor={cursor}"),
+    "citas_fragmento": ("vista=citas", "vista=concluidas", "vista=citas&cursor={cursor}"),
+    "doctor_concluidas": ("", "cursor={cursor}"),
+    "doctor_consultas": ("", "paciente_id={paciente_id}"),
+    "api_disponibilidad": ("medico_id={medico_id}", "especialidad={especialidad}"),
+    "export_citas": ("medico_id={medico_id}", "desde={hace_un_anio}&hasta={ahora}"),
+    "api_buscar_pacientes": ("q={q}", "q={q}&campo=notas_clinicas"),
+    "api_sugerencias_pacientes": ("q={prefijo}", "q={q} {prefijo}"),
+    "expedientes_buscar": ("q={q}",),
+}
+ARGUMENTOS = {"medico_id", "paciente_id", "cita_id", "formato"}
+EXCLUIDAS = {"logout", "metrics", "static", "assets"}
+
+
+# ----------------- CAPTURA -----------------
+class Captura:
+    """Sentencias (SQL, parámetros) emitidas por cualquier Engine, agrupadas por el nombre actual."""
+
+    def __init__(self):
+        self.actual = None
+        self.sentencias = {}  # nombre -> {sql: parámetros}
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.actual and not executemany and _SENTENCIA.match(statement):
+            self.sentencias.setdefault(self.actual, {}).setdefault(statement, parameters)
+
+    @contextmanager
+    def como(self, nombre):
+        previo, self.actual = self.actual, nombre
+        try:
+            yield
+        finally:
+            self.actual = previo
+
+
+def _muestra(db):
+    """Usuarios e ids reales para armar las URLs: el médico con más citas y su paciente más frecuente."""
+    from sqlalchemy import func, select
+
+    from models import Cita, Medico, TipoUsuario, Usuario
+    from utils import encode_cursor
+
+    medico_id = db.scalar(select(Cita.medico_id).group_by(Cita.medico_id).order_by(func.count().desc()).limit(1))
+    if medico_id is None:
+        raise SystemExit("La base no tiene citas: usa la base temporal (sin --actual)")
+    medico = db.get(Medico, medico_id)
+    paciente_id = db.scalar(
+        select(Cita.paciente_id).where(Cita.medico_id == medico_id)
+        .group_by(Cita.paciente_id).order_by(func.count().desc()).limit(1)
+    )
+    paciente = db.get(Usuario, paciente_id)
+    # Una cita intermedia: el cursor apunta a mitad del historial
+    total = db.scalar(select(func.count()).select_from(Cita).where(Cita.medico_id == medico_id))
+    cita = db.scalars(
+        select(Cita).where(Cita.medico_id == medico_id).order_by(Cita.start_at, Cita.id).offset(total // 2).limit(1)
+    ).one()
+    ahora = datetime.now().replace(microsecond=0)
+    return SimpleNamespace(
+        roles={
+            "admin": db.scalar(select(Usuario.id).where(Usuario.tipo == TipoUsuario.ADMIN).limit(1)),
+            "medico": medico.usuario_id,
+            "paciente": paciente_id,
+        },
+        valores=dict(
+            medico_id=medico_id,
+            paciente_id=paciente_id,
+            cita_id=cita.id,
+            formato="csv",
+            cursor=encode_cursor(cita),
+            especialidad=medico.especialidad,
+            q=paciente.apellido.split()[0],
+            prefijo=paciente.nombre[:3],
+            ahora=ahora.isoformat(),
+            hace_un_anio=(ahora - timedelta(days=365)).isoformat(),
+        ),
+        paciente_email=paciente.email,
+    )
+
+
+def _rutas(app):
+    """(endpoint, regla) de las rutas GET cuyos argumentos se pueden llenar con la muestra."""
+    return sorted(
+        (regla.endpoint, regla.rule)
+        for regla in app.url_map.iter_rules()
+        if "GET" in regla.methods and regla.endpoint not in EXCLUIDAS and set(regla.arguments) <= ARGUMENTOS
+    )
+
+
+def recorrer_rutas(app, muestra, captura):
+    """Cada ruta GET con cada rol; también la página siguiente de los listados con scroll infinito."""
+    from cache import user_cache
+
+    adaptador = app.url_map.bind("localhost")
+    rutas = _rutas(app)
+    with captura.como("login"):
+        # Credenciales inválidas: la búsqueda por correo sin iniciar sesión
+        app.test_client().post("/login", data=dict(email=muestra.paciente_email, password="-"))
+    for rol, usuario_id in muestra.roles.items():
+        if usuario_id is None:
+            continue
+        cliente = app.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion["_user_id"] = str(usuario_id)
+            sesion["_fresh"] = True
+        user_cache.clear()  # el primer request de cada rol pasa por fetch_user
+        for endpoint, regla in rutas:
+            url = adaptador.build(endpoint, {a: muestra.valores[a] for a in regla_args(app, endpoint, regla)})
+            for consulta in CONSULTAS.get(endpoint, ("",)):
+                nombre = f"{rol} GET {regla}" + (f"?{consulta}" if consulta else "")
+                with captura.como(nombre):
+                    r = cliente.get(url, query_string=consulta.format(**muestra.valores))
+                siguiente = _SIGUIENTE.search(r.get_data(as_text=True))
+                r.close()
+                if siguiente:
+                    with captura.como(f"{nombre} (página siguiente)"):
+                        cliente.get(html.unescape(siguiente.group(1))).close()
+
+
+def regla_args(app, endpoint, regla):
+    return next(r.arguments for r in app.url_map.iter_rules(endpoint) if r.rule == regla)
+
+
+def recorrer_helpers(muestra, captura):
+    """Caminos que los GET no recorren, con los helpers reales, en una transacción que se descarta."""
+    from sqlalchemy import update
+
+    import archive
+    import utils
+    from availability import _medicos
+    from cache import doctor_directory, fetch_user
+    from database import SessionLocal
+    from models import Cita, DoctorPaciente
+    from roster import roster_for
+
+    v = muestra.valores
+    medico_id, paciente_id = v["medico_id"], v["paciente_id"]
+    ahora = datetime.now().replace(second=0, microsecond=0)
+    antiguo = archive.horizonte(ahora) - timedelta(days=30)
+    db = SessionLocal.session_factory()
+    try:
+        with captura.como("load_user"):
+            fetch_user(db, muestra.roles["medico"])
+        with captura.como("directorio_medicos"):
+            doctor_directory.invalidate()
+            doctor_directory.entries()
+        with captura.como("disponibilidad_medicos"):
+            _medicos(db, especialidad=v["especialidad"])
+        with captura.como("has_overlap_sql"):
+            utils.sql_has_overlap(db, medico_id, ahora, ahora + timedelta(hours=1), exclude_id=v["cita_id"])
+        indice, utils.OVERLAP_INDEX = utils.OVERLAP_INDEX, False
+        try:
+            with captura.como("next_free_slot_sql"):
+                utils.next_free_slot(db, medico_id, ahora, timedelta(minutes=30))
+            with captura.como("busy_intervals_sql"):
+                utils.busy_intervals(db, medico_id, ahora, ahora + timedelta(days=14))
+        finally:
+            utils.OVERLAP_INDEX = indice
+        with captura.como("archivo_traslapes"):
+            archive.archived_overlaps(db, medico_id, antiguo, antiguo + timedelta(hours=1))
+            utils.series_conflicts(db, medico_id, utils.recurring_series(antiguo, antiguo + timedelta(hours=1), 8))
+        with captura.como("has_overlap"):
+            utils.has_overlap(db, medico_id, ahora + timedelta(days=400), ahora + timedelta(days=400, hours=1))
+        with captura.como("alta_cita"):
+            db.add(Cita(medico_id=medico_id, paciente_id=paciente_id,
+                        start_at=ahora + timedelta(days=401), end_at=ahora + timedelta(days=401, hours=1)))
+            db.flush()  # after_flush: doctor_paciente del par y filas vencidas del médico
+            utils.bulk_insert_citas(db, [dict(medico_id=medico_id, paciente_id=paciente_id,
+                                              start_at=ahora + timedelta(days=402),
+                                              end_at=ahora + timedelta(days=402, hours=1))])
+        with captura.como("roster_vencidos"):
+            db.execute(update(DoctorPaciente).where(DoctorPaciente.medico_id == medico_id)
+                       .values(next_visit=ahora - timedelta(days=1)))
+            roster_for(db, medico_id)
+        with captura.como("archivo_lote"):
+            archive.archive_batch(db, ahora)
+    finally:
+        db.rollback()
+        db.close()
+
+
+# ----------------- PLANES -----------------
+def explain(conn, sql, parametros):
+    """Filas 'detail' de EXPLAIN QUERY PLAN para una sentencia capturada."""
+    return [fila[3] for fila in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, parametros)]
+
+
+def check(conn, sentencias) -> list[str]:
+    """Imprime los planes; devuelve las fallas (vacía si nada recorre tablas o índices completos)."""
+    fallas = []
+    for nombre, por_sql in sorted(sentencias.items()):
+        print(f"{nombre}:")
+        for sql, parametros in por_sql.items():
+            print(f"  {' '.join(sql.split())[:110]}")
+            for detalle in explain(conn, sql, parametros):
+                print(f"      {detalle}")
+                m = _SCAN.match(detalle)
+                if (
+                    m
+                    and not m.group(1).startswith("anon_")
+                    and (nombre, m.group(1)) not in PERMITIDOS
+                    and (None, m.group(1)) not in PERMITIDOS
+                ):
+                    fallas.append(f"{nombre}: {detalle}")
+    return fallas
+
+
+def _preparar(actual, directorio):
+    """DATABASE_URL apuntando a una base desechable: copia de la actual o sembrada desde cero."""
+    destino = os.path.join(directorio, "plans.db")
+    if actual:
+        from sqlalchemy.engine import make_url
+
+        origen = sqlite3.connect(make_url(os.environ.get("DATABASE_URL", "sqlite:///health_system.db")).database)
+        copia = sqlite3.connect(destino)
+        try:
+            origen.backup(copia)
+        finally:
+            copia.close()
+            origen.close()
+    os.environ["DATABASE_URL"] = f"sqlite:///{destino}"
+    os.environ.pop("DATABASE_READ_URL", None)
+    os.environ["HASH_WORKERS"] = "0"
+    if not actual:
+        sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+        from generate_data import generate
+
+        generate(20, 2000, 20000, progreso=lambda _: None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Revisa los planes del SQL de las rutas.")
+    parser.add_argument("--actual", action="store_true", help="usar una copia de la base de DATABASE_URL")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    try:
+        _preparar(args.actual, directorio)
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        from app import app
+        from database import SessionLocal, engine
+
+        captura = Captura()
+        event.listen(Engine, "before_cursor_execute", captura)
+        with SessionLocal.session_factory() as db:
+            muestra = _muestra(db)
+        recorrer_rutas(app, muestra, captura)
+        recorrer_helpers(muestra, captura)
+        event.remove(Engine, "before_cursor_execute", captura)
+
+        with engine.connect() as conn:
+            fallas = check(conn, captura.sentencias)
+        engine.dispose()
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    if fallas:
+        print("\nConsultas que recorren tablas o índices completos:")
+        for falla in fallas:
+            print(f"  - {falla}")
+        return 1
+    print(f"\n{sum(map(len, captura.sentencias.values()))} sentencias; todas usan índices.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, RAIZ)
+    sys.exit(main())
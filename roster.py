@@ -0,0 +1,170 @@
+"""
+Mantenimiento de doctor_paciente: pacientes de cada médico con sus conteos.
+
+Cada flush que toca citas recalcula, en la misma transacción, los pares
+(medico_id, paciente_id) afectados. pending_count y next_visit dependen de la
+hora del cálculo; si next_visit ya pasó, la fila está vencida y roster_for la
+corrige al leer, mientras que el siguiente flush del médico la recalcula.
+
+    python roster.py          # reconstruye la tabla completa
+"""
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import and_, case, delete, event, func, insert, inspect, literal, null, select, tuple_, union_all
+
+from database import SessionLocal
+from models import Usuario, Cita, CitaArchivada, DoctorPaciente, EstadoCita, CITA_ACTIVA
+
+_LOTE = 400  # pares por sentencia (límite de variables de SQLite)
+
+
+def _resumen(ahora, filtros):
+    """
+    (medico_id, paciente_id, pending_count, last_visit, next_visit) de los pares
+    que cumplen filtros(modelo). citas_archivo solo tiene citas concluidas: aporta
+    last_visit y mantiene el par aunque ya no le queden citas en citas.
+    """
+    activa_futura = and_(CITA_ACTIVA, Cita.start_at >= ahora)
+    vigentes = (
+        select(
+            Cita.medico_id,
+            Cita.paciente_id,
+            func.sum(case((activa_futura, 1), else_=0)).label("pending_count"),
+            func.max(case((Cita.estado == EstadoCita.ATENDIDA, Cita.start_at))).label("last_visit"),
+            func.min(case((activa_futura, Cita.start_at))).label("next_visit"),
+        )
+        .where(*filtros(Cita))
+        .group_by(Cita.medico_id, Cita.paciente_id)
+    )
+    archivadas = (
+        select(
+            CitaArchivada.medico_id,
+            CitaArchivada.paciente_id,
+            literal(0),
+            func.max(case((CitaArchivada.estado == EstadoCita.ATENDIDA, CitaArchivada.start_at))),
+            null(),
+        )
+        .where(*filtros(CitaArchivada))
+        .group_by(CitaArchivada.medico_id, CitaArchivada.paciente_id)
+    )
+    pares = union_all(vigentes, archivadas).subquery()
+    return select(
+        pares.c.medico_id,
+        pares.c.paciente_id,
+        func.sum(pares.c.pending_count),
+        func.max(pares.c.last_visit),
+        func.min(pares.c.next_visit),
+    ).group_by(pares.c.medico_id, pares.c.paciente_id)
+
+
+def _insert_resumen(conn, ahora, filtros=lambda modelo: ()):
+    conn.execute(
+        insert(DoctorPaciente).from_select(
+            ["medico_id", "paciente_id", "pending_count", "last_visit", "next_visit"],
+            _resumen(ahora, filtros),
+        )
+    )
+
+
+def refresh_pairs(conn, pares, ahora=None):
+    """Recalcula las filas de los pares dados (y borra las que ya no tienen citas)."""
+    ahora = ahora or datetime.now()
+    pares = list(pares)
+    for i in range(0, len(pares), _LOTE):
+        lote = pares[i:i + _LOTE]
+        medicos = list({m for m, _ in lote})
+        pacientes = list({p for _, p in lote})
+        # SQLite no usa índices con IN de tuplas: los IN por columna acotan la búsqueda
+        conn.execute(
+            delete(DoctorPaciente).where(
+                DoctorPaciente.medico_id.in_(medicos),
+                DoctorPaciente.paciente_id.in_(pacientes),
+                tuple_(DoctorPaciente.medico_id, DoctorPaciente.paciente_id).in_(lote),
+            )
+        )
+        _insert_resumen(
+            conn,
+            ahora,
+            lambda modelo: (
+                modelo.medico_id.in_(medicos),
+                modelo.paciente_id.in_(pacientes),
+                tuple_(modelo.medico_id, modelo.paciente_id).in_(lote),
+            ),
+        )
+
+
+def refresh_stale(conn, medico_ids, ahora=None):
+    """Recalcula las filas vencidas (next_visit en el pasado) de los médicos dados."""
+    ahora = ahora or datetime.now()
+    pares = conn.execute(
+        select(DoctorPaciente.medico_id, DoctorPaciente.paciente_id).where(
+            DoctorPaciente.medico_id.in_(list(medico_ids)),
+            DoctorPaciente.next_visit < ahora,
+        )
+    ).all()
+    if pares:
+        refresh_pairs(conn, [tuple(p) for p in pares], ahora)
+
+
+def rebuild(conn):
+    """Reconstruye doctor_paciente completa a partir de citas y citas_archivo."""
+    conn.execute(delete(DoctorPaciente))
+    _insert_resumen(conn, datetime.now())
+
+
+def roster_for(db, medico_id):
+    """(pacientes ordenados por apellido/nombre, {paciente_id: citas pendientes}) del médico."""
+    filas = (
+        db.query(Usuario, DoctorPaciente.pending_count, DoctorPaciente.next_visit)
+        .join(DoctorPaciente, DoctorPaciente.paciente_id == Usuario.id)
+        .filter(DoctorPaciente.medico_id == medico_id)
+        .order_by(Usuario.apellido.asc(), Usuario.nombre.asc())
+        .all()
+    )
+    ahora = datetime.now()
+    pacientes = [u for u, _, _ in filas]
+    pending_counts = {u.id: n for u, n, _ in filas if n}
+
+    # Filas vencidas: una cita pendiente ya pasó desde el último cálculo
+    vencidos = [u.id for u, _, proxima in filas if proxima is not None and proxima < ahora]
+    for i in range(0, len(vencidos), _LOTE):
+        lote = vencidos[i:i + _LOTE]
+        for pid in lote:
+            pending_counts.pop(pid, None)
+        rows = (
+            db.query(Cita.paciente_id, func.count(Cita.id))
+            .filter(Cita.medico_id == medico_id, Cita.paciente_id.in_(lote), Cita.start_at >= ahora, CITA_ACTIVA)
+            .group_by(Cita.paciente_id)
+            .all()
+        )
+        pending_counts.update(rows)
+    return pacientes, pending_counts
+
+
+@event.listens_for(SessionLocal.session_factory, "after_flush")
+def _refresh_after_flush(session, flush_context):
+    pares = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(obj, Cita) or (obj in session.dirty and not session.is_modified(obj)):
+            continue
+        attrs = inspect(obj).attrs
+        # Incluye los valores anteriores si la cita cambió de médico o de paciente
+        for medico_id in attrs.medico_id.history.deleted or [obj.medico_id]:
+            for paciente_id in attrs.paciente_id.history.deleted or [obj.paciente_id]:
+                pares.add((medico_id, paciente_id))
+        pares.add((obj.medico_id, obj.paciente_id))
+    if pares:
+        conn = session.connection(bind_arguments={"primary": True})
+        refresh_pairs(conn, pares)
+        refresh_stale(conn, {medico_id for medico_id, _ in pares})
+
+
+if __name__ == "__main__":
+    from database import engine, init_db
+
+    init_db()
+    with engine.begin() as conn:
+        rebuild(conn)
+        total = conn.execute(select(func.count()).select_from(DoctorPaciente)).scalar()
+    print(f"doctor_paciente reconstruida: {total} filas")
@@ -1,8 +1,5 @@
-from app import create_app, db
+"""Atajo para el servidor de producción: python run.py --workers 4 (ver server.py)."""
+from server import main
 
-app = create_app()
-
-if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
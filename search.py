@@ -0,0 +1,188 @@
+"""
+Búsqueda de pacientes: texto completo (FTS5) sobre pacientes y expedientes, y
+autocompletado por prefijo de nombre, apellido o correo.
+
+pacientes_fts tiene una fila por paciente (rowid = usuarios.id) con nombre,
+apellido, email y los campos del expediente. La mantienen triggers de SQLite,
+así que también ven las escrituras de Core (bulk_insert, importer.py) y las
+hechas a mano sobre la base. Sin acentos y sin distinguir mayúsculas
+(unicode61 remove_diacritics 2).
+
+El autocompletado no usa FTS5: compara contra Usuario.nombre_norm y
+apellido_norm (minúsculas, sin acentos) con rangos sobre sus índices, así que
+cada tecla cuesta lo mismo con cien que con cien mil pacientes.
+
+    python search.py          # reconstruye el índice completo
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import and_, text
+
+from models import Usuario, TipoUsuario, normalizar
+
+TABLA = "pacientes_fts"
+CAMPOS = ("nombre", "apellido", "email", "antecedentes", "alergias", "notas_clinicas")
+# Peso de cada columna en bm25 (mismo orden que CAMPOS): el nombre pesa más que las notas
+PESOS = (4.0, 4.0, 2.0, 1.0, 2.0, 1.0)
+SEARCH_LIMIT = 50
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX = 25
+
+_INICIO, _FIN = "\x02", "\x03"  # marcas de highlight(); se cambian por <mark> ya escapado el texto
+_PALABRA = re.compile(r"\w+", re.UNICODE)
+
+
+def _refrescar(paciente_id):
+    """Sentencias que rehacen la fila de un paciente (expresión SQL para su id)."""
+    return f"""
+        DELETE FROM {TABLA} WHERE rowid = {paciente_id};
+        INSERT INTO {TABLA} (rowid, {", ".join(CAMPOS)})
+        SELECT u.id, u.nombre, u.apellido, u.email, e.antecedentes, e.alergias, e.notas_clinicas
+        FROM usuarios u LEFT JOIN expedientes e ON e.paciente_id = u.id
+        WHERE u.id = {paciente_id} AND u.tipo = 'PACIENTE';"""
+
+
+DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA} USING fts5(
+        {", ".join(CAMPOS)}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_usuario_ai AFTER INSERT ON usuarios
+        BEGIN {_refrescar("new.id")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_usuario_au AFTER UPDATE OF nombre, apellido, email, tipo ON usuarios
+        BEGIN {_refrescar("new.id")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_usuario_ad AFTER DELETE ON usuarios
+        BEGIN DELETE FROM {TABLA} WHERE rowid = old.id; END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_expediente_ai AFTER INSERT ON expedientes
+        BEGIN {_refrescar("new.paciente_id")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_expediente_au
+        AFTER UPDATE OF paciente_id, antecedentes, alergias, notas_clinicas ON expedientes
+        BEGIN {_refrescar("old.paciente_id")} {_refrescar("new.paciente_id")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_expediente_ad AFTER DELETE ON expedientes
+        BEGIN {_refrescar("old.paciente_id")} END""",
+]
+
+
+def install(conn):
+    """Crea la tabla virtual y los triggers si no existen."""
+    for sentencia in DDL:
+        conn.exec_driver_sql(sentencia)
+
+
+def rebuild(conn):
+    """Vacía el índice y lo vuelve a llenar desde usuarios y expedientes."""
+    conn.exec_driver_sql(f"DELETE FROM {TABLA}")
+    conn.exec_driver_sql(
+        f"""INSERT INTO {TABLA} (rowid, {", ".join(CAMPOS)})
+        SELECT u.id, u.nombre, u.apellido, u.email, e.antecedentes, e.alergias, e.notas_clinicas
+        FROM usuarios u LEFT JOIN expedientes e ON e.paciente_id = u.id
+        WHERE u.tipo = 'PACIENTE'"""
+    )
+
+
+def fts_query(texto: str, campo: str | None = None) -> str | None:
+    """
+    Texto libre -> consulta FTS5: cada palabra entre comillas (sin operadores
+    del usuario) y como prefijo, todas obligatorias. None si no hay palabras.
+    """
+    palabras = _PALABRA.findall(texto or "")
+    if not palabras:
+        return None
+    consulta = " ".join(f'"{p}"*' for p in palabras)
+    if campo:
+        if campo not in CAMPOS:
+            raise ValueError(f"Campo de búsqueda desconocido: {campo}")
+        consulta = f"{campo} : ({consulta})"
+    return consulta
+
+
+def _marcar(valor):
+    """Escapa el texto de highlight()/snippet() y convierte sus marcas en <mark>."""
+    if valor is None:
+        return None
+    return Markup(str(escape(valor)).replace(_INICIO, "<mark>").replace(_FIN, "</mark>"))
+
+
+def search(db, texto: str, campo: str | None = None, paciente_id: int | None = None, limite: int = SEARCH_LIMIT):
+    """
+    Pacientes que coinciden con 'texto', del más al menos relevante (bm25).
+    Devuelve dicts con id, nombre, apellido y email resaltados (Markup con
+    <mark>) y 'fragmento': el trozo del expediente o del nombre que mejor
+    coincide. paciente_id restringe la búsqueda a ese paciente.
+    """
+    consulta = fts_query(texto, campo)
+    if consulta is None:
+        return []
+    resaltar = ", ".join(
+        f"highlight({TABLA}, {i}, :ini, :fin) AS {c}" for i, c in enumerate(CAMPOS[:3])
+    )
+    sql = f"""
+        SELECT rowid AS id, {resaltar}, snippet({TABLA}, -1, :ini, :fin, '…', 12) AS fragmento
+        FROM {TABLA}
+        WHERE {TABLA} MATCH :consulta {"AND rowid = :paciente_id" if paciente_id is not None else ""}
+        ORDER BY bm25({TABLA}, {", ".join(str(p) for p in PESOS)})
+        LIMIT :limite"""
+    filas = db.execute(
+        text(sql),
+        {"consulta": consulta, "ini": _INICIO, "fin": _FIN, "paciente_id": paciente_id, "limite": limite},
+    ).mappings()
+    return [
+        {"id": f["id"], **{c: _marcar(f[c]) for c in CAMPOS[:3]}, "fragmento": _marcar(f["fragmento"])}
+        for f in filas
+    ]
+
+
+# ----------------- AUTOCOMPLETADO -----------------
+def _prefijo(columna, prefijo):
+    """columna empieza con 'prefijo', escrito como rango: LIKE no usaría el índice (no es NOCASE)."""
+    return and_(columna >= prefijo, columna < prefijo[:-1] + chr(ord(prefijo[-1]) + 1))
+
+
+def typeahead(db, texto: str, limite: int = TYPEAHEAD_LIMIT):
+    """
+    Hasta 'limite' pacientes (id, nombre, apellido, email) que empiezan con
+    'texto' sin importar acentos ni mayúsculas: primero por apellido, luego por
+    nombre, por correo y por "apellido nombre" o "nombre apellido". Cada
+    variante es un rango sobre un índice con su propio LIMIT.
+    """
+    q = " ".join(normalizar(texto or "").split())
+    if not q:
+        return []
+    variantes = [
+        ((_prefijo(Usuario.apellido_norm, q),), (Usuario.apellido_norm, Usuario.nombre_norm)),
+        ((_prefijo(Usuario.nombre_norm, q),), (Usuario.nombre_norm, Usuario.apellido_norm)),
+        ((_prefijo(Usuario.email, q),), (Usuario.email,)),
+    ]
+    palabras = q.split(" ")
+    for i in range(1, min(len(palabras), 4)):
+        izq, der = " ".join(palabras[:i]), " ".join(palabras[i:])
+        variantes += [
+            ((_prefijo(Usuario.apellido_norm, izq), _prefijo(Usuario.nombre_norm, der)),
+             (Usuario.apellido_norm, Usuario.nombre_norm)),
+            ((_prefijo(Usuario.nombre_norm, izq), _prefijo(Usuario.apellido_norm, der)),
+             (Usuario.nombre_norm, Usuario.apellido_norm)),
+        ]
+
+    encontrados = {}
+    for filtros, orden in variantes:
+        filas = (
+            db.query(Usuario.id, Usuario.nombre, Usuario.apellido, Usuario.email)
+            .filter(Usuario.tipo == TipoUsuario.PACIENTE, *filtros)
+            .order_by(*orden, Usuario.id)
+            .limit(limite)
+        )
+        for fila in filas:
+            encontrados.setdefault(fila.id, fila)
+        if len(encontrados) >= limite:
+            break
+    return [dict(f._mapping) for f in list(encontrados.values())[:limite]]
+
+
+if __name__ == "__main__":
+    from database import engine, init_db
+
+    init_db()
+    with engine.begin() as conn:
+        install(conn)
+        rebuild(conn)
+        total = conn.exec_driver_sql(f"SELECT count(*) FROM {TABLA}").scalar()
+    print(f"{TABLA}: {total} pacientes")
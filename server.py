@@ -0,0 +1,249 @@
+"""
+Servidor de producción: un proceso maestro y N workers que comparten el socket.
+
+    python server.py --workers 4 --port 8000 [--max-requests 5000]
+
+El maestro importa app.py una sola vez (init_db revisa el esquema y aplica
+migraciones) y abre el socket; los workers nacen con fork con la app ya
+cargada, descartan las conexiones heredadas de los pools y atienden con el
+servidor con hilos de Werkzeug. Señales al maestro:
+
+    TERM / INT   cierre ordenado: los workers terminan las peticiones en curso
+    HUP          recarga: el maestro vuelve a ejecutarse con el código nuevo
+                 (exec) sin cerrar el socket, arranca workers nuevos y después
+                 retira los anteriores
+
+Con --max-requests cada worker se recicla tras ese número de peticiones (más
+un margen aleatorio de hasta 10 % para que no se reinicien todos a la vez).
+
+Las métricas de /metrics se suman entre workers a través de METRICS_DIR (un
+directorio temporal si no se configura). Los cachés en memoria son por
+proceso: los usuarios y los fragmentos se acotan con su TTL, el directorio de
+médicos compara un sello con la base cada DIRECTORY_CHECK_SECONDS (cache.py) y
+el índice de agendas se descarta al detectar commits de otros procesos
+(interval_index.py).
+Requiere fork (Linux/macOS); en Windows queda el servidor de desarrollo de
+app.py.
+"""
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from werkzeug.serving import ThreadedWSGIServer
+
+import metrics
+import passwords
+
+log = logging.getLogger("server")
+
+HOST = os.environ.get("HOST", "127.0.0.1")
+PORT = int(os.environ.get("PORT", 5000))
+WORKERS = int(os.environ.get("WEB_WORKERS", 0)) or os.cpu_count() or 1
+MAX_REQUESTS = int(os.environ.get("WEB_MAX_REQUESTS", 0))  # 0 = sin reciclar
+GRACEFUL_TIMEOUT = float(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))
+
+_FD_ENV = "HS_LISTEN_FD"  # socket heredado al recargar con exec
+_OLD_ENV = "HS_OLD_WORKERS"  # pids de los workers a retirar tras la recarga
+
+
+# ----------------- WORKER -----------------
+class _WorkerServer(ThreadedWSGIServer):
+    daemon_threads = False  # server_close espera a las peticiones en curso
+    atendidas = 0
+
+    def process_request(self, request, client_address):
+        self.atendidas += 1
+        super().process_request(request, client_address)
+
+
+def _worker(sock, app, host, max_requests):
+    """Cuerpo del proceso hijo; nunca regresa."""
+    parar = False
+
+    def _terminar(signum, frame):
+        nonlocal parar
+        parar = True
+
+    signal.signal(signal.SIGTERM, _terminar)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C llega a todo el grupo: decide el maestro
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Las conexiones abiertas por el maestro no se comparten entre procesos
+    from database import engine, primary_read_engine, read_engine
+
+    engine.dispose(close=False)
+    read_engine.dispose(close=False)
+    if primary_read_engine not in (engine, read_engine):  # con DATABASE_READ_URL: los lectores del primario
+        primary_read_engine.dispose(close=False)
+    random.seed()
+
+    maestro = os.getppid()
+    limite = max_requests + random.randint(0, max_requests // 10) if max_requests else 0
+    server = _WorkerServer(host, sock.getsockname()[1], app, fd=sock.fileno())
+    server.socket.setblocking(False)  # con varios workers, otro pudo haber tomado la conexión
+    server.timeout = 1.0
+    try:
+        while not parar and not (limite and server.atendidas >= limite):
+            server.handle_request()
+            metrics.flush_if_due()
+            if os.getppid() != maestro:
+                log.warning("Worker %s: el maestro terminó; se cierra", os.getpid())
+                break
+    finally:
+        server.server_close()
+        metrics.flush()
+        passwords.shutdown()
+    os._exit(0)
+
+
+# ----------------- MAESTRO -----------------
+class Arbiter:
+    """Mantiene 'workers' procesos vivos y atiende las señales de cierre y recarga."""
+
+    def __init__(self, sock, app, host, workers, max_requests):
+        self.sock = sock
+        self.app = app
+        self.host = host
+        self.workers = workers
+        self.max_requests = max_requests
+        self.hijos = set()
+        self.parar = False
+        self.recargar = False
+
+    def _senal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.recargar = True
+        elif self.parar:
+            # Segunda señal de cierre: sin esperar a las peticiones en curso
+            self._enviar(signal.SIGKILL, self.hijos)
+        else:
+            self.parar = True
+
+    def _enviar(self, signum, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _arrancar(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _worker(self.sock, self.app, self.host, self.max_requests)
+            finally:
+                os._exit(1)
+        self.hijos.add(pid)
+
+    def _recoger(self):
+        while True:
+            try:
+                pid, estado = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if metrics.METRICS_DIR:
+                metrics.collect_dead(pid)
+            if pid in self.hijos:
+                self.hijos.discard(pid)
+                if estado and not self.parar:
+                    log.warning("Worker %s terminó con estado %s; se reemplaza", pid, estado)
+
+    def _reejecutar(self):
+        """Recarga sin cerrar el socket: exec del maestro con el código nuevo si importa sin errores."""
+        # Mismo directorio de trabajo que el maestro (DATABASE_URL puede ser relativo)
+        ruta = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")]))
+        prueba = subprocess.run([sys.executable, "-c", "import app"], env=dict(os.environ, PYTHONPATH=ruta))
+        if prueba.returncode != 0:
+            log.error("La recarga se canceló: app.py no importa con el código nuevo")
+            return
+        os.set_inheritable(self.sock.fileno(), True)
+        os.environ[_FD_ENV] = str(self.sock.fileno())
+        os.environ[_OLD_ENV] = ",".join(str(pid) for pid in self.hijos)
+        log.info("Recargando el maestro (pid %s)", os.getpid())
+        logging.shutdown()
+        os.execv(sys.executable, [sys.executable, *sys.orig_argv[1:]])
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self._senal)
+
+        # Tras un exec: los workers anteriores siguen siendo hijos de este pid
+        anteriores = {int(pid) for pid in os.environ.pop(_OLD_ENV, "").split(",") if pid}
+        for _ in range(self.workers):
+            self._arrancar()
+        if anteriores:
+            self._enviar(signal.SIGTERM, anteriores)
+        log.info("Maestro %s con %s workers en %s", os.getpid(), self.workers, self.sock.getsockname())
+
+        while not self.parar:
+            self._recoger()
+            if self.recargar:
+                self.recargar = False
+                self._reejecutar()
+            while len(self.hijos) < self.workers and not self.parar:
+                self._arrancar()
+            time.sleep(0.5)
+
+        log.info("Cerrando: esperando a %s workers", len(self.hijos))
+        self._enviar(signal.SIGTERM, self.hijos)
+        limite = time.monotonic() + GRACEFUL_TIMEOUT
+        while self.hijos and time.monotonic() < limite:
+            self._recoger()
+            time.sleep(0.1)
+        self._enviar(signal.SIGKILL, self.hijos)
+        self.sock.close()
+
+
+def _socket(host, port):
+    heredado = os.environ.pop(_FD_ENV, None)
+    if heredado:
+        return socket.socket(fileno=int(heredado))
+    familia = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return socket.create_server((host, port), family=familia, backlog=2048, reuse_port=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de producción con workers (fork).")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--max-requests", type=int, default=MAX_REQUESTS,
+                        help="reciclar cada worker tras N peticiones (0 = nunca)")
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        sys.exit("server.py requiere fork; en Windows usa: python app.py")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(message)s")
+
+    recarga = _FD_ENV in os.environ
+    sock = _socket(args.host, args.port)
+    if metrics.METRICS_DIR is None and args.workers > 1:
+        # /metrics suma los contadores que cada worker vuelca aquí (ver metrics.py)
+        metrics.METRICS_DIR = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="hs-metrics-")
+    elif metrics.METRICS_DIR and not recarga:
+        os.makedirs(metrics.METRICS_DIR, exist_ok=True)
+        for nombre in os.listdir(metrics.METRICS_DIR):  # contadores de una ejecución anterior
+            if nombre.endswith((".json", ".tmp")):
+                os.remove(os.path.join(metrics.METRICS_DIR, nombre))
+    # Una sola vez en el maestro: importar app.py corre init_db (esquema y migraciones)
+    from app import app
+    from database import engine, primary_read_engine, read_engine
+
+    engine.dispose()
+    read_engine.dispose()
+    if primary_read_engine not in (engine, read_engine):
+        primary_read_engine.dispose()
+    Arbiter(sock, app, args.host, args.workers, args.max_requests).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Caché de bytecode de Jinja en disco y caché de fragmentos {% cache %}.
+
+El bytecode se guarda por nombre de plantilla y no por ruta: en el ejecutable
+onefile de PyInstaller las plantillas se extraen a un directorio temporal
+distinto en cada arranque. Jinja compara además la suma de la fuente, así que
+una plantilla modificada se recompila sola.
+
+    {% cache "citas_fila", c, c.paciente %} ... {% endcache %}
+
+Las partes de la llave que son modelos se reemplazan por (tabla, id, versión):
+la columna version si el modelo la tiene (vale también entre procesos) y si no
+un contador en memoria que sube al confirmar un cambio a esa fila.
+"""
+import hashlib
+import logging
+import os
+import sys
+import threading
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from cache import TTLCache
+from database import on_commit
+
+log = logging.getLogger(__name__)
+
+if getattr(sys, "frozen", False):
+    _BASE_DIR = os.path.dirname(sys.executable)  # junto al .exe, no en el temporal de _MEIPASS
+else:
+    _BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cadena vacía desactiva la caché de bytecode
+TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR", os.path.join(_BASE_DIR, ".template_cache"))
+
+
+# ----------------- BYTECODE -----------------
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache con llave independiente de la ruta de extracción."""
+
+    def get_cache_key(self, name, filename=None):
+        return hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+
+def template_fingerprint(carpeta) -> str:
+    """Hash del contenido de las plantillas; cambia con cada despliegue que las toque."""
+    h = hashlib.sha1()
+    for raiz, _, archivos in sorted(os.walk(carpeta)):
+        for nombre in sorted(archivos):
+            ruta = os.path.join(raiz, nombre)
+            h.update(os.path.relpath(ruta, carpeta).encode("utf-8"))
+            with open(ruta, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+# ----------------- FRAGMENTOS -----------------
+class EntityVersions:
+    """Versión en memoria por (tabla, id); al llenarse se reinicia con una nueva época."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.epoch = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, tabla, id):
+        return self.epoch, self._versions.get((tabla, id), 0)
+
+    def bump(self, tabla, id):
+        with self._lock:
+            if len(self._versions) >= self.maxsize:
+                # La época entra en todas las llaves: reiniciar invalida todo sin perder cambios
+                self._versions.clear()
+                self.epoch += 1
+            clave = (tabla, id)
+            self._versions[clave] = self._versions.get(clave, 0) + 1
+
+
+FRAGMENT_CACHE = os.environ.get("FRAGMENT_CACHE", "1") == "1"
+entity_versions = EntityVersions(int(os.environ.get("FRAGMENT_VERSIONS_SIZE", 100_000)))
+fragment_cache = TTLCache(
+    maxsize=int(os.environ.get("FRAGMENT_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("FRAGMENT_CACHE_TTL", 60)),
+)
+
+
+@on_commit
+def _bump_versions(cambios):
+    for _, obj in cambios:
+        tabla = getattr(obj, "__tablename__", None)
+        # Los modelos con columna version no necesitan el contador
+        if tabla and getattr(obj, "id", None) is not None and not hasattr(obj, "version"):
+            entity_versions.bump(tabla, obj.id)
+
+
+def fragment_key(partes):
+    llave = []
+    for parte in partes:
+        tabla = getattr(parte, "__tablename__", None)
+        if tabla is None:
+            llave.append(parte)
+        else:
+            version = getattr(parte, "version", None)
+            llave.append((tabla, parte.id, version if version is not None else entity_versions.get(tabla, parte.id)))
+    return tuple(llave)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        partes = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            partes.append(parser.parse_expression())
+        cuerpo = parser.parse_statements(("name:endcache",), drop_needle=True)
+        # Plantilla y línea entran en la llave: dos bloques con la misma llave no chocan
+        origen = nodes.Const(f"{parser.name}:{lineno}")
+        llamada = self.call_method("_render", [origen, nodes.List(partes)])
+        return nodes.CallBlock(llamada, [], [], cuerpo).set_lineno(lineno)
+
+    def _render(self, origen, partes, caller):
+        if not FRAGMENT_CACHE:
+            return caller()
+        llave = (origen, fragment_key(partes))
+        html = fragment_cache.get(llave)
+        if html is None:
+            html = caller()
+            fragment_cache.set(llave, html)
+        return html
+
+
+def init_templates(app):
+    """Activa la caché de bytecode (si hay directorio escribible) y la extensión {% cache %}."""
+    if TEMPLATE_CACHE_DIR:
+        try:
+            os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+            app.jinja_env.bytecode_cache = TemplateBytecodeCache(TEMPLATE_CACHE_DIR)
+        except OSError:
+            log.warning("Sin caché de bytecode: no se pudo crear %s", TEMPLATE_CACHE_DIR)
+    app.jinja_env.add_extension(FragmentCacheExtension)
@@ -0,0 +1,92 @@
+"""
+Base compartida por las pruebas: una base temporal sembrada con
+benchmarks/generate_data.py, con parte de las citas ya archivada.
+
+El entorno se fija aquí, antes de que cualquier módulo de pruebas importe la
+app: HS_STRICT_LOADS=1 hace que una relación sin joinedload/selectinload
+(raise_on_sql) o una vista que pasa su presupuesto (PresupuestoExcedido)
+falle la prueba en lugar de responder 500.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from urllib.parse import urlsplit
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "benchmarks")]
+
+DIRECTORIO = tempfile.mkdtemp(prefix="hs-pruebas-")
+os.environ.update(
+    HS_STRICT_LOADS="1",
+    METRICS="1",
+    DATABASE_URL=f"sqlite:///{os.path.join(DIRECTORIO, 'pruebas.db')}",
+    ARCHIVE_AFTER_DAYS="30",  # las citas generadas van ~70 días atrás: parte queda archivada
+    HASH_WORKERS="0",  # sin pool de procesos para las contraseñas
+)
+os.environ.pop("DATABASE_READ_URL", None)
+
+import pytest  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+import archive  # noqa: E402
+from app import app  # noqa: E402
+from database import SessionLocal, engine, read_engine  # noqa: E402
+from generate_data import BENCH_PASSWORD, generate  # noqa: E402
+from models import Cita, Medico, Usuario  # noqa: E402
+
+ROLES = ("admin", "medico", "paciente")
+
+
+def _muestra():
+    """medico0, su paciente con más citas y los correos de cada rol."""
+    with SessionLocal.session_factory() as db:
+        medico_id = db.scalar(
+            select(Medico.id).join(Usuario, Medico.usuario_id == Usuario.id)
+            .where(Usuario.email == "medico0@bench.local")
+        )
+        paciente_id = db.scalar(
+            select(Cita.paciente_id).where(Cita.medico_id == medico_id)
+            .group_by(Cita.paciente_id).order_by(func.count().desc()).limit(1)
+        )
+        email, nombre, apellido = db.execute(
+            select(Usuario.email, Usuario.nombre, Usuario.apellido).where(Usuario.id == paciente_id)
+        ).one()
+    return dict(
+        medico_id=medico_id,
+        paciente_id=paciente_id,
+        q=apellido.split()[0],
+        prefijo=nombre[:3],
+        emails=dict(admin="admin@bench.local", medico="medico0@bench.local", paciente=email),
+    )
+
+
+@pytest.fixture(scope="session")
+def muestra():
+    generate(5, 200, 3000, progreso=lambda _: None)
+    assert archive.archive() > 0
+    app.testing = True  # PresupuestoExcedido y los errores de carga llegan a la prueba, no a un 500
+    yield _muestra()
+    engine.dispose()
+    read_engine.dispose()
+    shutil.rmtree(DIRECTORIO, ignore_errors=True)
+
+
+def iniciar_sesion(rol, muestra):
+    cliente = app.test_client()
+    r = cliente.post("/login", data=dict(email=muestra["emails"][rol], password=BENCH_PASSWORD))
+    assert r.status_code == 302 and urlsplit(r.headers["Location"]).path == "/", rol
+    return cliente
+
+
+@pytest.fixture(scope="session")
+def clientes(muestra):
+    return {rol: iniciar_sesion(rol, muestra) for rol in ROLES}
+
+
+@pytest.fixture
+def db(muestra):
+    """Sesión de escritura propia; lo que no se confirme se descarta al final."""
+    with SessionLocal.session_factory() as sesion:
+        yield sesion
+        sesion.rollback()
@@ -0,0 +1,79 @@
+"""
+Agenda de los médicos: el índice en memoria (interval_index.py) contra el SQL
+de respaldo, y series_conflicts contra has_overlap ocurrencia por ocurrencia.
+"""
+import random
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from archive import horizonte
+from interval_index import agenda_index
+from models import Cita, CitaArchivada, EstadoCita, Medico
+from utils import has_overlap, next_free_slot, recurring_series, series_conflicts, sql_has_overlap
+
+
+def _intervalos(db, medico_id, n, semilla):
+    """n intervalos al azar de 15 a 90 minutos dentro del rango de citas del médico, más los bordes de sus citas."""
+    rnd = random.Random(semilla)
+    desde, hasta = db.execute(
+        select(func.min(Cita.start_at), func.max(Cita.end_at)).where(Cita.medico_id == medico_id)
+    ).one()
+    minutos = int((hasta - desde).total_seconds() // 60)
+    intervalos = []
+    for _ in range(n):
+        inicio = desde + timedelta(minutes=rnd.randrange(minutos))
+        intervalos.append((inicio, inicio + timedelta(minutes=rnd.choice((15, 30, 45, 90)))))
+    # Inicio o fin exactamente en el borde de una cita: [a, b) no choca con [b, c)
+    for cita in db.scalars(select(Cita).where(Cita.medico_id == medico_id).limit(20)):
+        media_hora = timedelta(minutes=30)
+        intervalos += [(cita.end_at, cita.end_at + media_hora), (cita.start_at - media_hora, cita.start_at)]
+    return intervalos
+
+
+def test_indice_igual_a_sql(db):
+    agenda_index.invalidate()
+    for medico_id in db.scalars(select(Medico.id)):
+        for start_at, end_at in _intervalos(db, medico_id, 200, medico_id):
+            esperado = sql_has_overlap(db, medico_id, start_at, end_at)
+            assert agenda_index.overlaps(db, medico_id, start_at, end_at) is esperado, (medico_id, start_at, end_at)
+        # exclude_id: una cita no choca consigo misma
+        cita = db.scalars(select(Cita).where(Cita.medico_id == medico_id).limit(1)).one()
+        assert agenda_index.overlaps(db, medico_id, cita.start_at, cita.end_at, cita.id) is sql_has_overlap(
+            db, medico_id, cita.start_at, cita.end_at, cita.id
+        )
+
+
+def test_indice_sigue_los_commits(db, muestra):
+    medico_id, paciente_id = muestra["medico_id"], muestra["paciente_id"]
+    inicio = next_free_slot(db, medico_id, db.scalar(select(func.max(Cita.end_at))), timedelta(hours=1))
+    assert agenda_index.overlaps(db, medico_id, inicio, inicio + timedelta(hours=1)) is False  # agenda cargada
+
+    cita = Cita(medico_id=medico_id, paciente_id=paciente_id, start_at=inicio, end_at=inicio + timedelta(hours=1),
+                estado=EstadoCita.PENDIENTE)
+    db.add(cita)
+    db.commit()
+    try:
+        for desplazamiento in (-30, 0, 30):
+            a = inicio + timedelta(minutes=desplazamiento)
+            assert agenda_index.overlaps(db, medico_id, a, a + timedelta(hours=1)) is True
+        assert agenda_index.overlaps(db, medico_id, cita.end_at, cita.end_at + timedelta(hours=1)) is False
+        assert next_free_slot(db, medico_id, inicio, timedelta(minutes=30)) == cita.end_at
+    finally:
+        db.delete(cita)
+        db.commit()
+    assert agenda_index.overlaps(db, medico_id, inicio, inicio + timedelta(hours=1)) is False
+
+
+def test_series_conflicts_igual_a_has_overlap(db, muestra):
+    medico_id = muestra["medico_id"]
+    # Series diaria y semanal que arrancan en una cita archivada y cruzan el horizonte del archivo
+    archivada = db.scalars(
+        select(CitaArchivada).where(CitaArchivada.medico_id == medico_id).order_by(CitaArchivada.start_at).limit(1)
+    ).one()
+    assert archivada.start_at < horizonte()
+    for cada_dias in (1, 7):
+        ocurrencias = recurring_series(archivada.start_at, archivada.end_at, 60, cada_dias)
+        esperado = {i for i, (s, e) in enumerate(ocurrencias) if has_overlap(db, medico_id, s, e)}
+        assert 0 in esperado and len(esperado) < len(ocurrencias), esperado
+        assert series_conflicts(db, medico_id, ocurrencias) == esperado
@@ -0,0 +1,47 @@
+"""
+Búsqueda de pacientes (FTS5): las mismas reglas de acceso que expediente_view.
+El paciente solo se encuentra a sí mismo; médico y administrador, a cualquiera.
+"""
+import pytest
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import TipoUsuario, Usuario
+
+
+@pytest.fixture(scope="module")
+def otro(muestra):
+    """Un paciente distinto al de la sesión de paciente, con su apellido para buscarlo."""
+    with SessionLocal.session_factory() as db:
+        return db.execute(
+            select(Usuario.id, Usuario.apellido)
+            .where(Usuario.tipo == TipoUsuario.PACIENTE, Usuario.id != muestra["paciente_id"])
+            .limit(1)
+        ).one()
+
+
+def _ids(cliente, q, **args):
+    r = cliente.get("/api/pacientes/buscar", query_string=dict(q=q, **args))
+    assert r.status_code == 200
+    return {fila["id"] for fila in r.get_json()}
+
+
+@pytest.mark.parametrize("rol", ("admin", "medico"))
+def test_medico_y_admin_encuentran_a_cualquiera(rol, clientes, otro):
+    assert otro.id in _ids(clientes[rol], otro.apellido.split()[0])
+
+
+def test_paciente_solo_se_encuentra_a_si_mismo(clientes, muestra, otro):
+    paciente = clientes["paciente"]
+    assert _ids(paciente, otro.apellido.split()[0]) <= {muestra["paciente_id"]}
+    assert _ids(paciente, muestra["q"]) == {muestra["paciente_id"]}
+    # Tampoco por un campo del expediente ni en la página de resultados
+    assert _ids(paciente, otro.apellido.split()[0], campo="notas_clinicas") <= {muestra["paciente_id"]}
+    r = paciente.get("/expedientes/buscar", query_string=dict(q=otro.apellido.split()[0]))
+    assert r.status_code == 200 and f"/expediente/{otro.id}\"" not in r.get_data(as_text=True)
+    assert paciente.get(f"/expediente/{otro.id}").status_code == 403
+
+
+def test_paciente_sin_sugerencias(clientes, muestra):
+    r = clientes["paciente"].get("/api/pacientes/sugerencias", query_string=dict(q=muestra["prefijo"]))
+    assert r.status_code == 403
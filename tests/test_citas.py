@@ -0,0 +1,116 @@
+"""
+Citas: la paginación por cursor que mezcla citas y citas_archivo, el
+mantenimiento de doctor_paciente en after_flush y los ETag de las listas.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from conftest import iniciar_sesion
+from models import Cita, CitaArchivada, DoctorPaciente, EstadoCita, Medico
+from utils import keyset_page
+
+
+def _recorrer(db, filtro, limit):
+    """Todas las páginas de keyset_page: [[(start_at, id, archivada)], ...]."""
+    paginas, cursor = [], None
+    while True:
+        citas, cursor = keyset_page(
+            db.query(Cita).filter(filtro(Cita)),
+            cursor,
+            limit,
+            archivo=db.query(CitaArchivada).filter(filtro(CitaArchivada)),
+        )
+        paginas.append([(c.start_at, c.id, c.archivada) for c in citas])
+        if cursor is None:
+            return paginas
+
+
+def _todas(db, filtro):
+    filas = db.execute(select(Cita.start_at, Cita.id).where(filtro(Cita))).all()
+    filas += db.execute(select(CitaArchivada.start_at, CitaArchivada.id).where(filtro(CitaArchivada))).all()
+    return sorted(map(tuple, filas), reverse=True)
+
+
+def test_keyset_mezcla_citas_y_archivo(db, muestra):
+    filtro = lambda modelo: modelo.medico_id == muestra["medico_id"]  # noqa: E731
+    paginas = _recorrer(db, filtro, 37)
+    vistas = [(start_at, cita_id) for pagina in paginas for start_at, cita_id, _ in pagina]
+    assert vistas == _todas(db, filtro)  # en orden, sin huecos ni repetidas
+    assert all(len(pagina) == 37 for pagina in paginas[:-1])
+    # Hay páginas que mezclan las dos tablas: ahí cruza el horizonte del archivo
+    assert any(len({archivada for *_, archivada in pagina}) == 2 for pagina in paginas)
+
+
+def test_keyset_desempata_por_id(db, muestra):
+    # Tres citas del paciente con el mismo inicio (con médicos distintos) y páginas de dos
+    paciente_id = muestra["paciente_id"]
+    inicio = datetime.now().replace(second=0, microsecond=0) + timedelta(days=400)
+    for medico_id in db.scalars(select(Medico.id).limit(3)):
+        db.add(Cita(medico_id=medico_id, paciente_id=paciente_id, start_at=inicio, end_at=inicio + timedelta(hours=1)))
+    db.flush()
+    filtro = lambda modelo: modelo.paciente_id == paciente_id  # noqa: E731
+    vistas = [(start_at, cita_id) for pagina in _recorrer(db, filtro, 2) for start_at, cita_id, _ in pagina]
+    assert vistas == _todas(db, filtro)
+
+
+def _par(db, medico_id, paciente_id):
+    return db.get(DoctorPaciente, (medico_id, paciente_id), populate_existing=True)
+
+
+def test_roster_en_after_flush(db, muestra):
+    medico_id, paciente_id = muestra["medico_id"], muestra["paciente_id"]
+    otro_medico = db.scalar(select(Medico.id).where(Medico.id != medico_id).limit(1))
+    inicio = datetime.now().replace(second=0, microsecond=0) + timedelta(days=500)
+    antes = _par(db, medico_id, paciente_id).pending_count
+
+    cita = Cita(medico_id=medico_id, paciente_id=paciente_id, start_at=inicio, end_at=inicio + timedelta(hours=1),
+                estado=EstadoCita.PENDIENTE)
+    db.add(cita)
+    db.flush()
+    par = _par(db, medico_id, paciente_id)
+    assert par.pending_count == antes + 1
+
+    cita.estado = EstadoCita.CANCELADA
+    db.flush()
+    assert _par(db, medico_id, paciente_id).pending_count == antes
+
+    # Cambio de médico: se recalculan el par anterior y el nuevo
+    cita.estado = EstadoCita.PENDIENTE
+    cita.medico_id = otro_medico
+    db.flush()
+    assert _par(db, medico_id, paciente_id).pending_count == antes
+    assert _par(db, otro_medico, paciente_id).next_visit is not None
+
+    db.delete(cita)
+    db.flush()
+    quedan = db.scalar(
+        select(func.count()).select_from(Cita).where(Cita.medico_id == otro_medico, Cita.paciente_id == paciente_id)
+    ) + db.scalar(
+        select(func.count()).select_from(CitaArchivada)
+        .where(CitaArchivada.medico_id == otro_medico, CitaArchivada.paciente_id == paciente_id)
+    )
+    # Sin citas con ese médico, el par desaparece
+    assert (_par(db, otro_medico, paciente_id) is not None) == bool(quedan)
+
+
+def test_etag_y_304(db, muestra):
+    cliente = iniciar_sesion("medico", muestra)
+    r = cliente.get("/citas")
+    assert r.status_code == 200 and r.headers["ETag"]
+    etag = r.headers["ETag"]
+    assert cliente.get("/citas", headers={"If-None-Match": etag}).status_code == 304
+
+    # Un registro nuevo no aparece en las citas del médico: el ETag no cambia
+    r = cliente.application.test_client().post("/register", data=dict(
+        nombre="Nuevo", apellido="Registro", email="nuevo.registro@bench.local", password="x" * 12,
+    ))
+    assert r.status_code == 302
+    assert cliente.get("/citas", headers={"If-None-Match": etag}).status_code == 304
+
+    # Editar una cita del médico sí lo cambia
+    cita = db.scalars(select(Cita).where(Cita.medico_id == muestra["medico_id"]).limit(1)).one()
+    cita.notas = "editada"
+    db.commit()
+    r = cliente.get("/citas", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["ETag"] != etag
@@ -0,0 +1,70 @@
+"""
+Presupuestos de consultas (@query_budget) y carga estricta de relaciones.
+
+Con HS_STRICT_LOADS=1 (conftest.py) una relación que no se cargó con
+joinedload/selectinload (raise_on_sql) o una vista que hace más consultas que
+su presupuesto (PresupuestoExcedido) hace fallar la prueba. Cada ruta con
+@query_budget se pide con cada rol: 200 donde el rol tiene acceso, 403 donde no.
+
+    python -m pytest -q tests
+"""
+import html
+import re
+
+import pytest
+
+from app import app
+from conftest import ROLES
+
+# Variantes de query string por endpoint; las demás rutas se piden sin argumentos
+CONSULTAS = {
+    "citas_fragmento": ("vista=citas", "vista=concluidas"),
+    "api_buscar_pacientes": ("q={q}",),
+    "api_sugerencias_pacientes": ("q={prefijo}",),
+    "expedientes_buscar": ("q={q}",),
+}
+# "endpoint" o "endpoint?consulta" que el rol no puede ver (403); las demás responden 200
+DENEGADAS = {
+    "admin": {"citas_fragmento?vista=concluidas", "doctor_concluidas", "doctor_consultas", "doctor_expedientes"},
+    "medico": set(),
+    "paciente": {
+        "api_sugerencias_pacientes?q={prefijo}",
+        "citas_fragmento?vista=concluidas",
+        "doctor_concluidas",
+        "doctor_consultas",
+        "doctor_expedientes",
+        "doctor_perfil",
+        "doctores_list",
+    },
+}
+SIGUIENTE = re.compile(r'data-next="([^"]+)"')
+
+
+def _rutas():
+    """(endpoint, regla) de las rutas GET con @query_budget."""
+    return sorted(
+        (regla.endpoint, regla.rule)
+        for regla in app.url_map.iter_rules()
+        if "GET" in regla.methods and hasattr(app.view_functions[regla.endpoint], "query_budget")
+    )
+
+
+def test_todas_las_rutas_con_presupuesto_tienen_caso():
+    assert len(_rutas()) >= 10
+
+
+@pytest.mark.parametrize("rol", ROLES)
+@pytest.mark.parametrize("endpoint,regla", _rutas())
+def test_presupuesto(endpoint, regla, rol, muestra, clientes):
+    url = regla.replace("<int:medico_id>", str(muestra["medico_id"])).replace(
+        "<int:paciente_id>", str(muestra["paciente_id"])
+    )
+    for consulta in CONSULTAS.get(endpoint, ("",)):
+        r = clientes[rol].get(url, query_string=consulta.format(**muestra))
+        denegada = endpoint in DENEGADAS[rol] or f"{endpoint}?{consulta}" in DENEGADAS[rol]
+        assert r.status_code == (403 if denegada else 200), f"{rol} GET {url}?{consulta}: {r.status_code}"
+        # Con scroll infinito también la página siguiente (ahí empiezan las citas archivadas)
+        siguiente = SIGUIENTE.search(r.get_data(as_text=True))
+        if siguiente:
+            r = clientes[rol].get(html.unescape(siguiente.group(1)))
+            assert r.status_code == 200, f"{rol} GET {siguiente.group(1)}: {r.status_code}"
@@ -1,10 +1,46 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, insert, or_
 from sqlalchemy.orm import Session
+from database import call_after_commit
 from models import Cita
+from interval_index import agenda_index
+from archive import archived_overlaps, archived_intervals
+from roster import refresh_pairs
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 50
+SERIES_MAX = int(os.environ.get("SERIES_MAX", 104))  # ocurrencias por serie (dos años semanales)
+OVERLAP_INDEX = os.environ.get("OVERLAP_INDEX", "1") == "1"
+OVERLAP_VERIFY = os.environ.get("OVERLAP_VERIFY", "0") == "1"
+
 
 def has_overlap(db: Session, medico_id: int, start_at, end_at, exclude_id: int | None = None) -> bool:
     """
     True si existe una cita traslapada para el mismo médico en [start_at, end_at).
+    Usa el índice en memoria; el SQL queda como respaldo y, con OVERLAP_VERIFY=1, como verificador.
+    Antes del horizonte del archivo también revisa citas_archivo.
     """
+    if archived_overlaps(db, medico_id, start_at, end_at):
+        return True
+    if OVERLAP_INDEX:
+        resultado = agenda_index.overlaps(db, medico_id, start_at, end_at, exclude_id)
+        if resultado is not None:
+            if OVERLAP_VERIFY:
+                esperado = sql_has_overlap(db, medico_id, start_at, end_at, exclude_id)
+                if esperado != resultado:
+                    log.warning("Índice de agenda inconsistente para médico %s; se recarga", medico_id)
+                    agenda_index.invalidate(medico_id)
+                    return esperado
+            return resultado
+    return sql_has_overlap(db, medico_id, start_at, end_at, exclude_id)
+
+
+def sql_has_overlap(db: Session, medico_id: int, start_at, end_at, exclude_id: int | None = None) -> bool:
+    """Misma pregunta que has_overlap resuelta con un EXISTS sobre citas."""
     q = db.query(Cita).filter(
         Cita.medico_id == medico_id,
         Cita.start_at < end_at,
@@ -13,3 +49,141 @@ def has_overlap(db: Session, medico_id: int, start_at, end_at, exclude_id: int |
     if exclude_id is not None:
         q = q.filter(Cita.id != exclude_id)
     return db.query(q.exists()).scalar()
+
+
+def next_free_slot(db: Session, medico_id: int, desde, duracion):
+    """Primer inicio >= desde con un hueco libre de 'duracion' en la agenda del médico."""
+    if OVERLAP_INDEX:
+        inicio = agenda_index.next_free(db, medico_id, desde, duracion)
+        if inicio is not None:
+            return inicio
+    inicio = desde
+    filas = (
+        db.query(Cita.start_at, Cita.end_at)
+        .filter(Cita.medico_id == medico_id, Cita.end_at > desde)
+        .order_by(Cita.start_at)
+        .yield_per(500)
+    )
+    for start_at, end_at in filas:
+        if start_at >= inicio + duracion:
+            break
+        inicio = max(inicio, end_at)
+    return inicio
+
+
+def busy_intervals(db: Session, medico_id: int, desde, hasta):
+    """[(start_at, end_at)] ordenados por inicio de las citas del médico que tocan [desde, hasta)."""
+    if OVERLAP_INDEX:
+        ocupado = agenda_index.busy(db, medico_id, desde, hasta)
+        if ocupado is not None:
+            return ocupado
+    return [
+        tuple(f)
+        for f in db.query(Cita.start_at, Cita.end_at)
+        .filter(Cita.medico_id == medico_id, Cita.start_at < hasta, Cita.end_at > desde)
+        .order_by(Cita.start_at)
+    ]
+
+
+# ----------------- SERIES DE CITAS -----------------
+def recurring_series(start_at, end_at, repeticiones: int, cada_dias: int = 7):
+    """[(start_at, end_at)] de la primera cita y sus repeticiones cada 'cada_dias'."""
+    paso = timedelta(days=cada_dias)
+    return [(start_at + paso * i, end_at + paso * i) for i in range(repeticiones)]
+
+
+def series_conflicts(db: Session, medico_id: int, ocurrencias) -> set[int]:
+    """
+    Índices de las ocurrencias (ordenadas por inicio) que se traslapan con citas
+    del médico. Una sola consulta trae las citas del rango completo de la serie
+    (dos si la serie empieza antes del horizonte del archivo); luego un barrido:
+    una ocurrencia choca si la cita de mayor fin entre las que empiezan antes de
+    que ella termine termina después de que ella empieza.
+    """
+    if not ocurrencias:
+        return set()
+    desde, hasta = ocurrencias[0][0], ocurrencias[-1][1]
+    filas = (
+        db.query(Cita.start_at, Cita.end_at)
+        .filter(
+            Cita.medico_id == medico_id,
+            Cita.start_at < hasta,
+            Cita.end_at > desde,
+        )
+        .order_by(Cita.start_at)
+        .all()
+    )
+    archivadas = archived_intervals(db, medico_id, desde, hasta)
+    if archivadas:
+        filas = sorted(filas + archivadas, key=lambda f: f.start_at)
+    conflictos = set()
+    j, max_fin = 0, None
+    for i, (inicio, fin) in enumerate(ocurrencias):
+        while j < len(filas) and filas[j].start_at < fin:
+            max_fin = filas[j].end_at if max_fin is None else max(max_fin, filas[j].end_at)
+            j += 1
+        if max_fin is not None and max_fin > inicio:
+            conflictos.add(i)
+    return conflictos
+
+
+def bulk_insert_citas(db: Session, filas) -> None:
+    """
+    Inserta citas (dicts de columnas) con un solo executemany. Al no pasar por
+    el unit of work, actualiza doctor_paciente en la misma transacción y
+    descarta las agendas en memoria de los médicos al confirmar.
+    """
+    if not filas:
+        return
+    db.execute(insert(Cita), filas)
+    refresh_pairs(db.connection(bind_arguments={"primary": True}), {(f["medico_id"], f["paciente_id"]) for f in filas})
+    for medico_id in {f["medico_id"] for f in filas}:
+        call_after_commit(db, lambda medico_id=medico_id: agenda_index.invalidate(medico_id))
+
+
+# ----------------- PAGINACIÓN POR CURSOR -----------------
+def encode_cursor(cita: Cita) -> str:
+    """Cursor opaco con la posición (start_at, id) de la última cita mostrada."""
+    return f"{cita.start_at.isoformat()}_{cita.id}"
+
+
+def decode_cursor(cursor: str | None):
+    """Devuelve (start_at, id) o None si el cursor falta o es inválido."""
+    if not cursor:
+        return None
+    try:
+        start_raw, id_raw = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(start_raw), int(id_raw)
+    except ValueError:
+        return None
+
+
+def _keyset_rows(query, pos, limit):
+    modelo = query.column_descriptions[0]["entity"]  # Cita o CitaArchivada
+    if pos:
+        start_at, cita_id = pos
+        query = query.filter(
+            modelo.start_at <= start_at,  # cota que SQLite usa como rango del índice; el OR no la da
+            or_(
+                modelo.start_at < start_at,
+                and_(modelo.start_at == start_at, modelo.id < cita_id),
+            ),
+        )
+    return query.order_by(modelo.start_at.desc(), modelo.id.desc()).limit(limit + 1).all()
+
+
+def keyset_page(query, cursor: str | None, limit: int = PAGE_SIZE, archivo=None):
+    """
+    Página descendente por (start_at, id) a partir del cursor.
+    Devuelve (citas, siguiente_cursor); el costo no depende de la página pedida.
+    'archivo' es la misma consulta sobre CitaArchivada: cada tabla aporta su
+    página y se mezclan (los ids no se repiten entre tablas).
+    """
+    pos = decode_cursor(cursor)
+    rows = _keyset_rows(query, pos, limit)
+    if archivo is not None:
+        rows = sorted(rows + _keyset_rows(archivo, pos, limit), key=lambda c: (c.start_at, c.id), reverse=True)
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+